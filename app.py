@@ -1,91 +1,161 @@
+import hmac
 import os
-from datetime import datetime
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
 import json
-from typing import Optional
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from concurrent.futures import ThreadPoolExecutor
+from flask import (Flask, Response, copy_current_request_context, g, render_template, request, jsonify, redirect,
+                   stream_with_context, url_for)
 from dotenv import load_dotenv
-from supabase import create_client, Client
-import google.generativeai as genai
-from PIL import Image
-import io
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import export
+from caching import TriageCache
+from gemini_client import CircuitBreaker, CircuitOpenError, GeminiClient, GeminiClientError
+from image_pipeline import get_stats as image_stats, preprocess_image, thumbnail_name
+from local_store import LocalRecordStore
+from media_store import MAX_IMAGE_BYTES, MAX_UPLOAD_BYTES, MAX_VOICE_BYTES, MediaStore, MediaTooLarge
+from metrics import FALLBACKS, REQUEST_SECONDS, registry as metrics_registry, route_context, set_route, timed
+from model_registry import ModelRegistry, ModelUnavailable
+from prompt_builder import GENERATION_CONFIG, build_prompt, parse_result, record_usage, response_text
+from record_repository import RecordRepository
+from request_plan import RequestPlan
+from rollups import RemoteRollups, TriageRollups
+from sync_engine import SyncEngine, start_background_sync
+from triage_queue import QUEUED, RETRYING, RUNNING, QueueFull, RetryLater, TriageQueue
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
+# Oversized requests get a 413 before the multipart body is parsed.
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+LOCAL_RECORDS_FILE = os.path.join(app.root_path, 'data', 'local_records.jsonl')
+local_store = LocalRecordStore(LOCAL_RECORDS_FILE, fsync=os.environ.get('LOCAL_STORE_FSYNC', '1') != '0')
+# Dashboard counts, kept current as records are appended; built from the file once per process.
+local_rollups = TriageRollups()
+local_store.subscribe(local_rollups)
+remote_rollups = RemoteRollups(ttl=int(os.environ.get('DASHBOARD_ROLLUP_TTL', '300')))
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
-supabase: Optional[Client] = None
-supabase_admin: Optional[Client] = None
-if SUPABASE_URL and SUPABASE_KEY:
+# Clients are created on first use, not at import: importing this module (a gunicorn
+# worker booting, or a script pulling in one helper) must not wait on the network.
+# The supabase and google.generativeai packages are only imported at that point too.
+supabase = None
+supabase_admin = None
+_supabase_ready = False
+_genai = None
+model_registry = None
+_init_lock = threading.RLock()
+
+
+def get_supabase():
+    """Return the shared Supabase client, creating it on first call. None in demo mode."""
+    global supabase, _supabase_ready
+    if _supabase_ready or supabase is not None:
+        return supabase
+    with _init_lock:
+        if not _supabase_ready and supabase is None:
+            if SUPABASE_URL and SUPABASE_KEY:
+                try:
+                    from supabase import create_client
+                    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+                except Exception as e:
+                    print(f"[WARN] Could not create Supabase client: {e}")
+                    supabase = None
+            else:
+                print("[INFO] SUPABASE_URL or SUPABASE_KEY not set. Running in demo mode with no database.")
+            _supabase_ready = True
+    return supabase
+
+
+def get_genai():
+    """Import and configure google.generativeai on first call."""
+    global _genai
+    if _genai is None:
+        with _init_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=GEMINI_API_KEY)
+                _genai = genai
+    return _genai
+
+
+def get_model_registry():
+    """Shared model selection; lists models on first use, then only on TTL expiry or a 404."""
+    global model_registry
+    if model_registry is None:
+        with _init_lock:
+            if model_registry is None:
+                model_registry = ModelRegistry(get_genai(), ttl=int(os.environ.get('GEMINI_MODEL_TTL', '3600')))
+    return model_registry
+
+
+# One client per process so every Gemini call shares the same rate limits and circuit breaker.
+gemini_client = GeminiClient(
+    requests_per_minute=int(os.environ.get('GEMINI_RPM', '15')),
+    tokens_per_minute=int(os.environ.get('GEMINI_TPM', '250000')),
+    max_retries=int(os.environ.get('GEMINI_MAX_RETRIES', '3')),
+    deadline=float(os.environ.get('GEMINI_DEADLINE', '30')),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get('GEMINI_BREAKER_THRESHOLD', '5')),
+        reset_timeout=float(os.environ.get('GEMINI_BREAKER_RESET', '30')),
+    ),
+)
+
+# Identical resubmissions (flaky connections) reuse the earlier diagnosis instead of a new Gemini call.
+triage_cache = TriageCache(
+    max_entries=int(os.environ.get('TRIAGE_CACHE_SIZE', '512')),
+    ttl=int(os.environ.get('TRIAGE_CACHE_TTL', '86400')),
+    disk_dir=os.path.join(app.root_path, 'data', 'triage_cache') if os.environ.get('TRIAGE_CACHE_DISK', '1') != '0' else None,
+)
+
+
+def _fetch_image(image_url):
+    """Download an already-stored image; only used when re-analysing an existing record."""
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    except Exception as e:
-        print(f"[WARN] Could not create Supabase client: {e}")
-        supabase = None
-else:
-    print("[INFO] SUPABASE_URL or SUPABASE_KEY not set. Running in demo mode with no database.")
-
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    # Log available models on startup for debugging
-    try:
-        available_models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-        print(f"[INFO] Available Gemini models: {available_models[:5]}...")  # Limit to first 5 for brevity
-        if 'models/gemini-1.5-flash' not in available_models:
-            print("[WARN] 'gemini-1.5-flash' not available. Check API key or region.")
-    except Exception as e:
-        print(f"[WARN] Could not list models: {e}")
+        import requests
+        r = requests.get(image_url, timeout=10)
+        r.raise_for_status()
+        return r.content, r.headers.get('content-type') or 'image/jpeg'
+    except Exception as img_e:
+        print(f"[WARN] Could not download image for vision analysis: {img_e}")
+        return None, None
+
 
+def _prepare_diagnosis(symptoms_text, image_url, patient_info, image_data=None, image_mime_type=None):
+    """Everything before the Gemini call: model selection, prompt and cache lookup.
 
-def get_ai_diagnosis_from_api(symptoms_text, image_url, patient_info):
+    Returns (result, call). ``result`` is set when no call is needed (simulation mode,
+    no model, cache hit); otherwise ``call`` holds what `_diagnosis_steps` needs to make
+    the request and then pass to `_finish_diagnosis` or `_failed_diagnosis`.
+    """
     if not GEMINI_API_KEY:
         return {
             'main_diagnosis': 'Simulation Mode (No API Key)',
             'confidence': 75,
             'triage_level': 'URGENT',
             'explanation': 'API Key not found. This is a simulated response. Please provide a Gemini API key in the .env file for real analysis.'
-        }
-
-    # Select a supported model dynamically. Prefer stable/latest model names available in the account.
-    preferred_candidates = [
-        'models/gemini-pro-latest',
-        'models/gemini-flash-latest',
-        'models/gemini-2.5-flash',
-        'models/gemini-2.5-pro',
-        'models/gemini-2.0-flash',
-    ]
-
-    model = None
-    try:
-        models = list(genai.list_models())
-        available = {m.name for m in models}
-        chosen = None
-        for candidate in preferred_candidates:
-            if candidate in available:
-                chosen = candidate
-                break
-
-        if not chosen:
-            for m in models:
-                if getattr(m, 'supported_generation_methods', None) and 'generateContent' in m.supported_generation_methods:
-                    chosen = m.name
-                    break
-
-        if not chosen:
-            print('[ERROR] No model supporting generateContent is available for this API key.')
-            return {
-                'main_diagnosis': 'AI Unavailable',
-                'confidence': 0,
-                'triage_level': 'URGENT',
-                'explanation': 'No generative model available in your account. Please verify the API key and model access.'
-            }
+        }, None
 
-        print(f"[INFO] Using generative model: {chosen}")
-        model = genai.GenerativeModel(chosen)
+    try:
+        with timed('model_selection'):
+            registry = get_model_registry()
+            chosen, model = registry.get()
+    except ModelUnavailable:
+        print('[ERROR] No model supporting generateContent is available for this API key.')
+        return {
+            'main_diagnosis': 'AI Unavailable',
+            'confidence': 0,
+            'triage_level': 'URGENT',
+            'explanation': 'No generative model available in your account. Please verify the API key and model access.'
+        }, None
     except Exception as e:
         print(f"[ERROR] Failed selecting/initializing model: {e}")
         return {
@@ -93,186 +163,579 @@ def get_ai_diagnosis_from_api(symptoms_text, image_url, patient_info):
             'confidence': 0,
             'triage_level': 'URGENT',
             'explanation': f'Unable to initialize AI model. Error: {e}'
-        }
+        }, None
+
+    if image_url and not image_data:
+        image_data, image_mime_type = _fetch_image(image_url)
+
+    prompt = build_prompt(symptoms_text, patient_info, image_url=image_url, has_image=bool(image_data))
+    if prompt.trimmed_chars:
+        FALLBACKS.inc(kind='prompt_trimmed')
+        print(f"[INFO] Trimmed {prompt.trimmed_chars} characters of symptoms to fit the prompt token budget")
+
+    # Key on the prompt without the per-upload image URL, so a resubmitted form is a hit.
+    cache_key = TriageCache.make_key(chosen, prompt.cache_text, image_data)
+    cached = triage_cache.get(cache_key)
+    if cached is not None:
+        print(f"[INFO] Triage cache hit ({cache_key[:12]})")
+        return dict(cached), None
+
+    image_part = {'mime_type': image_mime_type or 'image/jpeg', 'data': image_data} if image_data else None
+    return None, {'registry': registry, 'chosen': chosen, 'model': model, 'prompt': prompt,
+                  'cache_key': cache_key, 'image_part': image_part,
+                  'symptoms_text': symptoms_text, 'patient_info': patient_info}
+
+
+def _text_only_call(call):
+    """``call`` redone without its image, for when the vision request fails.
+
+    The prompt is rebuilt so it no longer refers to an attached image (same budget and
+    schema), and the answer is not cached: it was not made from the image.
+    """
+    prompt = build_prompt(call['symptoms_text'], call['patient_info'])
+    return {**call, 'prompt': prompt, 'image_part': None, 'cache_key': None}
+
+
+def _finish_diagnosis(call, response):
+    """Record token usage and parse the model's reply. Returns (result, parsed); only a parsed result is cached."""
+    call['registry'].report_success(call['chosen'])
+    record_usage(response, call['prompt'])
+    response_body = response_text(response)
+    with timed('json_parse'):
+        ai_result = parse_result(response_body)
+    if ai_result is not None:
+        return ai_result, True
+    FALLBACKS.inc(kind='parse_error')
+    print(f"[WARN] Invalid JSON in response: {response_body[:200]}...")
+    return {
+        'main_diagnosis': 'Parsing Error - Incomplete Analysis',
+        'confidence': 50,
+        'triage_level': 'URGENT',
+        'explanation': 'Recommendation: Response format issue. Proceed with caution and refer to a clinic.'
+    }, False
+
+
+# For a patient the model never saw (throttled, upstream down, out of time): never a reassuring level.
+NOT_ASSESSED_RESULT = {
+    'main_diagnosis': 'AI Assessment Unavailable',
+    'confidence': 0,
+    'triage_level': 'URGENT',
+    'explanation': 'Recommendation: The AI service is busy and could not assess this patient. Proceed with manual assessment and refer if in doubt.'
+}
+
 
-    prompt_parts = [
-        "You are an expert medical AI assistant for Community Health Workers in rural India.",
-        "Your goal is to provide a preliminary analysis and triage recommendation based on patient data.",
-        "Do NOT give a definitive diagnosis. Your response must be cautious and guide the health worker.",
-        "Keep responses concise to respect rate limits.",
-        f"Patient Information: Age: {patient_info.get('age', 'N/A')}, Gender: {patient_info.get('gender', 'N/A')}.",
-        f"Text Symptoms from Patient/Worker: {symptoms_text if symptoms_text else 'No text symptoms provided.'}",
-        "---",
-        "Analyze the provided information and respond ONLY with a single, valid JSON object in the following format (no extra text, code blocks, or explanations):",
-        """
-        {
-          "main_diagnosis": "Most probable condition (e.g., 'Possible Bacterial Skin Infection')",
-          "confidence": <An integer confidence score between 50 and 95>,
-          "triage_level": "<One of: 'CRITICAL', 'URGENT', or 'STABLE'>",
-          "explanation": "<A brief, simple explanation and recommendation in 1-2 sentences for the health worker. Start with 'Recommendation:' and advise on next steps (e.g., refer immediately, monitor symptoms, provide basic care).>"
+def _failed_diagnosis(call, e):
+    """The fallback result for a Gemini call that raised ``e``."""
+    error_str = str(e)
+    print(f"Gemini API call failed: {error_str}")
+    if isinstance(e, CircuitOpenError):
+        FALLBACKS.inc(kind='circuit_open')
+        return {
+            'main_diagnosis': 'AI Service Unavailable',
+            'confidence': 0,
+            'triage_level': 'URGENT',
+            'explanation': 'Recommendation: The AI service is temporarily unavailable. Proceed with manual assessment and refer if in doubt.'
+        }
+    if isinstance(e, GeminiClientError):
+        # Throttled locally, retries exhausted or out of time: the model never assessed the patient.
+        FALLBACKS.inc(kind='not_assessed')
+        return dict(NOT_ASSESSED_RESULT)
+    if call['registry'].report_failure(call['chosen'], e):
+        FALLBACKS.inc(kind='model_not_found')
+        return {
+            'main_diagnosis': 'API Model Error',
+            'confidence': 0,
+            'triage_level': 'URGENT',
+            'explanation': 'Recommendation: Model not accessible (e.g., 404 error). Manual triage required—seek professional help now.'
+        }
+    elif "quota" in error_str.lower() or "rate limit" in error_str.lower():
+        FALLBACKS.inc(kind='rate_limit')
+        return {
+            'main_diagnosis': 'Rate Limit Exceeded',
+            'confidence': 0,
+            'triage_level': 'URGENT',
+            'explanation': 'Recommendation: API quota reached, so the AI could not assess this patient. Proceed with manual assessment.'
         }
-        """,
-        "---"
-    ]
+    FALLBACKS.inc(kind='ai_error')
+    return {
+        'main_diagnosis': 'AI Analysis Error',
+        'confidence': 50,
+        'triage_level': 'URGENT',
+        'explanation': 'Recommendation: The AI service could not process the request. Please proceed with manual assessment.'
+    }
 
-    if image_url:
-        prompt_parts.insert(5, f"Visual symptoms from uploaded image at: {image_url}")
+
+def _generate_step(call, contents, deadline):
+    return gemini_client.generate, gemini_client.generate_async, (call['model'], contents), {
+        'deadline': deadline, 'generation_config': GENERATION_CONFIG}
+
+
+def _diagnosis_steps(symptoms_text, image_url, patient_info, image_data=None, image_mime_type=None,
+                     deadline=None, raise_unassessed=False):
+    """The diagnosis control flow, shared by `get_ai_diagnosis_from_api` and asgi.py.
+
+    A generator: it yields each blocking step as ``(fn, async_fn, args, kwargs)`` and is sent
+    the step's result (or thrown its exception). `_run_steps` calls ``fn``; the async driver
+    awaits ``async_fn``, or runs ``fn`` in a thread when there is none. Returns the result.
+    """
+    ai_result, call = yield _prepare_diagnosis, None, (symptoms_text, image_url, patient_info, image_data,
+                                                       image_mime_type), {}
+    if call is None:
+        return ai_result
 
     try:
-        prompt_text = "\n".join(prompt_parts)
-        if image_url:
-            try:
-                import requests
-                from io import BytesIO
-                r = requests.get(image_url, timeout=10)
-                r.raise_for_status()
-                image_bytes = BytesIO(r.content)
-            except Exception as img_e:
-                print(f"[WARN] Could not download image for vision analysis: {img_e}")
-                image_bytes = None
-
-            if image_bytes:
+        with timed('generate_content'):
+            if call['image_part']:
                 try:
-                    response = model.generate_content([prompt_text, image_bytes])
+                    response = yield _generate_step(call, [call['prompt'].text, call['image_part']], deadline)
+                except GeminiClientError:
+                    # Rate limited / upstream down: a text-only retry would fail the same way.
+                    raise
                 except Exception:
-                    response = model.generate_content(prompt_text)
+                    # Fallback to text-only if vision call fails
+                    FALLBACKS.inc(kind='vision_text_only')
+                    call = _text_only_call(call)
+                    response = yield _generate_step(call, call['prompt'].text, deadline)
             else:
-                response = model.generate_content(prompt_text)
-        else:
-            response = model.generate_content(prompt_text)
+                response = yield _generate_step(call, call['prompt'].text, deadline)
+        ai_result, parsed = _finish_diagnosis(call, response)
+    except Exception as e:
+        if raise_unassessed and isinstance(e, GeminiClientError):
+            raise
+        return _failed_diagnosis(call, e)
+    if parsed and call['cache_key']:
+        try:
+            yield triage_cache.put, None, (call['cache_key'], ai_result), {}
+        except Exception as e:
+            print(f"[WARN] Could not cache triage result: {e}")
+    return ai_result
+
 
-        cleaned_response = getattr(response, 'text', str(response)).strip().replace('```json', '').replace('```', '').replace('json', '')
+def _run_steps(steps):
+    """Drive a `_diagnosis_steps` generator with blocking calls; returns its result."""
+    value, error = None, None
+    while True:
         try:
-            ai_result = json.loads(cleaned_response)
-        except json.JSONDecodeError:
-            print(f"[WARN] Invalid JSON in response: {cleaned_response[:200]}...")
-            ai_result = {
-                'main_diagnosis': 'Parsing Error - Incomplete Analysis',
-                'confidence': 50,
-                'triage_level': 'URGENT',
-                'explanation': 'Recommendation: Response format issue. Proceed with caution and refer to a clinic.'
-            }
-        return ai_result
-    except Exception as e:
-        error_str = str(e)
-        print(f"Gemini API call failed: {error_str}")
-        if "404" in error_str or "not found" in error_str.lower():
-            return {
-                'main_diagnosis': 'API Model Error',
-                'confidence': 0,
-                'triage_level': 'URGENT',
-                'explanation': 'Recommendation: Model not accessible (e.g., 404 error). Manual triage required—seek professional help now.'
-            }
-        elif "quota" in error_str.lower() or "rate limit" in error_str.lower():
-            return {
-                'main_diagnosis': 'Rate Limit Exceeded',
-                'confidence': 0,
-                'triage_level': 'STABLE',
-                'explanation': 'Recommendation: API quota reached. Wait and retry, or use manual assessment.'
-            }
-        return {
-            'main_diagnosis': 'AI Analysis Error',
-            'confidence': 50,
-            'triage_level': 'URGENT',
-            'explanation': 'Recommendation: The AI service could not process the request. Please proceed with manual assessment.'
-        }
+            fn, _, args, kwargs = steps.throw(error) if error else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            value = fn(*args, **kwargs)
+        except Exception as e:
+            error = e
 
 
-def _load_local_records():
-    """Return list of records saved in data/local_records.jsonl (each line is a JSON object)."""
-    data_dir = os.path.join(app.root_path, 'data')
-    local_file = os.path.join(data_dir, 'local_records.jsonl')
-    records = []
-    try:
-        if os.path.exists(local_file):
-            with open(local_file, 'r', encoding='utf-8') as fh:
-                for line in fh:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        records.append(json.loads(line))
-                    except Exception:
-                        continue
-    except Exception as ex:
-        print(f"[WARN] Could not read local records: {ex}")
-    return records
+def get_ai_diagnosis_from_api(symptoms_text, image_url, patient_info, image_data=None, image_mime_type=None,
+                              deadline=None, raise_unassessed=False):
+    """Ask Gemini for a triage suggestion.
+
+    Pass the uploaded bytes as `image_data` when they are still in memory; `image_url`
+    is only downloaded when no bytes are given (e.g. re-analysis of a stored record).
+    `deadline` caps the Gemini call in seconds (defaults to GEMINI_DEADLINE).
+    With `raise_unassessed`, a GeminiClientError (the model never saw the patient) is
+    raised for the caller to retry instead of being turned into a fallback result.
+    """
+    return _run_steps(_diagnosis_steps(symptoms_text, image_url, patient_info, image_data, image_mime_type,
+                                       deadline, raise_unassessed))
 
 
 def _find_local_record(record_id):
     if not record_id:
         return None
-    for r in _load_local_records():
-        if str(r.get('id')) == str(record_id):
-            return r
+    return local_store.get(record_id)
+
+
+# Shared by the result and ABDM pages; /analyze puts new records so the redirect is a cache hit.
+record_repository = RecordRepository(
+    get_supabase, local_store,
+    max_entries=int(os.environ.get('RECORD_CACHE_SIZE', '1024')),
+    ttl=int(os.environ.get('RECORD_CACHE_TTL', '300')),
+)
+
+
+PENDING_RESULT_FIELDS = {
+    'ai_diagnosis': 'Analysis in progress',
+    'confidence': None,
+    'triage_level': 'PENDING',
+    'explanation': 'The AI analysis is still running. Refresh this page in a few seconds.',
+}
+
+
+def _ai_result_fields(ai_result):
+    """Map a diagnosis result onto the patient_records columns."""
+    # Defensive: ensure ai_result is a dict to avoid NoneType errors
+    if not isinstance(ai_result, dict):
+        print(f"[WARN] ai_result unexpected type: {type(ai_result)}. Falling back to default result.")
+        ai_result = {
+            'main_diagnosis': 'AI Unavailable',
+            'confidence': 0,
+            'triage_level': 'URGENT',
+            'explanation': 'Recommendation: AI did not return a valid response.'
+        }
+    return {
+        'ai_diagnosis': ai_result.get('main_diagnosis'),
+        'confidence': ai_result.get('confidence'),
+        'triage_level': ai_result.get('triage_level'),
+        'explanation': ai_result.get('explanation'),
+    }
+
+
+def _records_saved(records_to_insert, rows):
+    """Bookkeeping after a database insert. Returns the new ids, or None if ``rows`` does not match the input."""
+    rows = rows if isinstance(rows, list) else []
+    if len(rows) != len(records_to_insert) or not all(row.get('id') for row in rows):
+        return None
+    for record, row in zip(records_to_insert, rows):
+        saved = {**record, **row}
+        remote_rollups.add(saved)
+        record_repository.put(saved)
+    return [row['id'] for row in rows]
+
+
+def _save_records_locally(records_to_insert):
+    """Append rows to the local store in one write. Returns their new ids, or None on failure."""
+    FALLBACKS.inc(kind='local_save')
+    try:
+        now = datetime.utcnow()
+        # Distinct timestamps keep the (created_at, id) order of a batch stable for paging.
+        local_records = [{**record, 'id': str(uuid.uuid4()), 'created_at': (now + timedelta(microseconds=i)).isoformat()}
+                         for i, record in enumerate(records_to_insert)]
+        with timed('local_save'):
+            local_store.append_many(local_records)
+        for record in local_records:
+            record_repository.put(record)
+        print(f"[INFO] Saved {len(local_records)} record(s) locally to {local_store.path}: "
+              f"{', '.join(r['id'] for r in local_records[:3])}{'...' if len(local_records) > 3 else ''}")
+        return [r['id'] for r in local_records]
+    except Exception as ex:
+        print(f"[ERROR] Failed to save record locally: {ex}")
     return None
 
+
+def _save_records(records_to_insert):
+    """Insert rows into patient_records in one request, falling back to one append to the local store.
+
+    Returns (record_ids, stored_locally) with ids in input order; record_ids is None if both failed.
+    """
+    db_client = supabase_admin or get_supabase()
+    if db_client:
+        try:
+            with timed('record_insert'):
+                response = db_client.table('patient_records').insert(records_to_insert).execute()
+            print(f"[DEBUG] insert response: {getattr(response, 'error', response)}")
+            record_ids = _records_saved(records_to_insert, response.data)
+            if record_ids:
+                return record_ids, False
+        except Exception as ex:
+            print(f"[ERROR] insert failed: {ex}")
+    # Fallback: if DB insert failed or no Supabase client, save records locally
+    record_ids = _save_records_locally(records_to_insert)
+    return record_ids, record_ids is not None
+
+
+def _save_record(record_to_insert):
+    """Insert into patient_records, falling back to the local store.
+
+    Returns (record_id, stored_locally); record_id is None if both failed.
+    """
+    record_ids, stored_locally = _save_records([record_to_insert])
+    return (record_ids[0] if record_ids else None), stored_locally
+
+
+def _update_record(record_id, fields, local):
+    """Write diagnosis fields back to a saved record."""
+    if local:
+        existing = local_store.get(record_id) or {'id': record_id}
+        # Appending a newer version is enough: the store serves the latest line for an id.
+        local_store.append({**existing, **fields})
+        record_repository.put({**existing, **fields})
+        return
+    db_client = supabase_admin or get_supabase()
+    response = db_client.table('patient_records').update(fields).eq('id', record_id).execute()
+    if response.data and isinstance(response.data, list):
+        # Only claimed PENDING rows are updated, so that is the version the counts hold.
+        remote_rollups.add({**response.data[0], **fields}, previous={**response.data[0], 'triage_level': 'PENDING'})
+        record_repository.put({**response.data[0], **fields})
+    else:
+        record_repository.invalidate(record_id)
+
+
+# A claim older than this is assumed to belong to a worker that died mid-diagnosis.
+TRIAGE_CLAIM_TTL = float(os.environ.get('TRIAGE_CLAIM_TTL', '600'))
+_claims_lock = threading.Lock()
+
+
+def _claim_local_job(record_id):
+    """Claim a locally stored PENDING record via data/triage_claims/<id>, serialised by an flock."""
     try:
-        # The SDK exposes `generate_content` which can accept either a prompt string or a list.
-        # When including images, pass the prompt and the image bytes via the SDK's supported interfaces.
-        # For text-only, provide the joined prompt.
-        prompt_text = "\n".join(prompt_parts)
-        if image_url:
-            # Download image bytes and let the model handle vision if supported
+        import fcntl
+    except ImportError:
+        fcntl = None
+    claims_dir = os.path.join(app.root_path, 'data', 'triage_claims')
+    claim_path = os.path.join(claims_dir, f'{record_id}.claim')
+    with _claims_lock:
+        os.makedirs(claims_dir, exist_ok=True)
+        with open(os.path.join(claims_dir, '.lock'), 'w') as lock_fh:
+            if fcntl:
+                fcntl.flock(lock_fh, fcntl.LOCK_EX)
             try:
-                import requests
-                from io import BytesIO
-                r = requests.get(image_url, timeout=10)
-                r.raise_for_status()
-                image_bytes = BytesIO(r.content)
-            except Exception as img_e:
-                print(f"[WARN] Could not download image for vision analysis: {img_e}")
-                image_bytes = None
-
-            if image_bytes:
-                # Some SDK versions accept a list [prompt_text, image_bytes] or attach the image via the `inputs` param.
-                try:
-                    response = model.generate_content([prompt_text, image_bytes])
-                except Exception:
-                    # Fallback to text-only if vision call fails
-                    response = model.generate_content(prompt_text)
-            else:
-                response = model.generate_content(prompt_text)
-        else:
-            response = model.generate_content(prompt_text)
+                if time.time() - os.path.getmtime(claim_path) < TRIAGE_CLAIM_TTL:
+                    return False
+            except OSError:
+                pass
+            with open(claim_path, 'w') as fh:
+                fh.write(str(os.getpid()))
+    existing = local_store.get(record_id)
+    if existing and existing.get('triage_level') != 'PENDING':
+        _release_local_job(record_id)
+        return False
+    return True
 
-        cleaned_response = getattr(response, 'text', str(response)).strip().replace('```json', '').replace('```', '').replace('json', '')
-        # Robust JSON parsing with error handling
-        try:
-            ai_result = json.loads(cleaned_response)
-        except json.JSONDecodeError:
-            print(f"[WARN] Invalid JSON in response: {cleaned_response[:200]}...")
-            # Fallback: Parse if it's almost valid or simulate
-            ai_result = {
-                'main_diagnosis': 'Parsing Error - Incomplete Analysis',
-                'confidence': 50,
-                'triage_level': 'URGENT',
-                'explanation': 'Recommendation: Response format issue. Proceed with caution and refer to a clinic.'
-            }
-        return ai_result
+
+def _release_local_job(record_id):
+    try:
+        os.remove(os.path.join(app.root_path, 'data', 'triage_claims', f'{record_id}.claim'))
+    except OSError:
+        pass
+
+
+def _claim_remote_job(record_id):
+    """Atomically mark a Supabase record as claimed if it is still PENDING and unclaimed (or the claim is stale)."""
+    db_client = supabase_admin or get_supabase()
+    if not db_client:
+        return True
+    now = datetime.utcnow()
+    stale = (now - timedelta(seconds=TRIAGE_CLAIM_TTL)).isoformat()
+    try:
+        response = db_client.table('patient_records').update({'claimed_at': now.isoformat()}).eq(
+            'id', record_id).eq('triage_level', 'PENDING').or_(
+            f'claimed_at.is.null,claimed_at.lt."{stale}"').execute()
     except Exception as e:
-        error_str = str(e)
-        print(f"Gemini API call failed: {error_str}")
-        if "404" in error_str or "not found" in error_str.lower():
-            return {
-                'main_diagnosis': 'API Model Error',
-                'confidence': 0,
-                'triage_level': 'URGENT',
-                'explanation': 'Recommendation: Model not accessible (e.g., 404 error). Manual triage required—seek professional help now.'
-            }
-        elif "quota" in error_str.lower() or "rate limit" in error_str.lower():
-            return {
-                'main_diagnosis': 'Rate Limit Exceeded',
-                'confidence': 0,
-                'triage_level': 'STABLE',
-                'explanation': 'Recommendation: API quota reached. Wait and retry, or use manual assessment.'
+        # Most likely the claimed_at column is missing (supabase_init not re-run): run unclaimed, as before.
+        print(f"[WARN] Could not claim triage job {record_id}: {e}")
+        return True
+    return bool(response.data)
+
+
+def _release_remote_job(record_id):
+    """Drop our claim on a still-PENDING Supabase record so its retry can claim it again."""
+    db_client = supabase_admin or get_supabase()
+    if not db_client:
+        return
+    try:
+        db_client.table('patient_records').update({'claimed_at': None}).eq(
+            'id', record_id).eq('triage_level', 'PENDING').execute()
+    except Exception as e:
+        print(f"[WARN] Could not release triage job {record_id}: {e}")
+
+
+def _run_triage_job(record_id, job):
+    # Recovery in another worker may have queued the same record; only the claimant runs it.
+    local = job.get('local')
+    if not (_claim_local_job(record_id) if local else _claim_remote_job(record_id)):
+        print(f"[INFO] Triage job {record_id} already claimed or finished; skipping")
+        return
+    try:
+        _diagnose_job(record_id, job)
+    finally:
+        if local:
+            _release_local_job(record_id)
+
+
+# A job the model could not assess (throttled, breaker open) stays PENDING and is retried with
+# doubling delays; after the last attempt it is saved as URGENT for manual assessment.
+TRIAGE_RETRY_ATTEMPTS = int(os.environ.get('TRIAGE_RETRY_ATTEMPTS', '5'))
+TRIAGE_RETRY_DELAY = float(os.environ.get('TRIAGE_RETRY_DELAY', '30'))
+TRIAGE_RETRY_MAX_DELAY = float(os.environ.get('TRIAGE_RETRY_MAX_DELAY', '600'))
+
+
+def _diagnose_job(record_id, job):
+    # Jobs queued by /analyze carry the uploaded bytes; recovered jobs only have the stored URL.
+    try:
+        ai_result = get_ai_diagnosis_from_api(job.get('symptoms_text'), job.get('image_url'),
+                                              job.get('patient_info') or {}, job.get('image_data'),
+                                              job.get('image_mime_type'), raise_unassessed=True)
+    except GeminiClientError as e:
+        job['attempts'] = job.get('attempts', 0) + 1
+        if job['attempts'] < TRIAGE_RETRY_ATTEMPTS:
+            if not job.get('local'):
+                _release_remote_job(record_id)
+            FALLBACKS.inc(kind='triage_retry')
+            raise RetryLater(min(TRIAGE_RETRY_DELAY * 2 ** (job['attempts'] - 1), TRIAGE_RETRY_MAX_DELAY), str(e))
+        print(f"[WARN] Giving up on AI triage for {record_id} after {job['attempts']} attempts: {e}")
+        FALLBACKS.inc(kind='not_assessed')
+        ai_result = dict(NOT_ASSESSED_RESULT)
+    _update_record(record_id, _ai_result_fields(ai_result), job.get('local'))
+    print(f"[INFO] Triage complete for {record_id}")
+
+
+TRIAGE_ASYNC = os.environ.get('TRIAGE_ASYNC', '1') != '0'
+def _queued_triage_job(record_id, job):
+    with route_context('triage_worker'):
+        _run_triage_job(record_id, job)
+
+
+triage_queue = TriageQueue(
+    _queued_triage_job,
+    workers=int(os.environ.get('TRIAGE_WORKERS', '4')),
+    max_depth=int(os.environ.get('TRIAGE_QUEUE_DEPTH', '100')),
+)
+
+
+def _recover_pending_jobs():
+    """Re-queue records left PENDING by a previous process (e.g. a restart mid-diagnosis).
+
+    Only one worker at a time scans, under data/triage_recovery.lock. Records that are
+    still being diagnosed elsewhere get re-queued too, but `_run_triage_job` skips them
+    because it cannot claim them.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    lock_path = os.path.join(app.root_path, 'data', 'triage_recovery.lock')
+    try:
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        lock_fh = open(lock_path, 'w')
+        if fcntl:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return 0
+
+    recovered = 0
+    try:
+        pending = [(r, True) for r in local_store.iter_records(triage_level='PENDING')]
+        client = get_supabase()
+        if client:
+            try:
+                response = client.table('patient_records').select(
+                    'id,symptoms_text,image_file_url,age,gender').eq('triage_level', 'PENDING').limit(
+                    triage_queue.max_depth).execute()
+                pending.extend((r, False) for r in response.data or [])
+            except Exception as e:
+                print(f"[WARN] Could not query pending Supabase records: {e}")
+        for record, local in pending:
+            job = {
+                'symptoms_text': record.get('symptoms_text'),
+                'image_url': record.get('image_file_url'),
+                'patient_info': {'age': record.get('age'), 'gender': record.get('gender')},
+                'local': local,
             }
-        return {
-            'main_diagnosis': 'AI Analysis Error',
-            'confidence': 50,
-            'triage_level': 'URGENT',
-            'explanation': 'Recommendation: The AI service could not process the request. Please proceed with manual assessment.'
-        }
+            try:
+                triage_queue.submit(str(record['id']), job)
+                recovered += 1
+            except QueueFull:
+                print("[WARN] Triage queue full during recovery; remaining records stay PENDING")
+                break
+    finally:
+        lock_fh.close()
+    if recovered:
+        print(f"[INFO] Re-queued {recovered} pending triage job(s)")
+    return recovered
+
+
+# Optional: push records saved offline back to Supabase every LOCAL_SYNC_INTERVAL seconds.
+LOCAL_SYNC_INTERVAL = float(os.environ.get('LOCAL_SYNC_INTERVAL', '0'))
+# Resolve clients and the Gemini model in the background as soon as the process starts serving.
+WARMUP_ON_START = os.environ.get('WARMUP_ON_START', '1') != '0'
+_background_started = False
+
+
+def warm_up():
+    """Create the Supabase client and resolve the Gemini model ahead of the first diagnosis."""
+    started = time.perf_counter()
+    get_supabase()
+    if GEMINI_API_KEY:
+        try:
+            registry = get_model_registry()
+            registry.get()
+            available_models = registry.state()['available']
+            print(f"[INFO] Available Gemini models: {available_models[:5]}...")  # Limit to first 5 for brevity
+            if 'models/gemini-1.5-flash' not in available_models:
+                print("[WARN] 'gemini-1.5-flash' not available. Check API key or region.")
+        except Exception as e:
+            print(f"[WARN] Could not list models: {e}")
+    print(f"[INFO] Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+
+def _startup(warm):
+    if warm:
+        warm_up()
+    media_store.sweep_staging(max_age=float(os.environ.get('UPLOAD_STAGING_MAX_AGE', '3600')))
+    if TRIAGE_ASYNC and os.environ.get('TRIAGE_RECOVER_ON_START', '1') != '0':
+        _recover_pending_jobs()
+    client = get_supabase()
+    if LOCAL_SYNC_INTERVAL > 0 and client:
+        start_background_sync(
+            SyncEngine(client, LOCAL_RECORDS_FILE, os.path.join(app.root_path, 'data', 'sync_state.json'),
+                       os.path.join(app.root_path, 'static', 'uploads'),
+                       batch_size=int(os.environ.get('LOCAL_SYNC_BATCH_SIZE', '200'))),
+            LOCAL_SYNC_INTERVAL,
+        )
+
+
+def start_background_services(warm=WARMUP_ON_START):
+    """Once per process: warm-up, pending-job recovery and offline sync, on a daemon thread.
+
+    Called from gunicorn's post_worker_init hook (gunicorn.conf.py) and, failing that,
+    by the first request. Never run at import, so threads are not lost across a fork.
+    """
+    global _background_started
+    with _init_lock:
+        if _background_started:
+            return None
+        _background_started = True
+    t = threading.Thread(target=_startup, args=(warm,), name='startup', daemon=True)
+    t.start()
+    return t
+
+
+# Component counters, read at scrape time.
+metrics_registry.gauge('aarogya_triage_queue_depth', 'Triage jobs waiting for a worker.', triage_queue.depth)
+metrics_registry.gauge('aarogya_triage_cache', 'Triage response cache counters.', triage_cache.stats, labels=('stat',))
+metrics_registry.gauge('aarogya_gemini_client', 'Gemini client call counters.',
+                       lambda: {k: v for k, v in gemini_client.stats().items() if k != 'breaker_state'}, labels=('stat',))
+metrics_registry.gauge('aarogya_gemini_breaker_open', '1 while the Gemini circuit breaker is open.',
+                       lambda: int(gemini_client.breaker.state == CircuitBreaker.OPEN))
+metrics_registry.gauge('aarogya_record_cache', 'Record lookup cache and fallback counters.', record_repository.stats,
+                       labels=('stat',))
+metrics_registry.gauge('aarogya_media_store', 'Upload staging, dedup and storage counters.', lambda: media_store.stats(),
+                       labels=('stat',))
+metrics_registry.gauge('aarogya_local_store_commits', 'Local record store group-commit counters.',
+                       lambda: dict(local_store.commit_stats), labels=('stat',))
+metrics_registry.gauge('aarogya_image_pipeline', 'Image preprocessing totals.', image_stats, labels=('stat',))
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    # Label by URL rule, not path, so record ids do not explode the series count.
+    set_route(request.url_rule.rule if request.url_rule else 'unmatched')
+    if not _background_started:
+        start_background_services()
+
+
+@app.after_request
+def _record_request_time(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method,
+                                status=str(response.status_code))
+    return response
+
+
+@app.teardown_request
+def _reset_request_route(_error):
+    # Sync workers reuse their thread, so the route must not outlive the request. This also
+    # runs when a copied request context (an upload stage) ends, which only touches that copy.
+    set_route('none')
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/')
@@ -285,44 +748,222 @@ def record():
     return render_template('record.html')
 
 
+DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', '50'))
+# Only the columns the dashboard table renders; keeps each page small.
+DASHBOARD_COLUMNS = 'id,patient_name,age,ai_diagnosis,triage_level,confidence,image_file_url,created_at'
+TRIAGE_LEVELS = ('CRITICAL', 'URGENT', 'STABLE')
+TRIAGE_FILTERS = {'RED': 'CRITICAL', 'YELLOW': 'URGENT', 'GREEN': 'STABLE'}
+
+
+def _triage_stats_from_rows(rows):
+    """Dashboard stats from `triage_counts()` rows ({triage_level, count})."""
+    stats = {'total': 0, 'critical': 0, 'urgent': 0, 'stable': 0}
+    for row in rows or []:
+        count = int(row.get('count') or 0)
+        stats['total'] += count
+        level = row.get('triage_level')
+        if level in TRIAGE_LEVELS:
+            stats[level.lower()] = count
+    return stats
+
+
+def _fetch_triage_stats(client):
+    """Count records per triage level in the database rather than in Python.
+
+    Uses the `triage_counts()` SQL function (supabase_init/dashboard_triage_counts.sql)
+    and falls back to head-only count queries if it has not been installed.
+    """
+    try:
+        response = client.rpc('triage_counts').execute()
+        return _triage_stats_from_rows(response.data)
+    except Exception as e:
+        print(f"[WARN] triage_counts() unavailable, using count queries: {e}")
+
+    stats = {'total': 0, 'critical': 0, 'urgent': 0, 'stable': 0}
+    table = client.table('patient_records')
+    stats['total'] = table.select('id', count='exact', head=True).execute().count or 0
+    for level in TRIAGE_LEVELS:
+        response = client.table('patient_records').select(
+            'id', count='exact', head=True).eq('triage_level', level).execute()
+        stats[level.lower()] = response.count or 0
+    return stats
+
+
+def _rollup_rows_from_stats(stats):
+    """Level counts as `triage_rollups()` rows, so a missing rollups function is only retried once per TTL.
+
+    Records at any other level (PENDING, unparsed results) are counted as UNKNOWN.
+    """
+    rows = [{'triage_level': level, 'count': stats.get(level.lower(), 0)} for level in TRIAGE_LEVELS]
+    rest = stats.get('total', 0) - sum(row['count'] for row in rows)
+    if rest > 0:
+        rows.append({'triage_level': 'UNKNOWN', 'count': rest})
+    return rows
+
+
+def _dashboard_stats():
+    """Stats and chart breakdowns for the dashboard, without touching individual records."""
+    client = get_supabase()
+    if not client:
+        local_store.refresh()
+        return local_rollups.snapshot()
+    if remote_rollups.is_stale():
+        try:
+            response = client.rpc('triage_rollups').execute()
+            remote_rollups.seed(response.data or [])
+        except Exception as e:
+            print(f"[WARN] triage_rollups() unavailable, falling back to level counts: {e}")
+            remote_rollups.seed(_rollup_rows_from_stats(_fetch_triage_stats(client)), breakdowns=False)
+    return remote_rollups.snapshot()
+
+
+def _parse_dashboard_cursor(before, before_id):
+    """Validate a dashboard cursor from the query string; raises ValueError if it is malformed.
+
+    The values end up inside a PostgREST filter expression, so only a real timestamp and
+    UUID are let through, re-serialised rather than passed on verbatim.
+    """
+    if not before:
+        if before_id:
+            raise ValueError('before_id needs before')
+        return None, None
+    before = datetime.fromisoformat(before).isoformat()
+    if before_id:
+        before_id = str(uuid.UUID(before_id))
+    return before, before_id
+
+
+def _dashboard_page_query(client, triage_level=None, before=None, before_id=None, page_size=DASHBOARD_PAGE_SIZE):
+    """The query for one page of records, newest first, using a keyset cursor on (created_at, id)."""
+    query = client.table('patient_records').select(DASHBOARD_COLUMNS)
+    if triage_level:
+        query = query.eq('triage_level', triage_level)
+    if before:
+        if before_id:
+            query = query.or_(f'created_at.lt."{before}",and(created_at.eq."{before}",id.lt.{before_id})')
+        else:
+            query = query.lt('created_at', before)
+    # Fetch one extra row to know whether another page exists.
+    return query.order('created_at', desc=True).order('id', desc=True).limit(page_size + 1)
+
+
+def _dashboard_page(records, page_size=DASHBOARD_PAGE_SIZE):
+    """Split the rows of `_dashboard_page_query` into (records, next_cursor); next_cursor is None on the last page."""
+    next_cursor = None
+    if len(records) > page_size:
+        records = records[:page_size]
+        last = records[-1]
+        next_cursor = {'before': last.get('created_at'), 'before_id': last.get('id')}
+    return records, next_cursor
+
+
+def _fetch_dashboard_page(client, triage_level=None, before=None, before_id=None, page_size=DASHBOARD_PAGE_SIZE):
+    """Return one page of records, newest first, as (records, next_cursor)."""
+    response = _dashboard_page_query(client, triage_level, before, before_id, page_size).execute()
+    return _dashboard_page(response.data or [], page_size)
+
+
+def _local_dashboard_page(triage_level=None, before=None, before_id=None, page_size=DASHBOARD_PAGE_SIZE):
+    """Newest-first page of offline records, on the same (created_at, id) keyset as Supabase."""
+    records = local_store.page(triage_level, before, before_id, limit=page_size + 1)
+    return _dashboard_page(records, page_size)
+
+
 @app.route('/dashboard')
 def dashboard():
+    filter_key = (request.args.get('filter') or 'ALL').upper()
+    triage_level = TRIAGE_FILTERS.get(filter_key)
+    if not triage_level:
+        filter_key = 'ALL'
     try:
-        if not supabase:
-            records = []
-            stats = {'total': 0, 'critical': 0, 'urgent': 0, 'stable': 0}
-            return render_template('dashboard.html', records=records, stats=stats)
-
-        response = supabase.table('patient_records').select(
-            '*').order('created_at', desc=True).execute()
-        records = response.data
+        before, before_id = _parse_dashboard_cursor(request.args.get('before'), request.args.get('before_id'))
+    except ValueError:
+        return "Invalid dashboard cursor", 400
+    try:
+        client = get_supabase()
+        if not client:
+            records, next_cursor = _local_dashboard_page(triage_level, before, before_id)
+            stats = _dashboard_stats()
+            return render_template('dashboard.html', records=records, stats=stats, filter=filter_key,
+                                   next_cursor=next_cursor, is_first_page=not before)
 
-        stats = {
-            'total': len(records),
-            'critical': len([r for r in records if r.get('triage_level') == 'CRITICAL']),
-            'urgent': len([r for r in records if r.get('triage_level') == 'URGENT']),
-            'stable': len([r for r in records if r.get('triage_level') == 'STABLE'])
-        }
-        return render_template('dashboard.html', records=records, stats=stats)
+        records, next_cursor = _fetch_dashboard_page(client, triage_level, before, before_id)
+        stats = _dashboard_stats()
+        return render_template('dashboard.html', records=records, stats=stats, filter=filter_key,
+                               next_cursor=next_cursor, is_first_page=not before)
     except Exception as e:
         return f"Error fetching dashboard data: {e}"
 
 
+EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '1000'))
+# /export hands out every patient record, so it is off unless a token is configured.
+EXPORT_TOKEN = os.environ.get('EXPORT_TOKEN') or None
+EXPORTED_ROWS = metrics_registry.counter('aarogya_export_rows_total', 'Rows streamed by /export.', labels=('format',))
+
+
+def _export_rows(client, triage_level, since, until, fmt):
+    """Rows for an export; counts them and logs (rather than raises) a mid-stream failure.
+
+    From Supabase the rows come oldest first by (created_at, id); from the local
+    store they come in write order, so a record finished after newer ones were
+    saved appears after them.
+    """
+    rows = 0
+    try:
+        if client:
+            source = export.iter_supabase_rows(client, triage_level, since, until, page_size=EXPORT_PAGE_SIZE)
+        else:
+            source = export.iter_local_rows(local_store, triage_level, since, until)
+        for row in source:
+            rows += 1
+            yield row
+    except Exception as e:
+        # Headers are already sent, so the client sees a truncated file.
+        print(f"[ERROR] Export stopped after {rows} rows: {e}")
+    finally:
+        EXPORTED_ROWS.inc(rows, format=fmt)
+        print(f"[INFO] Exported {rows} rows as {fmt}")
+
+
+@app.route('/export')
+def export_records():
+    """Stream patient records as NDJSON (default) or CSV, optionally gzipped.
+
+    Query parameters: format=ndjson|csv, gzip=1, filter=RED|YELLOW|GREEN, since/until (dates or ISO timestamps).
+    Requires the EXPORT_TOKEN in an ``X-Export-Token`` header; 404 when no token is configured.
+    """
+    if not EXPORT_TOKEN:
+        return jsonify({'success': False, 'error': 'Export is disabled'}), 404
+    token = request.headers.get('X-Export-Token') or ''
+    if not hmac.compare_digest(token.encode(), EXPORT_TOKEN.encode()):
+        return jsonify({'success': False, 'error': 'Missing or invalid export token'}), 401
+    fmt = (request.args.get('format') or 'ndjson').lower()
+    if fmt not in export.FORMATS:
+        return jsonify({'success': False, 'error': f"format must be one of: {', '.join(export.FORMATS)}"}), 400
+    compress = (request.args.get('gzip') or '').lower() in ('1', 'true', 'yes')
+    filter_key = (request.args.get('filter') or 'ALL').upper()
+    triage_level = TRIAGE_FILTERS.get(filter_key)
+    if filter_key != 'ALL' and not triage_level:
+        return jsonify({'success': False, 'error': 'filter must be RED, YELLOW, GREEN or ALL'}), 400
+    try:
+        since, until = export.normalize_range(request.args.get('since'), request.args.get('until'))
+        for value in (since, until):
+            if value:
+                datetime.fromisoformat(value)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'since/until must be ISO dates or timestamps'}), 400
+
+    client = get_supabase()
+    body = export.encode(_export_rows(client, triage_level, since, until, fmt), fmt, compress)
+    name = export.file_name(fmt, compress, datetime.now().strftime('%Y%m%d_%H%M%S'))
+    return Response(stream_with_context(body), mimetype=export.content_type(fmt, compress),
+                    headers={'Content-Disposition': f'attachment; filename="{name}"'})
+
+
 @app.route('/result/<record_id>')
 def result(record_id):
     try:
-        if not supabase:
-            # Check local fallback
-            local = _find_local_record(record_id)
-            return render_template('result.html', record=local)
-
-        response = supabase.table('patient_records').select(
-            '*').eq('id', record_id).single().execute()
-        record = response.data
-        if not record:
-            # Attempt to load from local fallback
-            record = _find_local_record(record_id)
-        return render_template('result.html', record=record)
+        return render_template('result.html', record=record_repository.get(record_id))
     except Exception as e:
         return f"Error fetching result data: {e}"
 
@@ -333,18 +974,8 @@ def result_query():
     This keeps compatibility with code that expects /result?id=<id> instead of /result/<id>.
     """
     record_id = request.args.get('id') or None
-    if not record_id or not supabase:
-        # If supabase not configured, try local fallback
-        local = _find_local_record(record_id)
-        return render_template('result.html', record=local)
-
-    try:
-        response = supabase.table('patient_records').select(
-            '*').eq('id', record_id).single().execute()
-        record = response.data
-        if not record:
-            record = _find_local_record(record_id)
-        return render_template('result.html', record=record)
+    try:
+        return render_template('result.html', record=record_repository.get(record_id))
     except Exception as e:
         print(f"Error fetching result by query id {record_id}: {e}")
         return render_template('result.html', record=None)
@@ -353,16 +984,7 @@ def result_query():
 @app.route('/abdm-record/<record_id>')
 def abdm_record(record_id):
     try:
-        if not supabase:
-            local = _find_local_record(record_id)
-            return render_template('abdm-record.html', record=local)
-
-        response = supabase.table('patient_records').select(
-            '*').eq('id', record_id).single().execute()
-        record = response.data
-        if not record:
-            record = _find_local_record(record_id)
-        return render_template('abdm-record.html', record=record)
+        return render_template('abdm-record.html', record=record_repository.get(record_id))
     except Exception as e:
         return f"Error fetching ABDM data: {e}"
 
@@ -373,170 +995,469 @@ def abdm_record_query():
     This mirrors the behavior of /result and keeps backwards compatibility.
     """
     record_id = request.args.get('id') or None
-    if not record_id or not supabase:
-        local = _find_local_record(record_id)
-        return render_template('abdm-record.html', record=local)
-
     try:
-        response = supabase.table('patient_records').select(
-            '*').eq('id', record_id).single().execute()
-        record = response.data
-        if not record:
-            record = _find_local_record(record_id)
-        return render_template('abdm-record.html', record=record)
+        return render_template('abdm-record.html', record=record_repository.get(record_id))
     except Exception as e:
         print(f"Error fetching ABDM by query id {record_id}: {e}")
         return render_template('abdm-record.html', record=None)
 
 
+media_store = MediaStore(
+    lambda: supabase_admin or get_supabase(),
+    os.path.join(app.root_path, 'static', 'uploads'),
+    lambda name: url_for('static', filename=f'uploads/{name}', _external=True),
+    staging_dir=os.path.join(app.root_path, 'data', 'incoming'),
+)
+
+
+def _upload_ext(filename, default):
+    """Extension from the client's filename, or ``default`` if it is missing or not plain alphanumerics."""
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return ext if ext.isalnum() and len(ext) <= 8 else default
+
+
+def _uploaded_file(field):
+    upload = request.files.get(field)
+    return upload if upload and upload.filename != '' else None
+
+
+def _stage_media(image_file, voice_file):
+    """Copy the request's photo and voice note to staging files.
+
+    Returns (image_file, staged_image, voice_file, staged_voice). Raises MediaTooLarge,
+    keeping nothing, if either file is over its limit. Stage every file of a request
+    before starting an upload: a task run with copy_current_request_context closes the
+    request's file streams when it finishes.
+    """
+    staged_image = staged_voice = None
+    try:
+        if image_file:
+            staged_image = media_store.stage(image_file.stream, MAX_IMAGE_BYTES, 'image')
+        if voice_file:
+            staged_voice = media_store.stage(voice_file.stream, MAX_VOICE_BYTES, 'voice')
+    except Exception:
+        if staged_image:
+            staged_image.discard()
+        raise
+    return image_file, staged_image, voice_file, staged_voice
+
+
+def _discard_staged(staged_media):
+    """Remove a request's staging files (idempotent); for error paths before the uploads own them."""
+    for staged in staged_media[1::2]:
+        if staged:
+            staged.discard()
+
+
+def _discard_if_cancelled(task, staged):
+    """Remove ``staged`` if ``task`` (a Future or asyncio Task) is cancelled before it can store it."""
+    if staged:
+        task.add_done_callback(lambda t: staged.discard() if t.cancelled() else None)
+
+
+def _prepare_media(staged_media):
+    """Preprocess the staged photo and name both files after their content.
+
+    Returns {'image_data', 'image_mime_type', 'image', 'voice'}: the bytes and type to
+    show the model, plus what `_store_image` / `_store_voice` need (None if absent).
+    """
+    image_file, staged_image, voice_file, staged_voice = staged_media
+    media = {'image_data': None, 'image_mime_type': None, 'image': None, 'voice': None}
+
+    if staged_image:
+        image_mime_type = image_file.mimetype
+        with timed('image_preprocess'):
+            processed = preprocess_image(staged_image.path)
+        # Named after the original upload's hash, so a resubmitted photo maps to the stored copy.
+        if processed:
+            staged_image.discard()
+            image_data = processed['data']
+            image_mime_type = processed['mime_type']
+            image_name = staged_image.content_name('img', processed['ext'])
+        else:
+            # Not decodable: keep the original bytes (the model may still accept them).
+            image_data = staged_image.read()
+            image_name = staged_image.content_name('img', _upload_ext(image_file.filename, 'bin'))
+        media['image_data'] = image_data
+        media['image_mime_type'] = image_mime_type
+        media['image'] = {'name': image_name, 'staged': None if processed else staged_image, 'data': image_data,
+                          'mime_type': image_mime_type, 'thumbnail': processed['thumbnail'] if processed else None}
+
+    if staged_voice:
+        media['voice'] = {'name': staged_voice.content_name('voice', _upload_ext(voice_file.filename, 'webm')),
+                          'staged': staged_voice, 'mime_type': voice_file.mimetype}
+    return media
+
+
+def _store_image(image):
+    with timed('image_upload'):
+        if image['staged']:
+            return media_store.store_staged(image['staged'], image['name'], image['mime_type'], 'image')
+        url = media_store.store_bytes(image['data'], image['name'], image['mime_type'], 'image')
+        if image['thumbnail'] and url:
+            media_store.store_bytes(image['thumbnail'], thumbnail_name(image['name']), image['mime_type'], 'thumbnail')
+    return url
+
+
+def _store_voice(voice):
+    with timed('voice_upload'):
+        return media_store.store_staged(voice['staged'], voice['name'], voice['mime_type'], 'voice')
+
+
+def _start_media_uploads(plan, staged_media, suffix=''):
+    """Preprocess the staged photo and start both uploads on ``plan``.
+
+    The stages are named `image_upload{suffix}` and `voice_upload{suffix}`. Returns
+    (image_data, image_mime_type) for the model.
+    """
+    try:
+        media = _prepare_media(staged_media)
+    except Exception:
+        _discard_staged(staged_media)
+        raise
+    # Local saves build their URL with url_for, which needs the request context.
+    if media['image']:
+        future = plan.start(f'image_upload{suffix}', copy_current_request_context(_store_image), media['image'])
+        _discard_if_cancelled(future, media['image']['staged'])
+    if media['voice']:
+        future = plan.start(f'voice_upload{suffix}', copy_current_request_context(_store_voice), media['voice'])
+        _discard_if_cancelled(future, media['voice']['staged'])
+    return media['image_data'], media['image_mime_type']
+
+
+@app.template_filter('thumbnail_url')
+def thumbnail_url_filter(image_url):
+    """Map a stored image URL to its dashboard thumbnail (same location, `thumb_` prefix)."""
+    if not image_url:
+        return None
+    base, _, name = image_url.rpartition('/')
+    name = name.split('?')[0]
+    return f"{base}/{thumbnail_name(name)}"
+
+
+# Uploads and the synchronous diagnosis of each /analyze request run side by side on this pool.
+analyze_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('ANALYZE_POOL_WORKERS', '16')),
+                                  thread_name_prefix='analyze')
+ANALYZE_DEADLINE = float(os.environ.get('ANALYZE_DEADLINE', '45'))
+
+DEADLINE_RESULT = {
+    'main_diagnosis': 'AI Analysis Timed Out',
+    'confidence': 0,
+    'triage_level': 'URGENT',
+    'explanation': 'Recommendation: The AI analysis took too long. Proceed with manual assessment and refer if in doubt.'
+}
+
+
+def _analyze_form(data):
+    """(patient_info, symptoms_text) from the /analyze form fields."""
+    patient_info = {
+        'patient_name': data.get('patient_name'),
+        'age': int(data.get('age')),
+        'gender': data.get('gender')
+    }
+    symptoms_text = data.get('symptoms_text')
+
+    # Defensive: ensure patient_info fields have expected types
+    try:
+        patient_info['age'] = int(patient_info.get('age') or 0)
+    except Exception:
+        patient_info['age'] = 0
+    return patient_info, symptoms_text
+
+
+def _analyze_busy():
+    """(body, status, headers) refusing /analyze while the triage queue is full, else None.
+
+    Backpressure: checked before anything is uploaded rather than queueing unbounded work.
+    """
+    if TRIAGE_ASYNC and not triage_queue.has_capacity():
+        return {'success': False, 'error': 'Server is busy, please retry shortly'}, 503, {'Retry-After': '10'}
+    return None
+
+
+def _analyze_record(plan, patient_info, symptoms_text, image_file_url, voice_file_url, ai_result):
+    """The patient_records row for an /analyze submission, once ``plan``'s stages are joined.
+
+    PENDING when the diagnosis is queued (TRIAGE_ASYNC), else ``ai_result``'s fields.
+    """
+    if plan.timed_out:
+        FALLBACKS.inc(kind='request_deadline')
+    return {
+        **patient_info,
+        'symptoms_text': symptoms_text,
+        'image_file_url': image_file_url,
+        'voice_file_url': voice_file_url,
+        **(PENDING_RESULT_FIELDS if TRIAGE_ASYNC else _ai_result_fields(ai_result)),
+    }
+
+
+def _analyze_job(record_id, record, patient_info, image_data, image_mime_type, stored_locally):
+    """The triage job for a saved PENDING record; None in sync mode or if saving failed."""
+    if not (record_id and TRIAGE_ASYNC):
+        return None
+    return {
+        'symptoms_text': record['symptoms_text'],
+        'image_url': record['image_file_url'],
+        'image_data': image_data,
+        'image_mime_type': image_mime_type,
+        'patient_info': patient_info,
+        'local': stored_locally,
+    }
+
+
+def _analyze_response(record_id, status):
+    """(body, HTTP status) for a finished /analyze; ``record_id`` is None if the record could not be saved."""
+    if not record_id:
+        print("[ERROR] Could not create or save record; returning failure to client")
+        return {'success': False, 'error': 'Failed to save record'}, 500
+    return {'success': True, 'record_id': record_id, 'status': status}, 202 if status == 'PENDING' else 200
+
+
+def _submit_triage(record_id, job):
+    """Queue the diagnosis of a PENDING record. Returns 'PENDING', or 'COMPLETE' if it had to run inline."""
+    try:
+        triage_queue.submit(record_id, job)
+        return 'PENDING'
+    except QueueFull:
+        # Lost the race for the last slot; the record exists, so finish it inline.
+        print(f"[WARN] Triage queue full; running diagnosis inline for {record_id}")
+        try:
+            _run_triage_job(record_id, job)
+        except RetryLater as e:
+            triage_queue.retry_later(record_id, job, e.delay)
+            return 'PENDING'
+        return 'COMPLETE'
+
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
+    busy = _analyze_busy()
+    if busy:
+        body, status, headers = busy
+        return jsonify(body), status, headers
     try:
-        data = request.form
-        patient_info = {
-            'patient_name': data.get('patient_name'),
-            'age': int(data.get('age')),
-            'gender': data.get('gender')
-        }
-        symptoms_text = data.get('symptoms_text')
-
-        image_file_url = None
-        voice_file_url = None
-
-        if 'image_file' in request.files and request.files['image_file'].filename != '':
-            image_file = request.files['image_file']
-            file_ext = image_file.filename.split('.')[-1]
-            file_name = f"img_{datetime.now().timestamp()}.{file_ext}"
-            # choose admin storage client when available
-            storage_client = supabase_admin if 'supabase_admin' in globals() and supabase_admin else supabase
-            if storage_client:
-                try:
-                    upload_resp = storage_client.storage.from_('media').upload(
-                        file=image_file.read(), path=file_name, file_options={"content-type": image_file.mimetype})
-                    print(f"[DEBUG] image upload response: {getattr(upload_resp, 'error', upload_resp)}")
-                    image_file_url = storage_client.storage.from_('media').get_public_url(file_name)
-                except Exception as ex:
-                    print(f"[ERROR] image upload failed: {ex}")
-                    image_file_url = None
-            else:
-                image_file_url = None
-            # Fallback: if Supabase upload did not produce a URL, save locally to static/uploads
-            if not image_file_url:
-                try:
-                    uploads_dir = os.path.join(app.root_path, 'static', 'uploads')
-                    os.makedirs(uploads_dir, exist_ok=True)
-                    local_path = os.path.join(uploads_dir, file_name)
-                    # If we already read file contents into memory via image_file.read() above, we need to re-seek
-                    image_file.stream.seek(0)
-                    with open(local_path, 'wb') as f:
-                        f.write(image_file.read())
-                    image_file_url = url_for('static', filename=f'uploads/{file_name}', _external=True)
-                    print(f"[INFO] Saved image locally to {local_path}")
-                except Exception as ex:
-                    print(f"[ERROR] Local image save failed: {ex}")
-
-        if 'voice_file' in request.files and request.files['voice_file'].filename != '':
-            voice_file = request.files['voice_file']
-            file_ext = voice_file.filename.split(
-                '.')[-1] if '.' in voice_file.filename else 'webm'
-            file_name = f"voice_{datetime.now().timestamp()}.{file_ext}"
-
-            storage_client = supabase_admin if 'supabase_admin' in globals() and supabase_admin else supabase
-            if storage_client:
-                try:
-                    upload_resp = storage_client.storage.from_('media').upload(
-                        file=voice_file.read(), path=file_name, file_options={"content-type": voice_file.mimetype})
-                    print(f"[DEBUG] voice upload response: {getattr(upload_resp, 'error', upload_resp)}")
-                    voice_file_url = storage_client.storage.from_('media').get_public_url(file_name)
-                except Exception as ex:
-                    print(f"[ERROR] voice upload failed: {ex}")
-                    voice_file_url = None
-            else:
-                voice_file_url = None
-            # Fallback: save voice locally if upload failed
-            if not voice_file_url:
-                try:
-                    uploads_dir = os.path.join(app.root_path, 'static', 'uploads')
-                    os.makedirs(uploads_dir, exist_ok=True)
-                    local_path = os.path.join(uploads_dir, file_name)
-                    voice_file.stream.seek(0)
-                    with open(local_path, 'wb') as f:
-                        f.write(voice_file.read())
-                    voice_file_url = url_for('static', filename=f'uploads/{file_name}', _external=True)
-                    print(f"[INFO] Saved voice locally to {local_path}")
-                except Exception as ex:
-                    print(f"[ERROR] Local voice save failed: {ex}")
-
-        ai_result = get_ai_diagnosis_from_api(
-            symptoms_text, image_file_url, patient_info)
-        # Defensive: ensure ai_result is a dict to avoid NoneType errors
-        if not isinstance(ai_result, dict):
-            print(f"[WARN] ai_result unexpected type: {type(ai_result)}. Falling back to default result.")
-            ai_result = {
-                'main_diagnosis': 'AI Unavailable',
-                'confidence': 0,
-                'triage_level': 'URGENT',
-                'explanation': 'Recommendation: AI did not return a valid response.'
-            }
+        plan = RequestPlan(analyze_pool, ANALYZE_DEADLINE)
+        patient_info, symptoms_text = _analyze_form(request.form)
+
+        # Stage both files first so an oversized one is rejected before anything is uploaded.
+        staged_media = _stage_media(_uploaded_file('image_file'), _uploaded_file('voice_file'))
+        image_data, image_mime_type = _start_media_uploads(plan, staged_media)
+
+        if not TRIAGE_ASYNC:
+            # The model gets the image bytes directly, so it need not wait for the upload's URL.
+            plan.start('diagnosis', get_ai_diagnosis_from_api, symptoms_text, None, patient_info,
+                       image_data, image_mime_type, deadline=plan.remaining())
 
-        # Defensive: ensure patient_info fields have expected types
+        # Join before the insert: the record needs the media URLs (and, in sync mode, the diagnosis).
+        record_to_insert = _analyze_record(plan, patient_info, symptoms_text, plan.result('image_upload'),
+                                           plan.result('voice_upload'),
+                                           None if TRIAGE_ASYNC else plan.result('diagnosis', DEADLINE_RESULT))
+        new_record_id, stored_locally = _save_record(record_to_insert)
+        job = _analyze_job(new_record_id, record_to_insert, patient_info, image_data, image_mime_type, stored_locally)
+        body, status = _analyze_response(new_record_id, _submit_triage(new_record_id, job) if job else 'COMPLETE')
+        return jsonify(body), status
+
+    except MediaTooLarge as e:
+        return jsonify({'success': False, 'error': str(e)}), 413
+    except RequestEntityTooLarge:
+        raise
+    except Exception as e:
+        print(f"Error in /analyze: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '50'))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '4'))
+BATCH_DEADLINE = float(os.environ.get('BATCH_DEADLINE', '120'))
+# MAX_CONTENT_LENGTH is sized for one patient's files; a batch may carry media for each entry.
+BATCH_MAX_UPLOAD_BYTES = int(os.environ.get('BATCH_MAX_UPLOAD_BYTES', str(256 * 1024 * 1024)))
+
+
+def _batch_patient(entry):
+    """Validate one batch entry. Returns (patient_info, symptoms_text); raises ValueError."""
+    if not isinstance(entry, dict):
+        raise ValueError('entry must be an object')
+    if not entry.get('patient_name'):
+        raise ValueError('patient_name is required')
+    try:
+        age = int(entry.get('age'))
+    except (TypeError, ValueError):
+        raise ValueError('age must be an integer')
+    patient_info = {'patient_name': entry.get('patient_name'), 'age': age, 'gender': entry.get('gender')}
+    return patient_info, entry.get('symptoms_text')
+
+
+def _batch_diagnosis(remaining, *args):
+    """One batch entry's diagnosis, or None if the model could not assess it (throttled, breaker open, ...)."""
+    try:
+        return get_ai_diagnosis_from_api(*args, deadline=remaining(), raise_unassessed=True)
+    except GeminiClientError as e:
+        print(f"[WARN] Batch diagnosis not assessed: {e}")
+        return None
+
+
+def _queue_unassessed(record_id, job):
+    """Hand a batch entry the request could not diagnose to the triage queue; it stays PENDING until then."""
+    try:
+        triage_queue.submit(record_id, job)
+    except QueueFull:
+        triage_queue.retry_later(record_id, job, TRIAGE_RETRY_DELAY)
+
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Triage many patients registered offline (e.g. at a screening camp) in one request.
+
+    Body: JSON {"patients": [{patient_name, age, gender, symptoms_text}, ...]}, or multipart
+    with that list in a `patients` field and optional `image_file_<i>` / `voice_file_<i>`
+    files for entry i. Diagnoses run at most BATCH_CONCURRENCY at a time, all rows are
+    written in one insert, and each entry gets its own status: COMPLETE, INVALID,
+    REJECTED (media too large), TIMED_OUT (past BATCH_DEADLINE) or AI_FAILED (the model
+    could not assess it). TIMED_OUT and AI_FAILED entries are saved PENDING and queued for
+    a background diagnosis when TRIAGE_ASYNC is on, and as URGENT for manual assessment
+    otherwise. Returns 200 if every entry is COMPLETE, 207 if only some are.
+    """
+    request.max_content_length = BATCH_MAX_UPLOAD_BYTES
+    try:
+        if request.is_json:
+            entries = (request.get_json(silent=True) or {}).get('patients')
+        else:
+            entries = json.loads(request.form.get('patients') or 'null')
+    except ValueError:
+        return jsonify({'success': False, 'error': '"patients" is not valid JSON'}), 400
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'success': False, 'error': 'Expected a non-empty "patients" list'}), 400
+    if len(entries) > BATCH_MAX_ITEMS:
+        return jsonify({'success': False, 'error': f'At most {BATCH_MAX_ITEMS} patients per batch'}), 413
+
+    try:
+        plan = RequestPlan(analyze_pool, BATCH_DEADLINE)
+        results = [{'index': i} for i in range(len(entries))]
+        staged = []
+        for i, entry in enumerate(entries):
+            try:
+                patient_info, symptoms_text = _batch_patient(entry)
+                staged_media = _stage_media(_uploaded_file(f'image_file_{i}'), _uploaded_file(f'voice_file_{i}'))
+            except ValueError as e:
+                results[i].update(status='INVALID', error=str(e))
+                continue
+            except MediaTooLarge as e:
+                results[i].update(status='REJECTED', error=str(e))
+                continue
+            staged.append((i, patient_info, symptoms_text, staged_media))
+        accepted = []
         try:
-            patient_info['age'] = int(patient_info.get('age') or 0)
+            for i, patient_info, symptoms_text, staged_media in staged:
+                image_data, image_mime_type = _start_media_uploads(plan, staged_media, suffix=f'_{i}')
+                accepted.append((i, patient_info, symptoms_text, image_data, image_mime_type))
         except Exception:
-            patient_info['age'] = 0
-
-        record_to_insert = {
-            **patient_info,
-            'symptoms_text': symptoms_text,
-            'image_file_url': image_file_url,
-            'voice_file_url': voice_file_url,
-            'ai_diagnosis': ai_result.get('main_diagnosis') if isinstance(ai_result, dict) else None,
-            'confidence': ai_result.get('confidence') if isinstance(ai_result, dict) else None,
-            'triage_level': ai_result.get('triage_level') if isinstance(ai_result, dict) else None,
-            'explanation': ai_result.get('explanation') if isinstance(ai_result, dict) else None
-        }
+            # The failing entry cleaned up after itself; later ones were never handed to an upload.
+            for _, _, _, staged_media in staged[len(accepted) + 1:]:
+                _discard_staged(staged_media)
+            raise
 
-        db_client = supabase_admin if 'supabase_admin' in globals() and supabase_admin else supabase
-        if db_client:
-            try:
-                response = db_client.table('patient_records').insert(record_to_insert).execute()
-                print(f"[DEBUG] insert response: {getattr(response, 'error', response)}")
-                try:
-                    new_record_id = response.data[0].get('id') if response.data and isinstance(response.data, list) else None
-                except Exception:
-                    new_record_id = None
-            except Exception as ex:
-                print(f"[ERROR] insert failed: {ex}")
-                new_record_id = None
-        # Fallback: if DB insert failed or no Supabase client, save record locally
-        if not new_record_id:
-            try:
-                import uuid
-                generated_id = str(uuid.uuid4())
-                record_to_insert_local = dict(record_to_insert)
-                record_to_insert_local['id'] = generated_id
-                record_to_insert_local['created_at'] = datetime.utcnow().isoformat()
-                data_dir = os.path.join(app.root_path, 'data')
-                os.makedirs(data_dir, exist_ok=True)
-                local_file = os.path.join(data_dir, 'local_records.jsonl')
-                with open(local_file, 'a', encoding='utf-8') as fh:
-                    fh.write(json.dumps(record_to_insert_local, ensure_ascii=False) + '\n')
-                new_record_id = generated_id
-                print(f"[INFO] Saved record locally to {local_file} with id {generated_id}")
-            except Exception as ex:
-                print(f"[ERROR] Failed to save record locally: {ex}")
-        # If we still don't have a record id, return an error to the client
-        if not new_record_id:
-            print("[ERROR] Could not create or save record; returning failure to client")
-            return jsonify({'success': False, 'error': 'Failed to save record'}), 500
-
-        return jsonify({'success': True, 'record_id': new_record_id})
+        if not accepted:
+            return jsonify({'success': False, 'saved': 0, 'results': results}), 400
+
+        # A small pool of its own bounds this batch's Gemini calls without starving /analyze.
+        diagnosis_pool = ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(accepted)),
+                                            thread_name_prefix='batch')
+        try:
+            diagnoses = RequestPlan(diagnosis_pool, plan.remaining())
+            for i, patient_info, symptoms_text, image_data, image_mime_type in accepted:
+                diagnoses.start(i, _batch_diagnosis, diagnoses.remaining,
+                                symptoms_text, None, patient_info, image_data, image_mime_type)
+            records_to_insert = []
+            unassessed = {}
+            for i, patient_info, symptoms_text, _, _ in accepted:
+                ai_result = diagnoses.result(i)
+                if i in diagnoses.timed_out:
+                    unassessed[i], ai_result = 'TIMED_OUT', DEADLINE_RESULT
+                elif ai_result is None:
+                    unassessed[i], ai_result = 'AI_FAILED', NOT_ASSESSED_RESULT
+                fields = PENDING_RESULT_FIELDS if i in unassessed and TRIAGE_ASYNC else _ai_result_fields(ai_result)
+                records_to_insert.append({
+                    **patient_info,
+                    'symptoms_text': symptoms_text,
+                    'image_file_url': plan.result(f'image_upload_{i}'),
+                    'voice_file_url': plan.result(f'voice_upload_{i}'),
+                    **fields,
+                })
+        finally:
+            # Past the deadline, drop queued diagnoses rather than waiting for them.
+            diagnosis_pool.shutdown(wait=False, cancel_futures=True)
+        if diagnoses.timed_out or plan.timed_out:
+            FALLBACKS.inc(kind='request_deadline')
+
+        record_ids, stored_locally = _save_records(records_to_insert)
+        if not record_ids:
+            print("[ERROR] Could not save batch records; returning failure to client")
+            for i, *_ in accepted:
+                results[i].update(status='FAILED', error='Failed to save record')
+            return jsonify({'success': False, 'saved': 0, 'results': results}), 500
+
+        queued = 0
+        for entry, record_id, record in zip(accepted, record_ids, records_to_insert):
+            i, patient_info, symptoms_text, image_data, image_mime_type = entry
+            status = unassessed.get(i, 'COMPLETE')
+            results[i].update(status=status, record_id=record_id, triage_level=record.get('triage_level'))
+            if status != 'COMPLETE' and TRIAGE_ASYNC:
+                _queue_unassessed(record_id, {
+                    'symptoms_text': symptoms_text,
+                    'image_url': record.get('image_file_url'),
+                    'patient_info': patient_info,
+                    'image_data': image_data,
+                    'image_mime_type': image_mime_type,
+                    'local': stored_locally,
+                })
+                queued += 1
+        complete = len(record_ids) - len(unassessed)
+        print(f"[INFO] Batch triage saved {len(record_ids)} of {len(entries)} patient(s), "
+              f"{complete} diagnosed, {queued} queued")
+        return jsonify({'success': True, 'saved': len(record_ids), 'complete': complete, 'queued': queued,
+                        'failed': len(entries) - complete, 'stored_locally': stored_locally, 'results': results}), (
+            200 if complete == len(entries) else 207)
 
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
-        print(f"Error in /analyze: {e}")
+        print(f"Error in /analyze/batch: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.errorhandler(413)
+def request_too_large(e):
+    limit = request.max_content_length or MAX_UPLOAD_BYTES
+    return jsonify({'success': False,
+                    'error': f'Upload too large (limit {round(limit / (1024 * 1024), 1)} MB per submission)'}), 413
+
+
+@app.route('/analyze/status/<record_id>')
+def analyze_status(record_id):
+    """Polled by the record form until the background diagnosis for `record_id` finishes."""
+    state = triage_queue.status(record_id)
+    if state in (QUEUED, RUNNING, RETRYING):
+        return jsonify({'success': True, 'record_id': record_id, 'status': 'PENDING'})
+
+    # Unknown to this worker (e.g. handled by another gunicorn worker) or finished: ask the store.
+    record = None
+    client = get_supabase()
+    if client:
+        try:
+            response = client.table('patient_records').select(
+                'id,triage_level').eq('id', record_id).single().execute()
+            record = response.data
+        except Exception as e:
+            print(f"[WARN] Status lookup failed for {record_id}: {e}")
+    if not record:
+        record = _find_local_record(record_id)
+    if not record:
+        return jsonify({'success': False, 'record_id': record_id, 'error': 'Record not found'}), 404
+    status = 'PENDING' if record.get('triage_level') == 'PENDING' else 'COMPLETE'
+    return jsonify({'success': True, 'record_id': record_id, 'status': status,
+                    'triage_level': None if status == 'PENDING' else record.get('triage_level')})
+
+
 if __name__ == '__main__':
     print("[DEBUG] Starting Flask app with debug=True")
     try:
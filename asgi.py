@@ -0,0 +1,353 @@
+"""Optional ASGI serving mode: the I/O-bound routes on one event loop per worker.
+
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT --workers 2
+    # or, keeping gunicorn.conf.py: gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+
+/analyze, /result, /abdm-record and /dashboard are served by the async views
+below. They await Supabase through supabase's async client and Gemini through
+``generate_content_async``. There is one async client per worker, so its
+HTTP connections are pooled and kept alive across requests. While a request
+waits on the network the worker serves others, so concurrency is no longer
+capped at the number of worker processes.
+
+The views share their logic with app.py:
+* parsing the form, staging and preprocessing uploads;
+* the diagnosis flow (`_diagnosis_steps`: prompt, triage cache, vision
+  fallback, response parsing and error mapping), driven here with awaits;
+* /analyze's record, triage job and response, and the busy check;
+* mapping results to records, the record cache and the local-store fallback;
+* the dashboard's keyset paging and templates.
+Only the network calls differ. File and CPU work (staging, Pillow, fsync'd
+local appends, local-store reads, the triage disk cache) runs in threads so it does not stall the loop. Background
+diagnoses (TRIAGE_ASYNC=1) still run on the triage queue's threads.
+
+Every other route (home, record form, /metrics, /export, /analyze/batch,
+status polling) is passed to the Flask app unchanged.
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+try:
+    from starlette.applications import Starlette
+    from starlette.responses import HTMLResponse, JSONResponse
+    from starlette.routing import Mount, Route
+    from starlette.staticfiles import StaticFiles
+except ImportError as e:
+    raise ImportError('The ASGI mode needs its optional dependencies: pip install -r requirements-asgi.txt') from e
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    import warnings
+    with warnings.catch_warnings():
+        # Deprecated in favour of a2wsgi, but still works and saves a dependency.
+        warnings.simplefilter('ignore')
+        from starlette.middleware.wsgi import WSGIMiddleware
+
+from flask import render_template
+
+import app as core
+from media_store import MAX_UPLOAD_BYTES, MediaTooLarge
+from metrics import REQUEST_SECONDS, route_context, timed
+from request_plan import AsyncRequestPlan
+
+async_supabase = None
+_async_ready = False
+_async_lock = asyncio.Lock()
+
+
+async def get_async_supabase():
+    """Return this worker's async Supabase client, creating it on first call. None in demo mode."""
+    global async_supabase, _async_ready
+    if _async_ready or async_supabase is not None:
+        return async_supabase
+    async with _async_lock:
+        if not _async_ready and async_supabase is None:
+            if core.SUPABASE_URL and core.SUPABASE_KEY:
+                try:
+                    from supabase import acreate_client
+                    async_supabase = await acreate_client(core.SUPABASE_URL, core.SUPABASE_KEY)
+                except Exception as e:
+                    print(f"[WARN] Could not create async Supabase client: {e}")
+                    async_supabase = None
+            _async_ready = True
+    return async_supabase
+
+
+def _base_url(request):
+    return f"{request.url.scheme}://{request.url.netloc}{request.scope.get('root_path', '')}"
+
+
+def render(request, template, **context):
+    """Render one of app.py's templates (url_for and template filters included) in a Flask request context."""
+    with core.app.test_request_context(request.url.path, base_url=_base_url(request),
+                                       query_string=request.url.query):
+        return HTMLResponse(render_template(template, **context))
+
+
+def _timed_route(rule, view):
+    """Record the view's latency in aarogya_request_seconds, as app.py's after_request hook does."""
+    async def endpoint(request):
+        started = time.perf_counter()
+        # Tasks and to_thread calls copy the context, so their stages are labelled with this route.
+        with route_context(rule):
+            response = await view(request)
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=rule, method=request.method,
+                                status=str(response.status_code))
+        return response
+    return endpoint
+
+
+async def _run_steps(steps):
+    """Async driver for `app._diagnosis_steps`: awaits each step's async call, or runs its blocking one in a thread."""
+    value, error = None, None
+    while True:
+        try:
+            fn, async_fn, args, kwargs = steps.throw(error) if error else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            if async_fn:
+                value = await async_fn(*args, **kwargs)
+            else:
+                value = await asyncio.to_thread(fn, *args, **kwargs)
+        except Exception as e:
+            error = e
+
+
+async def get_ai_diagnosis(symptoms_text, image_url, patient_info, image_data=None, image_mime_type=None,
+                           deadline=None):
+    """Async counterpart of `app.get_ai_diagnosis_from_api`: the same steps, with the Gemini call awaited."""
+    return await _run_steps(core._diagnosis_steps(symptoms_text, image_url, patient_info, image_data,
+                                                  image_mime_type, deadline))
+
+
+async def _save_record(client, record_to_insert):
+    """Async counterpart of `app._save_record`: returns (record_id, stored_locally)."""
+    if client:
+        try:
+            with timed('record_insert'):
+                response = await client.table('patient_records').insert([record_to_insert]).execute()
+            record_ids = core._records_saved([record_to_insert], response.data)
+            if record_ids:
+                return record_ids[0], False
+        except Exception as ex:
+            print(f"[ERROR] insert failed: {ex}")
+    record_ids = await asyncio.to_thread(core._save_records_locally, [record_to_insert])
+    return (record_ids[0] if record_ids else None), record_ids is not None
+
+
+class _Upload:
+    """The parts of werkzeug's FileStorage that app.py's media helpers read, over a Starlette UploadFile."""
+
+    def __init__(self, upload):
+        self.filename = upload.filename
+        self.mimetype = (upload.content_type or '').split(';')[0].strip()
+        self.stream = upload.file
+
+
+def _uploaded_file(form, field):
+    upload = form.get(field)
+    if upload is None or isinstance(upload, str) or not upload.filename:
+        return None
+    return _Upload(upload)
+
+
+async def _store_image(client, image, local_url):
+    with timed('image_upload'):
+        store = core.media_store
+        if image['staged']:
+            return await store.store_staged_async(client, image['staged'], image['name'], image['mime_type'], 'image',
+                                                  local_url)
+        url = await store.store_bytes_async(client, image['data'], image['name'], image['mime_type'], 'image',
+                                            local_url)
+        if image['thumbnail'] and url:
+            await store.store_bytes_async(client, image['thumbnail'], core.thumbnail_name(image['name']),
+                                          image['mime_type'], 'thumbnail', local_url)
+    return url
+
+
+async def _store_voice(client, voice, local_url):
+    with timed('voice_upload'):
+        return await core.media_store.store_staged_async(client, voice['staged'], voice['name'], voice['mime_type'],
+                                                         'voice', local_url)
+
+
+def _too_large(message=None):
+    return JSONResponse({'success': False, 'error': message or
+                         f'Upload too large (limit {round(MAX_UPLOAD_BYTES / (1024 * 1024), 1)} MB per submission)'},
+                        status_code=413)
+
+
+async def analyze(request):
+    busy = core._analyze_busy()
+    if busy:
+        body, status, headers = busy
+        return JSONResponse(body, status_code=status, headers=headers)
+    if int(request.headers.get('content-length') or 0) > MAX_UPLOAD_BYTES:
+        return _too_large()
+    try:
+        plan = AsyncRequestPlan(core.ANALYZE_DEADLINE)
+        form = await request.form()
+        try:
+            patient_info, symptoms_text = core._analyze_form(form)
+            # Stage both files first so an oversized one is rejected before anything is uploaded.
+            staged_media = await asyncio.to_thread(core._stage_media, _uploaded_file(form, 'image_file'),
+                                                   _uploaded_file(form, 'voice_file'))
+            try:
+                media = await asyncio.to_thread(core._prepare_media, staged_media)
+                client = await get_async_supabase()
+            except BaseException:
+                core._discard_staged(staged_media)
+                raise
+        finally:
+            await form.close()
+
+        base_url = _base_url(request)
+
+        def local_url(name):
+            return f'{base_url}/static/uploads/{name}'
+
+        # A task cancelled before it starts never reaches store_staged_async's cleanup.
+        if media['image']:
+            task = plan.start('image_upload', _store_image(client, media['image'], local_url))
+            core._discard_if_cancelled(task, media['image']['staged'])
+        if media['voice']:
+            task = plan.start('voice_upload', _store_voice(client, media['voice'], local_url))
+            core._discard_if_cancelled(task, media['voice']['staged'])
+        if not core.TRIAGE_ASYNC:
+            # The model gets the image bytes directly, so it need not wait for the upload's URL.
+            plan.start('diagnosis', get_ai_diagnosis(symptoms_text, None, patient_info, media['image_data'],
+                                                     media['image_mime_type'], deadline=plan.remaining()))
+
+        # Join before the insert: the record needs the media URLs (and, in sync mode, the diagnosis).
+        record_to_insert = core._analyze_record(
+            plan, patient_info, symptoms_text, await plan.result('image_upload'), await plan.result('voice_upload'),
+            None if core.TRIAGE_ASYNC else await plan.result('diagnosis', core.DEADLINE_RESULT))
+        new_record_id, stored_locally = await _save_record(client, record_to_insert)
+        job = core._analyze_job(new_record_id, record_to_insert, patient_info, media['image_data'],
+                                media['image_mime_type'], stored_locally)
+        # Usually just a queue put, but runs the diagnosis inline if the queue filled up meanwhile.
+        status = await asyncio.to_thread(core._submit_triage, new_record_id, job) if job else 'COMPLETE'
+        body, status_code = core._analyze_response(new_record_id, status)
+        return JSONResponse(body, status_code=status_code)
+
+    except MediaTooLarge as e:
+        return _too_large(str(e))
+    except Exception as e:
+        print(f"Error in /analyze: {e}")
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+
+def _record_views(template, label):
+    """The /<page>/<id> and /<page>?id= views for a record template, with app.py's error handling."""
+    async def by_path(request):
+        try:
+            record = await core.record_repository.get_async(request.path_params['record_id'],
+                                                            await get_async_supabase())
+            return render(request, template, record=record)
+        except Exception as e:
+            return HTMLResponse(f"Error fetching {label} data: {e}")
+
+    async def by_query(request):
+        record_id = request.query_params.get('id') or None
+        try:
+            record = await core.record_repository.get_async(record_id, await get_async_supabase())
+            return render(request, template, record=record)
+        except Exception as e:
+            print(f"Error fetching {label} by query id {record_id}: {e}")
+            return render(request, template, record=None)
+
+    return by_path, by_query
+
+
+result, result_query = _record_views('result.html', 'result')
+abdm_record, abdm_record_query = _record_views('abdm-record.html', 'ABDM')
+
+
+async def _fetch_triage_stats(client):
+    """Async counterpart of `app._fetch_triage_stats`; the fallback count queries run concurrently."""
+    try:
+        response = await client.rpc('triage_counts').execute()
+        return core._triage_stats_from_rows(response.data)
+    except Exception as e:
+        print(f"[WARN] triage_counts() unavailable, using count queries: {e}")
+
+    queries = [client.table('patient_records').select('id', count='exact', head=True).execute()]
+    for level in core.TRIAGE_LEVELS:
+        queries.append(client.table('patient_records').select(
+            'id', count='exact', head=True).eq('triage_level', level).execute())
+    total, *levels = await asyncio.gather(*queries)
+    stats = {'total': total.count or 0}
+    for level, response in zip(core.TRIAGE_LEVELS, levels):
+        stats[level.lower()] = response.count or 0
+    return stats
+
+
+async def _dashboard_stats(client):
+    if core.remote_rollups.is_stale():
+        try:
+            response = await client.rpc('triage_rollups').execute()
+            core.remote_rollups.seed(response.data or [])
+        except Exception as e:
+            print(f"[WARN] triage_rollups() unavailable, falling back to level counts: {e}")
+            core.remote_rollups.seed(core._rollup_rows_from_stats(await _fetch_triage_stats(client)),
+                                     breakdowns=False)
+    return core.remote_rollups.snapshot()
+
+
+async def dashboard(request):
+    filter_key = (request.query_params.get('filter') or 'ALL').upper()
+    triage_level = core.TRIAGE_FILTERS.get(filter_key)
+    if not triage_level:
+        filter_key = 'ALL'
+    try:
+        before, before_id = core._parse_dashboard_cursor(request.query_params.get('before'),
+                                                         request.query_params.get('before_id'))
+    except ValueError:
+        return HTMLResponse("Invalid dashboard cursor", status_code=400)
+    try:
+        client = await get_async_supabase()
+        if not client:
+            records, next_cursor = await asyncio.to_thread(
+                core._local_dashboard_page, triage_level, before, before_id)
+            await asyncio.to_thread(core.local_store.refresh)
+            stats = core.local_rollups.snapshot()
+        else:
+            # The page and the stats are independent: fetch them together.
+            response, stats = await asyncio.gather(
+                core._dashboard_page_query(client, triage_level, before, before_id).execute(),
+                _dashboard_stats(client))
+            records, next_cursor = core._dashboard_page(response.data or [])
+        return render(request, 'dashboard.html', records=records, stats=stats, filter=filter_key,
+                      next_cursor=next_cursor, is_first_page=not before)
+    except Exception as e:
+        return HTMLResponse(f"Error fetching dashboard data: {e}")
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    core.start_background_services()
+    if core.WARMUP_ON_START:
+        await get_async_supabase()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/analyze', _timed_route('/analyze', analyze), methods=['POST']),
+        Route('/result/{record_id}', _timed_route('/result/<record_id>', result)),
+        Route('/result', _timed_route('/result', result_query)),
+        Route('/abdm-record/{record_id}', _timed_route('/abdm-record/<record_id>', abdm_record)),
+        Route('/abdm-record', _timed_route('/abdm-record', abdm_record_query)),
+        Route('/dashboard', _timed_route('/dashboard', dashboard)),
+        Mount('/static', StaticFiles(directory=os.path.join(core.app.root_path, 'static')), name='static'),
+        # Everything else is the Flask app, run in a thread per request.
+        Mount('/', WSGIMiddleware(core.app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,204 @@
+"""Small in-process caches used by the app.
+
+`TTLCache` is a thread-safe LRU with a per-entry time-to-live and a bound on
+the number of entries. `TriageCache` builds on it to remember diagnosis
+results for identical requests (same prompt, image and model), with an
+optional on-disk tier so entries survive worker restarts.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, max_entries=512, ttl=3600, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (self._clock() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def _normalize(text):
+    return ' '.join(str(text or '').split()).lower()
+
+
+class TriageCache:
+    """Content-addressed cache of diagnosis results.
+
+    Keys are a SHA-256 over the model name, the normalised prompt and the image
+    digest, so a resubmitted form maps to the same entry even though its
+    upload gets a new file name. With ``disk_dir`` set, entries are also
+    written as JSON files there and read back on a memory miss.
+    """
+
+    def __init__(self, max_entries=512, ttl=86400, disk_dir=None, max_disk_entries=5000):
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self._lock = threading.Lock()
+        self._puts_since_prune = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    @staticmethod
+    def make_key(model_name, prompt_text, image_data=None):
+        h = hashlib.sha256()
+        h.update(_normalize(model_name).encode('utf-8'))
+        h.update(b'\0')
+        h.update(_normalize(prompt_text).encode('utf-8'))
+        h.update(b'\0')
+        if image_data:
+            h.update(hashlib.sha256(image_data).digest())
+        return h.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f'{key}.json')
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk_dir:
+            value = self._disk_get(key)
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def _disk_get(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as fh:
+                entry = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        remaining = entry.get('expires_at', 0) - time.time()
+        if remaining <= 0:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        value = entry.get('value')
+        self.memory.put(key, value, ttl=remaining)
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self.disk_dir:
+            self._disk_put(key, value)
+
+    def _disk_put(self, key, value):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as fh:
+                json.dump({'expires_at': time.time() + self.ttl, 'value': value}, fh, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as ex:
+            print(f"[WARN] Could not write triage cache entry: {ex}")
+            return
+        with self._lock:
+            self._puts_since_prune += 1
+            should_prune = self._puts_since_prune >= 100
+            if should_prune:
+                self._puts_since_prune = 0
+        if should_prune:
+            self.prune_disk()
+
+    def prune_disk(self):
+        """Drop expired files, then the oldest ones beyond ``max_disk_entries``."""
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+        entries.sort()
+        cutoff = time.time() - self.ttl
+        excess = len(entries) - self.max_disk_entries
+        for i, (mtime, path) in enumerate(entries):
+            if mtime < cutoff or i < excess:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.memory),
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'evictions': self.memory.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,115 @@
+"""Stream patient records out as NDJSON or CSV, optionally gzip-compressed.
+
+Rows are read page by page, from Supabase with a keyset cursor on
+(created_at, id) or from the local store's streaming iterator, and encoded
+one at a time into ~64 KiB chunks, so memory stays flat however many rows
+an extract covers. Used by the /export route and scripts/export_records.py.
+"""
+import csv
+import io
+import json
+import zlib
+
+from sync_engine import RECORD_COLUMNS
+
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+EXPORT_PAGE_SIZE = 1000
+CHUNK_BYTES = 64 * 1024
+
+
+def normalize_range(since=None, until=None):
+    """Accept dates or ISO timestamps; a bare ``until`` date covers that whole day."""
+    since = since or None
+    until = until or None
+    if until and len(until) == 10:
+        until = f'{until}T23:59:59.999999'
+    return since, until
+
+
+def iter_supabase_rows(client, triage_level=None, since=None, until=None, page_size=EXPORT_PAGE_SIZE,
+                       columns=RECORD_COLUMNS, table='patient_records'):
+    """Yield rows oldest first, one page per request, resuming after the last (created_at, id) seen."""
+    cursor = None
+    while True:
+        query = client.table(table).select(','.join(columns))
+        if triage_level:
+            query = query.eq('triage_level', triage_level)
+        if since:
+            query = query.gte('created_at', since)
+        if until:
+            query = query.lte('created_at', until)
+        if cursor:
+            created_at, record_id = cursor
+            query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{record_id})')
+        rows = query.order('created_at').order('id').limit(page_size).execute().data or []
+        for row in rows:
+            yield row
+        if len(rows) < page_size:
+            return
+        cursor = (rows[-1].get('created_at'), rows[-1].get('id'))
+
+
+def iter_local_rows(store, triage_level=None, since=None, until=None, columns=RECORD_COLUMNS):
+    for record in store.iter_records(triage_level=triage_level, since=since, until=until):
+        yield {k: record.get(k) for k in columns}
+
+
+def _ndjson(rows):
+    for row in rows:
+        yield (json.dumps(row, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+
+
+def _csv(rows, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(['' if row.get(k) is None else row.get(k) for k in columns])
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+    # Header only, for an empty extract.
+    if buf.tell():
+        yield buf.getvalue().encode('utf-8')
+
+
+def _batched(chunks, size=CHUNK_BYTES):
+    pending = []
+    pending_bytes = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_bytes += len(chunk)
+        if pending_bytes >= size:
+            yield b''.join(pending)
+            pending = []
+            pending_bytes = 0
+    if pending:
+        yield b''.join(pending)
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def encode(rows, fmt='ndjson', compress=False, columns=RECORD_COLUMNS):
+    """Turn an iterable of row dicts into an iterator of byte chunks."""
+    chunks = _csv(rows, list(columns)) if fmt == 'csv' else _ndjson(rows)
+    chunks = _batched(chunks)
+    return _gzip(chunks) if compress else chunks
+
+
+def content_type(fmt, compress):
+    return 'application/gzip' if compress else FORMATS[fmt][0] + '; charset=utf-8'
+
+
+def file_name(fmt, compress, stamp):
+    return f"patient_records_{stamp}.{FORMATS[fmt][1]}{'.gz' if compress else ''}"
@@ -0,0 +1,313 @@
+"""Rate-limit-aware wrapper around ``model.generate_content``.
+
+All Gemini calls in a process go through one `GeminiClient`, which
+
+* paces calls with token buckets for requests/minute and tokens/minute, so we
+  queue briefly instead of tripping the API quota;
+* retries 429 and 5xx responses with jittered exponential backoff;
+* bounds each call (including retries and waiting) by a deadline;
+* trips a circuit breaker after repeated upstream failures and fails fast
+  until a cool-down has passed.
+
+`generate_async` applies the same limits, retries and breaker for callers on
+an event loop (asgi.py), awaiting ``generate_content_async`` and sleeping
+with ``asyncio.sleep`` so other requests keep running.
+
+Clock, sleep and random source are injectable so the behaviour can be
+exercised with a fake model that injects latency and errors.
+"""
+import asyncio
+import random
+import threading
+import time
+
+
+class GeminiClientError(Exception):
+    """Base class for errors raised by the client itself."""
+
+
+class RateLimitExceeded(GeminiClientError):
+    """The local rate limit could not be satisfied before the deadline."""
+
+
+class CircuitOpenError(GeminiClientError):
+    """The upstream has been failing; calls are rejected until the breaker resets."""
+
+
+class DeadlineExceeded(GeminiClientError):
+    """The call (including retries) did not finish within its deadline."""
+
+
+class RetriesExhausted(GeminiClientError):
+    """Every attempt failed with a retryable error; the last error is chained."""
+
+
+_RETRYABLE_MARKERS = ('429', '500', '502', '503', '504', 'quota', 'rate limit', 'resource exhausted',
+                      'resourceexhausted', 'unavailable', 'internal error', 'deadline', 'timed out', 'timeout')
+
+
+def is_retryable(error):
+    """True for rate limiting and transient server/network errors."""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int) and (code == 429 or 500 <= code < 600):
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in _RETRYABLE_MARKERS)
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at ``rate_per_minute``."""
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity or rate_per_minute)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, amount=1):
+        """Take ``amount`` tokens if available. Returns seconds to wait otherwise (0 on success)."""
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            self._refill_locked()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    def acquire(self, amount=1, timeout=None):
+        """Block until ``amount`` tokens are taken. Returns False if that would exceed ``timeout``."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(amount)
+            if wait <= 0:
+                return True
+            if timeout is not None and waited + wait > timeout:
+                return False
+            self._sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, amount=1, timeout=None):
+        """`acquire` that waits with ``asyncio.sleep`` instead of blocking the thread."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(amount)
+            if wait <= 0:
+                return True
+            if timeout is not None and waited + wait > timeout:
+                return False
+            await asyncio.sleep(wait)
+            waited += wait
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state_locked()
+
+    def _current_state_locked(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow(self):
+        """Whether a call may proceed. In half-open state only one probe call is let through.
+
+        Returns a truthy value when the call may proceed: True, or HALF_OPEN when it is
+        the probe, which must then end in `record_success`, `record_failure` or `release`.
+        """
+        with self._lock:
+            state = self._current_state_locked()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return self.HALF_OPEN
+            return False
+
+    def release(self):
+        """End a probe that got no answer from upstream (local throttle, deadline) without counting it."""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._probe_in_flight = False
+
+
+def estimate_tokens(contents):
+    """Rough input token estimate (about 4 characters per token; images count as a flat 258)."""
+    if isinstance(contents, str):
+        return max(1, len(contents) // 4)
+    total = 0
+    for part in contents or []:
+        total += estimate_tokens(part) if isinstance(part, str) else 258
+    return max(1, total)
+
+
+class GeminiClient:
+    def __init__(self, requests_per_minute=60, tokens_per_minute=None, max_retries=3, base_delay=1.0,
+                 max_delay=16.0, deadline=30.0, breaker=None, clock=time.monotonic, sleep=time.sleep, rng=None):
+        self._clock = clock
+        self._sleep = sleep
+        self._rng = rng or random.Random()
+        self.request_bucket = TokenBucket(requests_per_minute, clock=clock, sleep=sleep) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute, clock=clock, sleep=sleep) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'attempts': 0, 'retries': 0, 'throttled': 0, 'rejected_open': 0, 'failures': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _backoff(self, attempt):
+        # Exponential backoff with "equal jitter": half fixed, half random.
+        cap = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return cap / 2 + self._rng.uniform(0, cap / 2)
+
+    def _admit(self):
+        """Count the call and pass the breaker. Returns True if this call is the half-open probe."""
+        self._count('calls')
+        admission = self.breaker.allow()
+        if not admission:
+            self._count('rejected_open')
+            raise CircuitOpenError('Gemini circuit breaker is open; upstream recently failing')
+        return admission == CircuitBreaker.HALF_OPEN
+
+    def _retry_delay(self, error, attempt, remaining):
+        """``(delay, is_probe)`` before retrying after ``error`` on attempt number ``attempt``; raises if we should not."""
+        if not is_retryable(error):
+            # Client-side problems (bad request, 404 model) mean upstream answered, so it is healthy.
+            self.breaker.record_success()
+            raise error
+        self._count('failures')
+        self.breaker.record_failure()
+        delay = self._backoff(attempt)
+        admission = False
+        if attempt + 1 <= self.max_retries and delay < remaining:
+            admission = self.breaker.allow()
+        if not admission:
+            raise RetriesExhausted(f'Gemini call failed after {attempt + 1} attempt(s): {error}') from error
+        self._count('retries')
+        return delay, admission == CircuitBreaker.HALF_OPEN
+
+    def generate(self, model, contents, deadline=None, **kwargs):
+        """Call ``model.generate_content(contents, **kwargs)`` under rate limits, retries and the breaker."""
+        budget = self.deadline if deadline is None else deadline
+        started = self._clock()
+        probe = self._admit()
+
+        attempt = 0
+        try:
+            while True:
+                remaining = budget - (self._clock() - started)
+                if remaining <= 0:
+                    raise DeadlineExceeded(f'Gemini call exceeded its {budget}s deadline')
+                if self.request_bucket and not self.request_bucket.acquire(1, timeout=remaining):
+                    self._count('throttled')
+                    raise RateLimitExceeded('Local rate limit: request quota for this minute is used up')
+                if self.token_bucket and not self.token_bucket.acquire(estimate_tokens(contents), timeout=remaining):
+                    self._count('throttled')
+                    raise RateLimitExceeded('Local rate limit: token quota for this minute is used up')
+
+                self._count('attempts')
+                remaining = budget - (self._clock() - started)
+                try:
+                    response = model.generate_content(contents, request_options={'timeout': max(remaining, 1)},
+                                                      **kwargs)
+                except Exception as e:
+                    delay, probe = self._retry_delay(e, attempt, budget - (self._clock() - started))
+                    attempt += 1
+                    self._sleep(delay)
+                    continue
+                self.breaker.record_success()
+                return response
+        finally:
+            # A probe that ended without an upstream verdict must not leave the breaker half-open forever.
+            if probe:
+                self.breaker.release()
+
+    async def generate_async(self, model, contents, deadline=None, **kwargs):
+        """`generate` for an event loop: awaits ``model.generate_content_async`` and never blocks while waiting."""
+        budget = self.deadline if deadline is None else deadline
+        started = self._clock()
+        probe = self._admit()
+
+        attempt = 0
+        try:
+            while True:
+                remaining = budget - (self._clock() - started)
+                if remaining <= 0:
+                    raise DeadlineExceeded(f'Gemini call exceeded its {budget}s deadline')
+                if self.request_bucket and not await self.request_bucket.acquire_async(1, timeout=remaining):
+                    self._count('throttled')
+                    raise RateLimitExceeded('Local rate limit: request quota for this minute is used up')
+                if self.token_bucket and not await self.token_bucket.acquire_async(estimate_tokens(contents),
+                                                                                   timeout=remaining):
+                    self._count('throttled')
+                    raise RateLimitExceeded('Local rate limit: token quota for this minute is used up')
+
+                self._count('attempts')
+                remaining = budget - (self._clock() - started)
+                try:
+                    response = await asyncio.wait_for(
+                        model.generate_content_async(contents, request_options={'timeout': max(remaining, 1)},
+                                                     **kwargs),
+                        timeout=max(remaining, 1))
+                except Exception as e:
+                    if isinstance(e, asyncio.TimeoutError):
+                        e = DeadlineExceeded(f'Gemini call exceeded its {budget}s deadline (timeout)')
+                    delay, probe = self._retry_delay(e, attempt, budget - (self._clock() - started))
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                self.breaker.record_success()
+                return response
+        finally:
+            if probe:
+                self.breaker.release()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self.counters)
+        snapshot['breaker_state'] = self.breaker.state
+        return snapshot
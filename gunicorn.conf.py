@@ -0,0 +1,31 @@
+"""Gunicorn settings picked up automatically from the working directory (see Procfile).
+
+Workers import app.py without touching the network; `post_worker_init` then
+starts the per-worker warm-up (Supabase client, Gemini model listing), pending
+job recovery and offline sync on a background thread, so they happen after the
+fork and never delay the worker from accepting requests. Set WARMUP_ON_START=0
+to resolve the clients on first use instead.
+
+`timeout` must outlast the longest request deadline, or the arbiter kills the
+worker mid-request (default 30 s) before /analyze can answer with its
+timed-out result. It defaults to the longer of ANALYZE_DEADLINE and
+BATCH_DEADLINE (/analyze/batch) plus a margin for saving the records; set
+GUNICORN_TIMEOUT to override.
+
+The same settings serve the optional ASGI app (asgi.py, see requirements-asgi.txt):
+
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT
+"""
+import os
+
+# Keep these defaults in step with app.py.
+ANALYZE_DEADLINE = float(os.environ.get('ANALYZE_DEADLINE', '45'))
+BATCH_DEADLINE = float(os.environ.get('BATCH_DEADLINE', '120'))
+TIMEOUT_MARGIN = 15
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', max(ANALYZE_DEADLINE, BATCH_DEADLINE) + TIMEOUT_MARGIN))
+
+
+def post_worker_init(worker):
+    from app import start_background_services
+    start_background_services()
@@ -0,0 +1,150 @@
+"""Downscale and re-encode uploaded photos before storage and inference.
+
+Phone cameras produce multi-megabyte images; the model and the dashboard need
+far less. Each photo is decoded (JPEGs in draft mode, so the decoder skips
+most of the full-resolution work), rotated per its EXIF orientation, capped on
+the long edge and re-encoded without metadata under a byte budget. A small
+thumbnail is produced alongside for the dashboard.
+
+Images whose (post-draft) pixel count exceeds IMAGE_MAX_PIXELS are not decoded
+at all: a small, highly compressed PNG can expand to gigabytes in memory.
+Larger images are box-reduced by an integer factor before any mode conversion,
+so the full-resolution bitmap is never copied.
+"""
+import io
+import os
+import threading
+import time
+import warnings
+
+
+IMAGE_MAX_EDGE = int(os.environ.get('IMAGE_MAX_EDGE', '1600'))
+IMAGE_TARGET_BYTES = int(os.environ.get('IMAGE_TARGET_BYTES', '300000'))
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'JPEG').upper()
+THUMBNAIL_EDGE = int(os.environ.get('THUMBNAIL_EDGE', '256'))
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', '40000000'))
+
+_FORMATS = {
+    'JPEG': ('image/jpeg', 'jpg'),
+    'WEBP': ('image/webp', 'webp'),
+}
+_QUALITIES = (85, 75, 65, 55, 45)
+
+# Modes Image.reduce averages correctly (palette indices can't be averaged).
+_REDUCIBLE_MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+_stats_lock = threading.Lock()
+stats = {'images': 0, 'failed': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0}
+
+
+class ImageTooLarge(ValueError):
+    """Raised when an upload's pixel count exceeds IMAGE_MAX_PIXELS."""
+
+
+def _to_rgb(img):
+    from PIL import Image
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _encode(img, fmt, target_bytes):
+    """Encode at the highest quality that fits ``target_bytes``, shrinking the image if none does."""
+    while True:
+        for quality in _QUALITIES:
+            buf = io.BytesIO()
+            # No exif= argument: metadata (GPS, device, timestamps) is dropped.
+            img.save(buf, fmt, quality=quality, optimize=True)
+            if buf.tell() <= target_bytes:
+                return buf.getvalue()
+        if max(img.size) <= 320:
+            return buf.getvalue()
+        img = img.resize((max(1, int(img.width * 0.75)), max(1, int(img.height * 0.75))))
+
+
+def preprocess_image(data, max_edge=None, target_bytes=None, fmt=None, thumbnail_edge=None, max_pixels=None):
+    """Return a dict with the re-encoded image and thumbnail, or None if ``data`` is not a decodable image.
+
+    ``data`` is the upload as bytes, or the path of a staged upload (decoded from
+    disk without reading it into memory first).
+    Keys: data, mime_type, ext, thumbnail, bytes_in, bytes_out, seconds.
+    """
+    from PIL import Image, ImageOps
+
+    max_edge = max_edge or IMAGE_MAX_EDGE
+    target_bytes = target_bytes or IMAGE_TARGET_BYTES
+    fmt = (fmt or IMAGE_FORMAT).upper()
+    if fmt not in _FORMATS:
+        fmt = 'JPEG'
+    thumbnail_edge = thumbnail_edge or THUMBNAIL_EDGE
+    max_pixels = max_pixels or IMAGE_MAX_PIXELS
+    # Pillow only warns between MAX_IMAGE_PIXELS and twice that; make it fatal. Re-applied
+    # on every call (a no-op when already first) in case something reset the filters.
+    warnings.simplefilter('error', Image.DecompressionBombWarning)
+
+    started = time.perf_counter()
+    try:
+        if isinstance(data, (bytes, bytearray)):
+            source, bytes_in = io.BytesIO(data), len(data)
+        else:
+            source, bytes_in = data, os.path.getsize(data)
+        img = Image.open(source)
+        if img.format == 'JPEG':
+            # Let libjpeg decode at a reduced scale (1/2, 1/4, 1/8) that still covers max_edge.
+            img.draft('RGB', (max_edge, max_edge))
+        # Only the header has been read so far; refuse before the decoder allocates the bitmap.
+        if img.width * img.height > max_pixels:
+            raise ImageTooLarge(f'{img.width}x{img.height} exceeds IMAGE_MAX_PIXELS ({max_pixels})')
+        factor = max(img.size) // max_edge
+        if factor >= 2 and img.mode in _REDUCIBLE_MODES:
+            img = img.reduce(factor)
+        img = ImageOps.exif_transpose(img)
+        img = _to_rgb(img)
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        encoded = _encode(img, fmt, target_bytes)
+
+        thumb = img.copy()
+        thumb.thumbnail((thumbnail_edge, thumbnail_edge), Image.LANCZOS)
+        thumb_buf = io.BytesIO()
+        thumb.save(thumb_buf, fmt, quality=70, optimize=True)
+    except Exception as e:
+        print(f"[WARN] Image preprocessing failed, keeping original upload: {e}")
+        with _stats_lock:
+            stats['failed'] += 1
+        return None
+
+    elapsed = time.perf_counter() - started
+    mime_type, ext = _FORMATS[fmt]
+    with _stats_lock:
+        stats['images'] += 1
+        stats['bytes_in'] += bytes_in
+        stats['bytes_out'] += len(encoded)
+        stats['seconds'] += elapsed
+    print(f"[INFO] Image preprocessed: {bytes_in // 1024}KB -> {len(encoded) // 1024}KB "
+          f"({img.width}x{img.height}) in {elapsed * 1000:.0f}ms")
+    return {
+        'data': encoded,
+        'mime_type': mime_type,
+        'ext': ext,
+        'thumbnail': thumb_buf.getvalue(),
+        'bytes_in': bytes_in,
+        'bytes_out': len(encoded),
+        'seconds': elapsed,
+    }
+
+
+def get_stats():
+    """Totals since start-up, including bytes saved, for tuning the size budget."""
+    with _stats_lock:
+        snapshot = dict(stats)
+    snapshot['bytes_saved'] = snapshot['bytes_in'] - snapshot['bytes_out']
+    return snapshot
+
+
+def thumbnail_name(file_name):
+    return f"thumb_{file_name}"
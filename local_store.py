@@ -0,0 +1,489 @@
+"""Offline record store backed by data/local_records.jsonl.
+
+Records are appended one JSON object per line. An in-memory index maps each
+record id to the byte offset of its latest line, so lookups seek straight to
+one line instead of parsing the whole file. The index is built once and then
+extended incrementally; the file's size and mtime are checked on every access
+so lines appended by other workers are picked up without a full rebuild.
+
+`iter_records` streams records (forwards, or last-written-first from the file
+tail) with triage/date filters, so callers never materialise the whole history.
+`page` returns newest-first pages on the same (created_at, id) keyset the
+dashboard uses for Supabase. Alongside the offsets the index keeps the latest
+version's (created_at, id) keys sorted, overall and per triage level, so a
+page is a bisect plus one seek per record on it, however long the history.
+
+Appends are safe across gunicorn workers and crashes: each write happens under
+an exclusive flock on the file and is fsync'd before `append` returns, and a
+torn last line left by a crash mid-write is moved to `<path>.torn` before the
+next write. Concurrent appends within a process are group-committed: while
+one thread holds the lock and fsyncs, the others queue up, and the next
+thread through writes all of their lines with one write and one fsync.
+"""
+import bisect
+import json
+import os
+import re
+import sys
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are serialised within the process only
+    fcntl = None
+
+# Matches the id field as written by json.dumps (top-level, default separators). Inside string
+# values quotes are escaped, so this cannot match symptom text. Lines it misses are fully parsed.
+_ID_RE = re.compile(rb'(?:^\{|, )"id": (?:"([^"\\]*)"|(-?\d+))[,}]')
+
+_CREATED_KEY = b'"created_at": "'
+_LEVEL_KEY = b'"triage_level": "'
+
+
+def _line_field(raw, key):
+    """A top-level string field of a raw line as written by json.dumps (same reasoning as _ID_RE),
+    or None if it is missing, not a plain string, or ambiguous."""
+    start = raw.find(key)
+    if start < 0 or not (start == 1 or raw.startswith(b', ', start - 2)):
+        return None
+    start += len(key)
+    stop = raw.find(b'"', start)
+    if stop < 0 or raw.find(b'\\', start, stop) >= 0:
+        return None
+    return raw[start:stop].decode('utf-8')
+
+
+def _line_sort_fields(raw):
+    """(created_at, triage_level) of a raw line, parsing it only if the fast path is unsure."""
+    created_at = _line_field(raw, _CREATED_KEY)
+    level = _line_field(raw, _LEVEL_KEY)
+    if created_at is None or level is None:
+        try:
+            record = json.loads(raw)
+        except Exception:
+            return created_at or '', level
+        created_at, level = record.get('created_at') or '', record.get('triage_level')
+    return created_at, level
+
+
+def _line_id(raw):
+    match = _ID_RE.search(raw)
+    if match:
+        return (match.group(1) or match.group(2)).decode('utf-8')
+    try:
+        record_id = json.loads(raw).get('id')
+    except Exception:
+        return None
+    return None if record_id is None else str(record_id)
+
+
+class _Commit:
+    """Lines from one `append_many` call, waiting to be written by whichever thread commits next."""
+
+    def __init__(self, records, lines):
+        self.records = records
+        self.lines = lines
+        self.done = False
+        self.error = None
+
+
+class LocalRecordStore:
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._index = {}
+        self._sort_keys = {}
+        self._sorted = {None: []}
+        self._indexed_size = 0
+        self._indexed_mtime = None
+        self._indexed_ino = None
+        self._listeners = []
+        self._commit_lock = threading.Lock()
+        self._queue_lock = threading.Lock()
+        self._queue = []
+        self.commit_stats = {'commits': 0, 'records': 0, 'torn_repairs': 0}
+
+    def subscribe(self, listener):
+        """Register an object with ``add(record)`` and ``reset()``, called for every newly indexed line.
+
+        Each line is delivered once per process: from the initial scan, from our own
+        appends, or from tail scans picking up other writers' appends.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            # Drop the index so the next access replays the file to every listener.
+            self._reset_index_locked()
+
+    def _reset_index_locked(self):
+        self._index = {}
+        self._sort_keys = {}
+        self._sorted = {None: []}
+        self._indexed_size = 0
+        self._indexed_mtime = None
+        self._indexed_ino = None
+        for listener in self._listeners:
+            listener.reset()
+
+    def _index_locked(self, record_id, offset, created_at, level, resort=True):
+        """Point ``record_id`` at the line at ``offset`` and move its sort key if it changed.
+
+        Sort keys are (created_at, id, triage_level) tuples, shared between the overall and the
+        per-level lists. ``resort=False`` only records the key; the caller rebuilds the lists.
+        """
+        self._index[record_id] = offset
+        created_at = created_at if isinstance(created_at, str) else str(created_at or '')
+        level = sys.intern(level) if isinstance(level, str) else None
+        previous = self._sort_keys.get(record_id)
+        if previous is not None and previous[0] == created_at and previous[2] == level:
+            return
+        key = (created_at, record_id, level)
+        self._sort_keys[record_id] = key
+        if not resort:
+            return
+        if previous is not None:
+            for name in (None, previous[2]) if previous[2] else (None,):
+                keys = self._sorted[name]
+                i = bisect.bisect_left(keys, previous)
+                if i < len(keys) and keys[i] is previous:
+                    del keys[i]
+        # Records mostly arrive in created_at order, so these usually append.
+        bisect.insort(self._sorted[None], key)
+        if level:
+            bisect.insort(self._sorted.setdefault(level, []), key)
+
+    def _rebuild_sorted_locked(self):
+        """Sort every key at once, after a full scan (cheaper than one insort per line)."""
+        keys = sorted(self._sort_keys.values())
+        self._sorted = {None: keys}
+        for key in keys:
+            if key[2]:
+                self._sorted.setdefault(key[2], []).append(key)
+
+    def _deliver(self, record):
+        for listener in self._listeners:
+            try:
+                listener.add(record)
+            except Exception as ex:
+                print(f"[WARN] Local store listener failed: {ex}")
+
+    def _scan(self, start):
+        """Index lines from byte offset ``start`` to EOF. Returns the offset after the last full line."""
+        offset = start
+        # A scan from the start indexes everything, so sort once at the end instead of per line.
+        bulk = start == 0
+        with open(self.path, 'rb') as fh:
+            fh.seek(start)
+            for raw in fh:
+                if not raw.endswith(b'\n'):
+                    # Partial line still being written; pick it up on the next refresh.
+                    break
+                line_offset = offset
+                offset += len(raw)
+                if not raw.strip():
+                    continue
+                record_id = _line_id(raw)
+                if record_id is None:
+                    continue
+                record = None
+                if self._listeners:
+                    # Listeners need the parsed record anyway; take the sort fields from it.
+                    try:
+                        record = json.loads(raw)
+                    except Exception:
+                        pass
+                if isinstance(record, dict):
+                    self._index_locked(record_id, line_offset, record.get('created_at') or '',
+                                       record.get('triage_level'), resort=not bulk)
+                    self._deliver(record)
+                else:
+                    self._index_locked(record_id, line_offset, *_line_sort_fields(raw), resort=not bulk)
+        if bulk:
+            self._rebuild_sorted_locked()
+        return offset
+
+    def _refresh_locked(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._indexed_size:
+                self._reset_index_locked()
+            return
+        if (st.st_size == self._indexed_size and st.st_mtime == self._indexed_mtime
+                and st.st_ino == self._indexed_ino):
+            return
+        if st.st_size < self._indexed_size or (self._indexed_ino is not None and st.st_ino != self._indexed_ino):
+            # File was truncated or replaced (e.g. compacted); start over.
+            self._reset_index_locked()
+        self._indexed_size = self._scan(self._indexed_size)
+        self._indexed_mtime = st.st_mtime
+        self._indexed_ino = st.st_ino
+
+    def refresh(self):
+        with self._lock:
+            self._refresh_locked()
+
+    def get(self, record_id):
+        """Return the latest saved version of ``record_id``, or None."""
+        if not record_id:
+            return None
+        with self._lock:
+            self._refresh_locked()
+            offset = self._index.get(str(record_id))
+            if offset is None:
+                return None
+            try:
+                with open(self.path, 'rb') as fh:
+                    fh.seek(offset)
+                    return json.loads(fh.readline())
+            except Exception as ex:
+                print(f"[WARN] Could not read local record {record_id}: {ex}")
+                return None
+
+    def _lines_forward(self, end):
+        """Yield (offset, raw_line) for complete lines before ``end``."""
+        offset = 0
+        with open(self.path, 'rb') as fh:
+            for raw in fh:
+                if offset >= end:
+                    return
+                yield offset, raw
+                offset += len(raw)
+
+    def _lines_reverse(self, end, block_size=1 << 16):
+        """Yield (offset, raw_line) for complete lines before ``end``, last line first.
+
+        Reads fixed-size blocks backwards from ``end`` so the newest records are
+        reached without touching the rest of the file.
+        """
+        with open(self.path, 'rb') as fh:
+            pos = end
+            head = b''
+            while pos > 0:
+                size = min(block_size, pos)
+                pos -= size
+                fh.seek(pos)
+                lines = (fh.read(size) + head).split(b'\n')
+                # lines[0] may be the tail of a line that starts in an earlier block.
+                head = lines[0]
+                offset = pos + len(head) + 1
+                entries = []
+                for line in lines[1:]:
+                    entries.append((offset, line))
+                    offset += len(line) + 1
+                for entry in reversed(entries):
+                    yield entry
+            if head:
+                yield 0, head
+
+    def iter_records(self, triage_level=None, since=None, until=None, limit=None, reverse=False):
+        """Stream the latest version of each record, optionally filtered.
+
+        ``since``/``until`` bound ``created_at`` (ISO strings or datetimes, inclusive);
+        ``reverse=True`` yields the most recently written first by reading from the end
+        of the file. That is not ``created_at`` order: a record updated after newer
+        inserts (PENDING -> final) moves to the tail. Use `page` for ordered paging.
+        Only one record is held in memory at a time.
+        """
+        if limit is not None and limit <= 0:
+            return
+        since = since.isoformat() if hasattr(since, 'isoformat') else since
+        until = until.isoformat() if hasattr(until, 'isoformat') else until
+        with self._lock:
+            self._refresh_locked()
+            end = self._indexed_size
+        if not end:
+            return
+        lines = self._lines_reverse(end) if reverse else self._lines_forward(end)
+        level_marker = f'"triage_level": "{triage_level}"'.encode('utf-8') if triage_level else None
+        yielded = 0
+        for offset, raw in lines:
+            if not raw.strip():
+                continue
+            # Cheap checks on the raw bytes before paying for a full parse.
+            if level_marker and level_marker not in raw:
+                continue
+            record_id = _line_id(raw)
+            # Older versions of a record (e.g. its PENDING line) are superseded by later lines.
+            if record_id is None or self._index.get(record_id) != offset:
+                continue
+            try:
+                record = json.loads(raw)
+            except Exception:
+                continue
+            if triage_level and record.get('triage_level') != triage_level:
+                continue
+            created_at = record.get('created_at') or ''
+            if since and created_at < since:
+                continue
+            if until and created_at > until:
+                continue
+            yield record
+            yielded += 1
+            if limit is not None and yielded >= limit:
+                return
+
+    def page(self, triage_level=None, before=None, before_id=None, limit=50):
+        """Up to ``limit`` records ordered by (created_at, id) descending, strictly after the cursor.
+
+        The cursor is the (created_at, id) of the last record on the previous page; without
+        ``before_id`` every record at ``before`` is skipped. The sorted keys locate the page;
+        only its own lines are read.
+        """
+        if limit <= 0:
+            return []
+        with self._lock:
+            self._refresh_locked()
+            keys = self._sorted.get(triage_level) if triage_level else self._sorted[None]
+            if not keys:
+                return []
+            if before is None:
+                stop = len(keys)
+            else:
+                # (before,) sorts ahead of every (before, id), so it skips all records at ``before``.
+                stop = bisect.bisect_left(keys, (before, before_id) if before_id is not None else (before,))
+            offsets = [self._index[key[1]] for key in keys[max(0, stop - limit):stop]]
+            records = []
+            try:
+                with open(self.path, 'rb') as fh:
+                    for offset in reversed(offsets):
+                        fh.seek(offset)
+                        records.append(json.loads(fh.readline()))
+            except Exception as ex:
+                print(f"[WARN] Could not read local records page: {ex}")
+                return []
+        return records
+
+    def append(self, record):
+        """Append ``record`` (which must carry an ``id``) and index it."""
+        self.append_many([record])
+
+    def append_many(self, records):
+        """Append several records durably; returns once they are on disk. Each must carry an ``id``."""
+        lines = [(json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8') for record in records]
+        if not lines:
+            return
+        commit = _Commit(records, lines)
+        with self._queue_lock:
+            self._queue.append(commit)
+        with self._commit_lock:
+            # A thread that went before us may already have written our lines along with its own.
+            if not commit.done:
+                with self._queue_lock:
+                    batch, self._queue = self._queue, []
+                self._write_batch(batch)
+        if commit.error:
+            raise commit.error
+
+    def _open_locked(self):
+        """Open the log for appending and take the cross-process write lock."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            if not fcntl:
+                return fd
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # The file may have been replaced (e.g. compacted) while we waited for the lock.
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            except OSError:
+                os.close(fd)
+                raise
+            os.close(fd)
+
+    def _repair_tail(self, fd):
+        """Move a partial last line (a crash mid-write) to ``<path>.torn``. Call with the write lock held."""
+        size = os.fstat(fd).st_size
+        if not size or os.pread(fd, 1, size - 1) == b'\n':
+            return 0
+        keep = size
+        while keep > 0:
+            start = max(0, keep - (1 << 16))
+            newline = os.pread(fd, keep - start, start).rfind(b'\n')
+            if newline != -1:
+                keep = start + newline + 1
+                break
+            keep = start
+        fragment = os.pread(fd, size - keep, keep)
+        with open(f'{self.path}.torn', 'ab') as torn:
+            torn.write(fragment + b'\n')
+            torn.flush()
+            os.fsync(torn.fileno())
+        os.ftruncate(fd, keep)
+        self.commit_stats['torn_repairs'] += 1
+        print(f"[WARN] Moved a torn {len(fragment)}-byte line at the end of {self.path} to {self.path}.torn")
+        return len(fragment)
+
+    @contextmanager
+    def write_lock(self):
+        """Hold the write lock every appender takes, e.g. while a maintenance script rewrites the file."""
+        with self._commit_lock:
+            fd = self._open_locked()
+            try:
+                yield fd
+            finally:
+                os.close(fd)
+
+    def repair(self):
+        """Repair a torn tail now (normally done lazily by the next append). Returns bytes moved."""
+        with self.write_lock() as fd:
+            return self._repair_tail(fd)
+
+    def _write_batch(self, batch):
+        payload = b''.join(line for commit in batch for line in commit.lines)
+        try:
+            fd = self._open_locked()
+            try:
+                self._repair_tail(fd)
+                offset = os.lseek(fd, 0, os.SEEK_END)
+                ino = os.fstat(fd).st_ino
+                view = memoryview(payload)
+                while view:
+                    view = view[os.write(fd, view):]
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)  # also releases the flock
+        except Exception as ex:
+            for commit in batch:
+                commit.error = ex
+                commit.done = True
+            return
+        self.commit_stats['commits'] += 1
+        self.commit_stats['records'] += sum(len(commit.records) for commit in batch)
+
+        with self._lock:
+            if offset == self._indexed_size and self._indexed_ino in (None, ino):
+                # Nothing unindexed before our lines: index them without re-reading the file.
+                for commit in batch:
+                    for record, line in zip(commit.records, commit.lines):
+                        self._index_locked(str(record['id']), offset, record.get('created_at') or '',
+                                           record.get('triage_level'))
+                        offset += len(line)
+                        self._deliver(record)
+                self._indexed_size = offset
+                try:
+                    st = os.stat(self.path)
+                    self._indexed_mtime, self._indexed_ino = st.st_mtime, st.st_ino
+                except OSError:
+                    self._indexed_mtime = None
+            else:
+                # Other writers' lines came first (or a concurrent refresh already read ours):
+                # scanning from the indexed size picks up everything once, in file order.
+                self._refresh_locked()
+        for commit in batch:
+            commit.done = True
+
+    def __contains__(self, record_id):
+        with self._lock:
+            self._refresh_locked()
+            return str(record_id) in self._index
+
+    def __len__(self):
+        with self._lock:
+            self._refresh_locked()
+            return len(self._index)
@@ -0,0 +1,267 @@
+"""Size-bounded, content-addressed storage for uploaded photos and voice notes.
+
+An upload is copied in fixed-size chunks from the request into a staging file
+(data/incoming by default, outside the publicly served static/ tree), hashing
+as it goes and stopping as soon as it passes the limit for its type, so no
+upload is ever held in memory whole. The file is then named after its SHA-256
+and either streamed to the Supabase `media` bucket or renamed into
+static/uploads (a rename when both are on one filesystem, a copy otherwise).
+Resubmitting the same file maps to the same name, so it is stored once.
+
+Whoever stages a file owns it until `store_staged` takes it over: callers
+discard staged files on their error paths, and `sweep_staging` removes what
+a crashed worker left behind.
+"""
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import threading
+import uuid
+
+from caching import TTLCache
+from metrics import FALLBACKS
+
+
+CHUNK_SIZE = 64 * 1024
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', str(15 * 1024 * 1024)))
+MAX_VOICE_BYTES = int(os.environ.get('MAX_VOICE_BYTES', str(10 * 1024 * 1024)))
+# Whole-request cap, enforced by Flask (MAX_CONTENT_LENGTH) before the form is parsed.
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(MAX_IMAGE_BYTES + MAX_VOICE_BYTES + 1024 * 1024)))
+
+
+class MediaTooLarge(Exception):
+    def __init__(self, label, limit):
+        super().__init__(f'{label} upload exceeds the {round(limit / (1024 * 1024), 1)} MB limit')
+        self.label = label
+        self.limit = limit
+
+
+def _is_duplicate_error(error):
+    text = str(error).lower()
+    return '409' in text or 'duplicate' in text or 'already exists' in text
+
+
+class StagedUpload:
+    """An upload copied to disk: ``path``, ``sha256`` (hex), ``size`` in bytes."""
+
+    def __init__(self, path, sha256, size):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+
+    def content_name(self, prefix, ext):
+        return f'{prefix}_{self.sha256[:32]}.{ext}'
+
+    def read(self):
+        with open(self.path, 'rb') as fh:
+            return fh.read()
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class MediaStore:
+    def __init__(self, client_getter, uploads_dir, local_url, bucket='media', known_entries=4096, staging_dir=None):
+        """``client_getter`` returns the Supabase client (or None); ``local_url(name)`` builds the URL
+        of a file saved under ``uploads_dir``. Keep ``staging_dir`` out of any served directory."""
+        self._get_client = client_getter
+        self.uploads_dir = uploads_dir
+        self.staging_dir = staging_dir or os.path.join(tempfile.gettempdir(), 'aarogya_incoming')
+        self._local_url = local_url
+        self.bucket = bucket
+        # name -> URL of objects already stored by this process, to skip repeat uploads.
+        self._known = TTLCache(max_entries=known_entries, ttl=3600)
+        self._lock = threading.Lock()
+        self.counters = {'staged': 0, 'staged_bytes': 0, 'rejected': 0, 'uploaded': 0, 'deduplicated': 0,
+                         'local_saved': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def stage(self, stream, limit, label):
+        """Copy ``stream`` to a staging file, hashing on the fly. Raises MediaTooLarge past ``limit`` bytes."""
+        os.makedirs(self.staging_dir, exist_ok=True)
+        path = os.path.join(self.staging_dir, uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(path, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > limit:
+                        raise MediaTooLarge(label, limit)
+                    digest.update(chunk)
+                    out.write(chunk)
+        except BaseException as e:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            if isinstance(e, MediaTooLarge):
+                self._count('rejected')
+            raise
+        self._count('staged')
+        self._count('staged_bytes', size)
+        return StagedUpload(path, digest.hexdigest(), size)
+
+    def sweep_staging(self, max_age=3600):
+        """Remove staging files older than ``max_age`` seconds (left by a crash). Returns how many."""
+        removed = 0
+        cutoff = time.time() - max_age
+        try:
+            entries = list(os.scandir(self.staging_dir))
+        except OSError:
+            return 0
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            print(f"[INFO] Removed {removed} stale staged upload(s) from {self.staging_dir}")
+        return removed
+
+    def _upload(self, name, body, content_type, label):
+        client = self._get_client()
+        if not client:
+            return None
+        storage = client.storage.from_(self.bucket)
+        try:
+            upload_resp = storage.upload(file=body, path=name, file_options={"content-type": content_type})
+            print(f"[DEBUG] {label} upload response: {getattr(upload_resp, 'error', upload_resp)}")
+            self._count('uploaded')
+        except Exception as ex:
+            if not self._duplicate(ex, label):
+                return None
+        return storage.get_public_url(name)
+
+    async def _upload_async(self, client, name, body, content_type, label):
+        storage = client.storage.from_(self.bucket)
+        try:
+            upload_resp = await storage.upload(file=body, path=name, file_options={"content-type": content_type})
+            print(f"[DEBUG] {label} upload response: {getattr(upload_resp, 'error', upload_resp)}")
+            self._count('uploaded')
+        except Exception as ex:
+            if not self._duplicate(ex, label):
+                return None
+        return await storage.get_public_url(name)
+
+    def _duplicate(self, error, label):
+        if not _is_duplicate_error(error):
+            print(f"[ERROR] {label} upload failed: {error}")
+            return False
+        # Same content, same name: the earlier copy is the one we want.
+        self._count('deduplicated')
+        return True
+
+    def _known_url(self, name):
+        url = self._known.get(name)
+        if url:
+            self._count('deduplicated')
+        return url
+
+    def store_bytes(self, data, name, content_type, label):
+        """Store an in-memory object (a re-encoded photo, a thumbnail). Returns its URL or None."""
+        url = self._known_url(name)
+        if url:
+            return url
+        url = self._upload(name, data, content_type, label)
+        if not url:
+            url = self._save_local(name, label, data=data)
+        if url:
+            self._known.put(name, url)
+        return url
+
+    def store_staged(self, staged, name, content_type, label):
+        """Store a staged upload under ``name`` and remove the staging file. Returns its URL or None."""
+        try:
+            url = self._known_url(name)
+            if url:
+                return url
+            if self._get_client():
+                with open(staged.path, 'rb') as fh:
+                    url = self._upload(name, fh, content_type, label)
+            if not url:
+                url = self._save_local(name, label, staged_path=staged.path)
+            if url:
+                self._known.put(name, url)
+            return url
+        finally:
+            staged.discard()
+
+    async def store_bytes_async(self, client, data, name, content_type, label, local_url=None):
+        """`store_bytes` through an async Supabase ``client`` (or None). ``local_url`` overrides the URL builder."""
+        url = self._known_url(name)
+        if url:
+            return url
+        if client:
+            url = await self._upload_async(client, name, data, content_type, label)
+        if not url:
+            url = self._save_local(name, label, data=data, local_url=local_url)
+        if url:
+            self._known.put(name, url)
+        return url
+
+    async def store_staged_async(self, client, staged, name, content_type, label, local_url=None):
+        """`store_staged` through an async Supabase ``client`` (or None)."""
+        try:
+            url = self._known_url(name)
+            if url:
+                return url
+            if client:
+                with open(staged.path, 'rb') as fh:
+                    url = await self._upload_async(client, name, fh, content_type, label)
+            if not url:
+                url = self._save_local(name, label, staged_path=staged.path, local_url=local_url)
+            if url:
+                self._known.put(name, url)
+            return url
+        finally:
+            staged.discard()
+
+    def _save_local(self, name, label, data=None, staged_path=None, local_url=None):
+        local_url = local_url or self._local_url
+        FALLBACKS.inc(kind=f'{label}_local_save')
+        try:
+            os.makedirs(self.uploads_dir, exist_ok=True)
+            local_path = os.path.join(self.uploads_dir, name)
+            if os.path.exists(local_path):
+                self._count('deduplicated')
+                return local_url(name)
+            if staged_path:
+                try:
+                    os.replace(staged_path, local_path)
+                except OSError as ex:
+                    if ex.errno != errno.EXDEV:
+                        raise
+                    # Staging dir on another filesystem: copy next to the target, then rename.
+                    tmp_path = f'{local_path}.{uuid.uuid4().hex}.tmp'
+                    shutil.copyfile(staged_path, tmp_path)
+                    os.replace(tmp_path, local_path)
+            else:
+                tmp_path = f'{local_path}.{uuid.uuid4().hex}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, local_path)
+            self._count('local_saved')
+            print(f"[INFO] Saved {label} locally to {local_path}")
+            return local_url(name)
+        except Exception as ex:
+            print(f"[ERROR] Local {label} save failed: {ex}")
+            return None
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
@@ -0,0 +1,197 @@
+"""Lightweight in-process metrics with Prometheus text exposition.
+
+Counters and histograms are plain dicts keyed by label values behind a lock;
+recording a sample is a dict lookup and a bisect, cheap enough to leave on in
+production. `timed()` wraps a block and records its duration into a
+histogram, labelled with the stage and the route it ran for. The route is
+set once per request (`route_context`) and carried in a context variable,
+so shared helpers deep in a request, or on a thread the request started,
+need not be passed it. Gauges are read from callbacks at scrape time, which lets existing
+components (cache, queue, Gemini client) expose their own counters without
+being rewritten around this module.
+
+Values are per process: under gunicorn each worker serves its own /metrics.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}' for key, value in items]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, (list(s[0]), s[1], s[2])) for k, s in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, 'le="%s"' % bound)
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {round(total, 6)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+class CallbackGauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, callback, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._callback = callback
+
+    def render(self):
+        try:
+            value = self._callback()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [f'{self.name}{_format_labels(self.labels, (k,))} {v}' for k, v in sorted(value.items())]
+        return [f'{self.name} {value}']
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, callback, labels=()):
+        """Register a gauge read from ``callback()`` at scrape time (a number, or {label_value: number})."""
+        return self._register(CallbackGauge(name, help_text, callback, labels))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        out = []
+        for metric in metrics:
+            out.append(f'# HELP {metric.name} {metric.help}')
+            out.append(f'# TYPE {metric.name} {metric.kind}')
+            out.extend(metric.render())
+        return '\n'.join(out) + '\n'
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    'aarogya_stage_seconds', 'Time spent in each stage of a triage request, by route.', labels=('stage', 'route'))
+REQUEST_SECONDS = registry.histogram(
+    'aarogya_request_seconds', 'HTTP request latency by route.', labels=('route', 'method', 'status'))
+FALLBACKS = registry.counter(
+    'aarogya_fallbacks_total', 'Degraded-path events (local save, parse error, rate limit, ...).', labels=('kind',))
+GEMINI_TOKENS = registry.histogram(
+    'aarogya_gemini_tokens', 'Tokens per Gemini call, from usage_metadata.', labels=('direction',),
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192))
+
+
+_route = contextvars.ContextVar('aarogya_route', default='none')
+
+
+def set_route(route):
+    """Make ``route`` the label for stages timed in this context; returns a token for `reset_route`."""
+    return _route.set(route)
+
+
+def reset_route(token):
+    _route.reset(token)
+
+
+@contextmanager
+def route_context(route):
+    token = set_route(route)
+    try:
+        yield
+    finally:
+        reset_route(token)
+
+
+@contextmanager
+def timed(stage, route=None):
+    """Record the duration of the enclosed block under ``stage``, even if it raises.
+
+    ``route`` defaults to the one set for the current request (or worker).
+    """
+    route = route or _route.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage, route=route)
@@ -0,0 +1,147 @@
+"""Process-wide cache of the Gemini model used for triage.
+
+Listing models is a network round-trip, so the registry resolves the preferred
+model once (at worker start-up when warm-up is on, see `app.warm_up`), keeps a
+warm ``GenerativeModel`` handle, and only re-lists when the TTL expires or a
+model starts answering 404 / "not found".
+"""
+import threading
+import time
+
+
+# Prefer stable/latest model names available in the account.
+PREFERRED_CANDIDATES = [
+    'models/gemini-pro-latest',
+    'models/gemini-flash-latest',
+    'models/gemini-2.5-flash',
+    'models/gemini-2.5-pro',
+    'models/gemini-2.0-flash',
+]
+
+
+class ModelUnavailable(Exception):
+    """Raised when no model supporting generateContent can be selected."""
+
+
+def is_not_found_error(error):
+    error_str = str(error)
+    return "404" in error_str or "not found" in error_str.lower()
+
+
+class ModelRegistry:
+    """Resolves and caches the generative model shared by all requests.
+
+    ``genai_module`` is the ``google.generativeai`` module (or a stub exposing
+    ``list_models`` and ``GenerativeModel``). Models that fail with a not-found
+    error are parked for ``failure_cooldown`` seconds and the next candidate is
+    used instead.
+    """
+
+    def __init__(self, genai_module, candidates=None, ttl=3600, failure_cooldown=300, clock=time.monotonic):
+        self._genai = genai_module
+        self.candidates = list(candidates or PREFERRED_CANDIDATES)
+        self.ttl = ttl
+        self.failure_cooldown = failure_cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._available = None  # ordered list of model names supporting generateContent
+        self._listed_at = None
+        self._handles = {}
+        self._failures = {}
+        self._stale = False
+        self.list_calls = 0
+
+    def refresh(self):
+        """Re-list models from the API, dropping cached handles."""
+        with self._lock:
+            self._refresh_locked()
+
+    def _refresh_locked(self):
+        self.list_calls += 1
+        names = []
+        for m in self._genai.list_models():
+            methods = getattr(m, 'supported_generation_methods', None) or []
+            if 'generateContent' in methods:
+                names.append(m.name)
+        self._available = names
+        self._listed_at = self._clock()
+        self._stale = False
+        self._handles = {k: v for k, v in self._handles.items() if k in names}
+
+    def _is_parked(self, name, now):
+        state = self._failures.get(name)
+        return bool(state and state['disabled_until'] and state['disabled_until'] > now)
+
+    def _choose_locked(self):
+        now = self._clock()
+        expired = self._listed_at is not None and self.ttl and now - self._listed_at >= self.ttl
+        if self._available is None:
+            self._refresh_locked()
+        elif expired or self._stale:
+            try:
+                self._refresh_locked()
+            except Exception as e:
+                # Keep serving from the previous listing rather than failing the request.
+                print(f"[WARN] Could not refresh model list, using cached selection: {e}")
+                self._listed_at = now
+                self._stale = False
+        available = set(self._available)
+        for candidate in self.candidates:
+            if candidate in available and not self._is_parked(candidate, now):
+                return candidate
+        for name in self._available:
+            if not self._is_parked(name, now):
+                return name
+        return None
+
+    def get(self):
+        """Return ``(model_name, model)`` for the currently preferred model."""
+        with self._lock:
+            chosen = self._choose_locked()
+            if not chosen:
+                raise ModelUnavailable('No model supporting generateContent is available for this API key.')
+            model = self._handles.get(chosen)
+            if model is None:
+                print(f"[INFO] Using generative model: {chosen}")
+                model = self._genai.GenerativeModel(chosen)
+                self._handles[chosen] = model
+            return chosen, model
+
+    def report_failure(self, name, error):
+        """Record a failed call. Not-found errors park the model and force a re-list."""
+        with self._lock:
+            state = self._failures.setdefault(name, {'failures': 0, 'last_error': None, 'disabled_until': None})
+            state['failures'] += 1
+            state['last_error'] = str(error)[:200]
+            if is_not_found_error(error):
+                state['disabled_until'] = self._clock() + self.failure_cooldown
+                self._handles.pop(name, None)
+                # Force a re-list on the next lookup; the account's model set may have changed.
+                self._stale = True
+                return True
+            return False
+
+    def report_success(self, name):
+        with self._lock:
+            state = self._failures.get(name)
+            if state:
+                state['failures'] = 0
+                state['disabled_until'] = None
+
+    def state(self):
+        """Snapshot of the selection and per-model failover state, for diagnostics."""
+        with self._lock:
+            now = self._clock()
+            return {
+                'available': list(self._available or []),
+                'listed_age_seconds': None if self._listed_at is None else round(now - self._listed_at, 1),
+                'warm_models': sorted(self._handles),
+                'failures': {
+                    name: {
+                        'failures': s['failures'],
+                        'last_error': s['last_error'],
+                        'parked': self._is_parked(name, now),
+                    }
+                    for name, s in self._failures.items()
+                },
+            }
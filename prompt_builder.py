@@ -0,0 +1,165 @@
+"""Triage prompt construction, token budgeting and response parsing for Gemini.
+
+The prompt is kept short: the output format is enforced by a JSON response
+schema (``response_mime_type='application/json'``) rather than by an inline
+template, and ``max_output_tokens`` caps the reply. Free-text symptoms are the
+only part that grows with the request, so when the estimated prompt size
+exceeds the token budget they are trimmed (keeping the start and the end).
+
+Replies are parsed with a plain ``json.loads`` first; only if that fails are
+code fences or surrounding prose cut away. Either way the result is checked
+against the schema before it is used or cached.
+"""
+import json
+import os
+
+from gemini_client import estimate_tokens
+from metrics import GEMINI_TOKENS
+
+
+TRIAGE_LEVELS = ('CRITICAL', 'URGENT', 'STABLE')
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', '1024'))
+# Thinking models (2.5 pro/flash) count their reasoning against this cap too, so keep headroom.
+MAX_OUTPUT_TOKENS = int(os.environ.get('GEMINI_MAX_OUTPUT_TOKENS', '2048'))
+IMAGE_TOKENS = 258
+MIN_SYMPTOM_CHARS = 200
+TRIM_MARKER = ' [...] '
+
+RESPONSE_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'main_diagnosis': {'type': 'STRING', 'description': "Most probable condition, e.g. 'Possible Bacterial Skin Infection'"},
+        'confidence': {'type': 'INTEGER', 'description': 'Confidence score between 50 and 95'},
+        'triage_level': {'type': 'STRING', 'format': 'enum', 'enum': list(TRIAGE_LEVELS)},
+        'explanation': {'type': 'STRING', 'description': "1-2 sentences starting with 'Recommendation:'"},
+    },
+    'required': ['main_diagnosis', 'confidence', 'triage_level', 'explanation'],
+}
+
+GENERATION_CONFIG = {
+    'response_mime_type': 'application/json',
+    'response_schema': RESPONSE_SCHEMA,
+    'max_output_tokens': MAX_OUTPUT_TOKENS,
+    'temperature': float(os.environ.get('GEMINI_TEMPERATURE', '0.2')),
+}
+
+_INSTRUCTIONS = (
+    "You are a medical AI assistant for Community Health Workers in rural India. "
+    "Give a cautious preliminary analysis and triage recommendation, not a definitive diagnosis. "
+    "In the explanation, start with 'Recommendation:' and advise on next steps "
+    "(refer immediately, monitor symptoms, or provide basic care)."
+)
+
+
+class TriagePrompt:
+    """``text`` is sent to the model; ``cache_text`` omits the per-upload image line so resubmissions share a key."""
+
+    def __init__(self, text, cache_text, estimated_tokens, trimmed_chars=0):
+        self.text = text
+        self.cache_text = cache_text
+        self.estimated_tokens = estimated_tokens
+        self.trimmed_chars = trimmed_chars
+
+
+def _trim(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    keep = max(max_chars - len(TRIM_MARKER), 0)
+    head = keep * 2 // 3
+    return text[:head] + TRIM_MARKER + text[len(text) - (keep - head):]
+
+
+def build_prompt(symptoms_text, patient_info, image_url=None, has_image=False, budget=PROMPT_TOKEN_BUDGET):
+    """Build the triage prompt, trimming the symptoms so the estimate (image included) fits ``budget`` tokens."""
+    symptoms = (symptoms_text or '').strip() or 'None provided.'
+    patient = f"Patient: age {patient_info.get('age', 'N/A')}, gender {patient_info.get('gender', 'N/A')}."
+    if image_url:
+        image_line = f"Image of visual symptoms: {image_url}"
+    elif has_image:
+        image_line = "Visual symptoms: see the attached image."
+    else:
+        image_line = None
+
+    def render(symptom_text, with_image):
+        lines = [_INSTRUCTIONS, patient, f"Symptoms: {symptom_text}"]
+        if with_image and image_line:
+            lines.append(image_line)
+        return "\n".join(lines)
+
+    image_tokens = IMAGE_TOKENS if has_image else 0
+    text = render(symptoms, True)
+    trimmed = 0
+    over = estimate_tokens(text) + image_tokens - budget
+    if over > 0:
+        allowed = max(MIN_SYMPTOM_CHARS, len(symptoms) - over * 4)
+        if allowed < len(symptoms):
+            shortened = _trim(symptoms, allowed)
+            trimmed = len(symptoms) - len(shortened)
+            symptoms = shortened
+            text = render(symptoms, True)
+    return TriagePrompt(text, render(symptoms, False), estimate_tokens(text) + image_tokens, trimmed)
+
+
+def validate_result(data):
+    """Return the four triage fields normalised, or None if ``data`` does not match the schema."""
+    if not isinstance(data, dict):
+        return None
+    level = str(data.get('triage_level') or '').strip().upper()
+    diagnosis = data.get('main_diagnosis')
+    explanation = data.get('explanation')
+    if level not in TRIAGE_LEVELS or not isinstance(diagnosis, str) or not isinstance(explanation, str):
+        return None
+    try:
+        confidence = int(round(float(data.get('confidence'))))
+    except (TypeError, ValueError):
+        return None
+    return {
+        'main_diagnosis': diagnosis.strip(),
+        'confidence': max(0, min(100, confidence)),
+        'triage_level': level,
+        'explanation': explanation.strip(),
+    }
+
+
+def parse_result(text):
+    """Parse a model reply into triage fields, or None if it is not a valid result."""
+    if not text:
+        return None
+    try:
+        return validate_result(json.loads(text))
+    except ValueError:
+        pass
+    # Slow path: a reply wrapped in ``` fences or prose. Take the outermost object.
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end <= start:
+        return None
+    try:
+        return validate_result(json.loads(text[start:end + 1]))
+    except ValueError:
+        return None
+
+
+def response_text(response):
+    """The reply text, or '' when there is none (blocked, or cut off by max_output_tokens)."""
+    try:
+        return response.text or ''
+    except (AttributeError, ValueError):
+        # `.text` raises when the candidate has no parts.
+        return ''
+
+
+def record_usage(response, prompt=None):
+    """Observe the call's input/output token counts from ``usage_metadata``; returns them as a dict."""
+    usage = getattr(response, 'usage_metadata', None)
+    counts = {
+        'input': getattr(usage, 'prompt_token_count', None),
+        'output': getattr(usage, 'candidates_token_count', None),
+        'thinking': getattr(usage, 'thoughts_token_count', None),
+    }
+    for direction, count in counts.items():
+        if count:
+            GEMINI_TOKENS.observe(count, direction=direction)
+    estimate = f" (estimated {prompt.estimated_tokens})" if prompt else ''
+    print(f"[DEBUG] Gemini tokens: input={counts['input']}{estimate} output={counts['output']}"
+          f"{' thinking=' + str(counts['thinking']) if counts['thinking'] else ''}")
+    return counts
@@ -0,0 +1,97 @@
+"""Single place to look up a patient record by id.
+
+`RecordRepository.get()` checks a bounded, TTL'd LRU cache, then Supabase,
+then the local JSONL store, and caches whatever it finds. /analyze puts each
+record it saves, so the redirect to /result (and the ABDM slip after it) is
+served from memory. Records still PENDING get a short TTL so a diagnosis
+finished by another gunicorn worker shows up quickly.
+"""
+import asyncio
+import threading
+
+from caching import TTLCache
+
+
+class RecordRepository:
+    def __init__(self, client_getter, local_store, max_entries=1024, ttl=300, pending_ttl=2,
+                 table='patient_records'):
+        """``client_getter`` returns the Supabase client, or None in demo mode."""
+        self.cache = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.pending_ttl = pending_ttl
+        self.table = table
+        self._get_client = client_getter
+        self._local_store = local_store
+        self._lock = threading.Lock()
+        self.counters = {'db_reads': 0, 'db_errors': 0, 'local_reads': 0, 'not_found': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def put(self, record):
+        """Cache a record that was just written (or read). Ignored without an id."""
+        if not record or not record.get('id'):
+            return
+        ttl = self.pending_ttl if record.get('triage_level') == 'PENDING' else None
+        self.cache.put(str(record['id']), dict(record), ttl=ttl)
+
+    def invalidate(self, record_id):
+        self.cache.pop(str(record_id))
+
+    def get(self, record_id):
+        """Return the record dict for ``record_id``, or None if no store has it."""
+        if not record_id:
+            return None
+        key = str(record_id)
+        record = self.cache.get(key)
+        if record is not None:
+            return record
+
+        client = self._get_client()
+        if client:
+            self._count('db_reads')
+            try:
+                response = client.table(self.table).select('*').eq('id', key).single().execute()
+                record = response.data
+            except Exception as e:
+                # No row (single() raises) or the database is unreachable: try the offline copy.
+                self._count('db_errors')
+                print(f"[WARN] Record lookup for {key} failed in Supabase: {e}")
+        return self._found(key, record)
+
+    async def get_async(self, record_id, client):
+        """`get` for an event loop: awaits the lookup on ``client``, an async Supabase client (or None)."""
+        if not record_id:
+            return None
+        key = str(record_id)
+        record = self.cache.get(key)
+        if record is not None:
+            return record
+
+        if client:
+            self._count('db_reads')
+            try:
+                response = await client.table(self.table).select('*').eq('id', key).single().execute()
+                record = response.data
+            except Exception as e:
+                self._count('db_errors')
+                print(f"[WARN] Record lookup for {key} failed in Supabase: {e}")
+        if record:
+            return self._found(key, record)
+        # The local fallback reads the JSONL store from disk; keep it off the event loop.
+        return await asyncio.to_thread(self._found, key, None)
+
+    def _found(self, key, record):
+        if not record:
+            self._count('local_reads')
+            record = self._local_store.get(key)
+        if not record:
+            self._count('not_found')
+            return None
+        self.put(record)
+        return record
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {**self.cache.stats(), **counters}
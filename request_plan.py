@@ -0,0 +1,81 @@
+"""Run the independent stages of one request concurrently, under one deadline.
+
+`/analyze` uploads the photo, uploads the voice note and asks Gemini for a
+diagnosis; none of these depends on another. A `RequestPlan` starts each
+stage on a shared thread pool and joins them before the record is written, so
+the request takes about as long as its slowest stage rather than the sum. A
+stage still running when the request's deadline passes is abandoned and its
+result replaced by a default.
+
+`AsyncRequestPlan` is the same for the ASGI mode (asgi.py): stages are
+coroutines run as tasks on the event loop, and a late one is cancelled.
+"""
+import asyncio
+import contextvars
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+
+
+class RequestPlan:
+    def __init__(self, executor, deadline, clock=time.monotonic):
+        self._executor = executor
+        self._clock = clock
+        self.deadline_at = clock() + deadline
+        self._futures = {}
+        self.timed_out = []
+
+    def remaining(self):
+        """Seconds left before the request deadline (never negative)."""
+        return max(0.0, self.deadline_at - self._clock())
+
+    def start(self, name, fn, *args, **kwargs):
+        # Run in a copy of the caller's context so the stage keeps its request's metrics route.
+        context = contextvars.copy_context()
+        self._futures[name] = self._executor.submit(context.run, fn, *args, **kwargs)
+        return self._futures[name]
+
+    def result(self, name, default=None):
+        """Wait for stage ``name`` until the deadline.
+
+        Returns ``default`` if the stage was never started or did not finish in
+        time; an exception raised by the stage is re-raised here.
+        """
+        future = self._futures.get(name)
+        if future is None:
+            return default
+        try:
+            return future.result(timeout=self.remaining())
+        except FutureTimeout:
+            # Not cancellable once running; the worker finishes it and the result is dropped.
+            future.cancel()
+            self.timed_out.append(name)
+            print(f"[WARN] Stage '{name}' missed the request deadline")
+            return default
+
+
+class AsyncRequestPlan:
+    def __init__(self, deadline, clock=time.monotonic):
+        self._clock = clock
+        self.deadline_at = clock() + deadline
+        self._tasks = {}
+        self.timed_out = []
+
+    def remaining(self):
+        return max(0.0, self.deadline_at - self._clock())
+
+    def start(self, name, coro):
+        self._tasks[name] = asyncio.ensure_future(coro)
+        return self._tasks[name]
+
+    async def result(self, name, default=None):
+        """Await stage ``name`` until the deadline; same contract as `RequestPlan.result`."""
+        task = self._tasks.get(name)
+        if task is None:
+            return default
+        try:
+            # wait_for cancels the task if it is still running at the deadline.
+            return await asyncio.wait_for(task, timeout=self.remaining())
+        except asyncio.TimeoutError:
+            self.timed_out.append(name)
+            print(f"[WARN] Stage '{name}' missed the request deadline")
+            return default
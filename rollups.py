@@ -0,0 +1,148 @@
+"""Incrementally maintained triage counts for the dashboard.
+
+`TriageRollups` keeps counts by triage level, by day, by age bucket and by
+gender, updated one record at a time, so rendering the dashboard stats costs
+the same whether there are ten records or ten million. For the local store
+the rollups are fed by `LocalRecordStore` as lines are indexed (a full pass
+only on cold start); for Supabase they are seeded from one grouped query and
+bumped as this process inserts and updates rows.
+"""
+import threading
+import time
+from collections import Counter
+
+
+AGE_BUCKETS = ((0, 4, '0-4'), (5, 14, '5-14'), (15, 29, '15-29'), (30, 44, '30-44'), (45, 59, '45-59'), (60, None, '60+'))
+
+
+def age_bucket(age):
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        return 'unknown'
+    for low, high, label in AGE_BUCKETS:
+        if age >= low and (high is None or age <= high):
+            return label
+    return 'unknown'
+
+
+def _key(record):
+    return (
+        record.get('triage_level') or 'UNKNOWN',
+        (record.get('created_at') or '')[:10] or 'unknown',
+        age_bucket(record.get('age')),
+        (record.get('gender') or 'unknown'),
+    )
+
+
+class TriageRollups:
+    """Counters over records. Thread-safe.
+
+    Records are only ever re-added while PENDING (the background diagnosis
+    replaces them once), so only PENDING records remember their previous key;
+    memory stays proportional to the in-flight jobs, not the history.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._clear_counts_locked()
+            self._pending = {}
+
+    def _clear_counts_locked(self):
+        self.total = 0
+        self.by_level = Counter()
+        self.by_day = Counter()
+        self.by_age = Counter()
+        self.by_gender = Counter()
+
+    def _apply(self, key, sign):
+        level, day, bucket, gender = key
+        self.total += sign
+        self.by_level[level] += sign
+        self.by_day[day] += sign
+        self.by_age[bucket] += sign
+        self.by_gender[gender] += sign
+
+    def add(self, record, previous=None):
+        """Count ``record``, replacing its earlier PENDING version if one was counted.
+
+        ``previous`` is the record as it was before this change, for callers that know it
+        (a diagnosis replacing a PENDING row) when this instance may not have seen it added.
+        """
+        record_id = str(record.get('id'))
+        key = _key(record)
+        with self._lock:
+            previous_key = self._pending.pop(record_id, None)
+            if previous_key is None and previous is not None:
+                previous_key = _key(previous)
+            if previous_key:
+                self._apply(previous_key, -1)
+            self._apply(key, 1)
+            if key[0] == 'PENDING':
+                self._pending[record_id] = key
+
+    def add_counts(self, rows):
+        """Fold in pre-aggregated rows of {triage_level, day, age_bucket, gender, count}."""
+        with self._lock:
+            self._add_counts_locked(rows)
+
+    def _add_counts_locked(self, rows):
+        for row in rows:
+            count = int(row.get('count') or 0)
+            key = (row.get('triage_level') or 'UNKNOWN', str(row.get('day') or 'unknown')[:10],
+                   row.get('age_bucket') or 'unknown', row.get('gender') or 'unknown')
+            self._apply(key, count)
+
+    def snapshot(self, days=14):
+        """Stats in the shape the dashboard template expects, plus breakdowns for the charts."""
+        with self._lock:
+            recent_days = sorted(d for d in self.by_day if d != 'unknown')[-days:]
+            return {
+                'total': self.total,
+                'critical': self.by_level.get('CRITICAL', 0),
+                'urgent': self.by_level.get('URGENT', 0),
+                'stable': self.by_level.get('STABLE', 0),
+                'pending': self.by_level.get('PENDING', 0),
+                'by_day': {d: self.by_day[d] for d in recent_days},
+                'by_age': {label: self.by_age.get(label, 0) for _, _, label in AGE_BUCKETS},
+                'by_gender': {g: c for g, c in self.by_gender.items() if c},
+            }
+
+
+class RemoteRollups(TriageRollups):
+    """Rollups for Supabase: seeded from the `triage_rollups()` SQL function and re-seeded after ``ttl``
+    seconds so counts written by other workers are picked up."""
+
+    def __init__(self, ttl=300, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._seeded_at = None
+        self._breakdowns = True
+        super().__init__()
+
+    def is_stale(self):
+        return self._seeded_at is None or self._clock() - self._seeded_at >= self.ttl
+
+    def seed(self, rows, breakdowns=True):
+        """Replace the counts with ``rows``. PENDING records this process is tracking stay tracked:
+        they are counted as PENDING in the seed, so their diagnosis must still subtract that.
+
+        ``breakdowns=False`` marks rows that carry only triage levels (no day/age/gender),
+        so `snapshot` leaves the chart breakdowns out rather than showing them empty.
+        """
+        with self._lock:
+            self._clear_counts_locked()
+            self._add_counts_locked(rows)
+            self._breakdowns = breakdowns
+        self._seeded_at = self._clock()
+
+    def snapshot(self, days=14):
+        snapshot = super().snapshot(days)
+        if not self._breakdowns:
+            for key in ('by_day', 'by_age', 'by_gender'):
+                del snapshot[key]
+        return snapshot
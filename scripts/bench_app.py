@@ -0,0 +1,212 @@
+"""Load-test /analyze, /dashboard and /result against local stand-ins for Supabase and Gemini.
+
+Usage:
+    python scripts/bench_app.py [--requests 200] [--concurrency 16]
+                                [--gemini-latency 1.5] [--gemini-sigma 0.4] [--gemini-error-rate 0.05]
+                                [--db-latency 0.03] [--storage-latency 0.08]
+                                [--sync] [--out bench_output.json] [--compare previous.json]
+
+The app is imported with a fake `google.generativeai` module (scripts/fakes.py)
+and its Supabase client replaced by an in-memory fake, so no network is used.
+Concurrent clients POST multipart submissions (a JPEG photo and a webm voice
+note) to /analyze, then read /dashboard and /result pages. For each route the
+harness reports p50/p95/p99 latency, requests/s, error count and process peak
+RSS after the phase, and writes everything to a JSON file that a later run can
+be compared against with --compare.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(SCRIPTS)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, SCRIPTS)
+
+from fakes import FakeGenAI, FakeSupabase, install_fake_genai  # noqa: E402
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round((rss / 1024 / 1024) if sys.platform == 'darwin' else rss / 1024, 1)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def make_jpeg(seed, size=(1600, 1200)):
+    from PIL import Image
+    img = Image.new('RGB', size, ((seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256))
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=92)
+    return buf.getvalue()
+
+
+def fake_webm(seed, size=48_000):
+    # Not a playable recording; the app stores voice notes as opaque bytes.
+    return b'\x1aE\xdf\xa3' + bytes((seed + i) % 256 for i in range(size))
+
+
+def run_phase(name, worker, count, concurrency):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    local = threading.local()
+
+    def task(i):
+        started = time.perf_counter()
+        try:
+            detail = None if worker(i, local) else 'unexpected status'
+        except Exception as e:  # a crashed request counts as an error, not a harness failure
+            detail = str(e)[:200]
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if detail:
+                errors.append(detail)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(task, range(count)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'route': name,
+        'requests': count,
+        'concurrency': concurrency,
+        'errors': len(errors),
+        'error_samples': errors[:3],
+        'wall_seconds': round(wall, 3),
+        'requests_per_sec': round(count / wall, 1) if wall else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--gemini-latency', type=float, default=1.5, help='median seconds per generate_content')
+    parser.add_argument('--gemini-sigma', type=float, default=0.4, help='log-normal spread of Gemini latency')
+    parser.add_argument('--gemini-error-rate', type=float, default=0.05)
+    parser.add_argument('--db-latency', type=float, default=0.03)
+    parser.add_argument('--storage-latency', type=float, default=0.08)
+    parser.add_argument('--sync', action='store_true', help='run /analyze synchronously (TRIAGE_ASYNC=0)')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--out', default='bench_output.json')
+    parser.add_argument('--compare', default=None, help='previous output file to diff against')
+    args = parser.parse_args()
+
+    # Keep the run hermetic: no real keys, no on-disk cache, no recovery of old jobs.
+    os.environ.pop('SUPABASE_URL', None)
+    os.environ.pop('SUPABASE_KEY', None)
+    os.environ['GEMINI_API_KEY'] = 'fake-key'
+    os.environ['TRIAGE_CACHE_DISK'] = '0'
+    os.environ['TRIAGE_RECOVER_ON_START'] = '0'
+    os.environ['LOCAL_SYNC_INTERVAL'] = '0'
+    os.environ['GEMINI_RPM'] = '100000'
+    os.environ['GEMINI_TPM'] = '0'
+    os.environ['TRIAGE_ASYNC'] = '0' if args.sync else '1'
+    os.environ['TRIAGE_QUEUE_DEPTH'] = str(max(100, args.requests))
+
+    genai = install_fake_genai(FakeGenAI(args.gemini_latency, args.gemini_sigma, args.gemini_error_rate, seed=args.seed))
+    fake_db = FakeSupabase(db_latency=args.db_latency, storage_latency=args.storage_latency)
+
+    import app as app_module
+    app_module.supabase = fake_db
+    flask_app = app_module.app
+    flask_app.testing = True
+
+    images = [make_jpeg(i) for i in range(8)]
+    voices = [fake_webm(i) for i in range(4)]
+    record_ids = []
+    ids_lock = threading.Lock()
+
+    def client(local):
+        if not hasattr(local, 'client'):
+            local.client = flask_app.test_client()
+        return local.client
+
+    def analyze(i, local):
+        data = {
+            'patient_name': f'Bench Patient {i}',
+            'age': str(5 + i % 80),
+            'gender': 'F' if i % 2 else 'M',
+            # Vary the text so the triage cache does not turn the run into cache hits.
+            'symptoms_text': f'fever and cough for {i % 9 + 1} days, case {i}',
+            'image_file': (io.BytesIO(images[i % len(images)]), 'photo.jpg', 'image/jpeg'),
+            'voice_file': (io.BytesIO(voices[i % len(voices)]), 'recording.webm', 'audio/webm'),
+        }
+        resp = client(local).post('/analyze', data=data, content_type='multipart/form-data')
+        body = resp.get_json(silent=True) or {}
+        if body.get('record_id'):
+            with ids_lock:
+                record_ids.append(body['record_id'])
+        return resp.status_code in (200, 202) and body.get('success')
+
+    def dashboard(i, local):
+        return client(local).get('/dashboard').status_code == 200
+
+    def result(i, local):
+        record_id = record_ids[i % len(record_ids)] if record_ids else 'missing'
+        return client(local).get(f'/result?id={record_id}').status_code == 200
+
+    baseline_rss = peak_rss_mb()
+    results = [run_phase('/analyze', analyze, args.requests, args.concurrency)]
+    if not args.sync:
+        # Let queued diagnoses finish so later phases see completed records.
+        drain_started = time.perf_counter()
+        app_module.triage_queue.join()
+        results[0]['queue_drain_seconds'] = round(time.perf_counter() - drain_started, 3)
+    results.append(run_phase('/dashboard', dashboard, args.requests, args.concurrency))
+    results.append(run_phase('/result', result, args.requests, args.concurrency))
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'config': vars(args),
+        'baseline_rss_mb': baseline_rss,
+        'gemini_calls': sum(m.calls for m in genai.models),
+        'routes': results,
+    }
+
+    print(f"{'route':<12} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'peak RSS MB':>12}")
+    for r in results:
+        print(f"{r['route']:<12} {r['requests_per_sec']:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} "
+              f"{r['errors']:>7} {r['peak_rss_mb']:>12}")
+
+    with open(args.out, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh, indent=2)
+    print(f'Wrote {args.out}')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as fh:
+            previous = {r['route']: r for r in json.load(fh).get('routes', [])}
+        print(f"\n{'route':<12} {'metric':<18} {'before':>10} {'after':>10} {'change':>8}")
+        for r in results:
+            old = previous.get(r['route'])
+            if not old:
+                continue
+            for metric in ('requests_per_sec', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb'):
+                before, after = old.get(metric), r.get(metric)
+                if before:
+                    print(f"{r['route']:<12} {metric:<18} {before:>10} {after:>10} {(after - before) / before * 100:>+7.1f}%")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""Compare how many concurrent clients the sync (gunicorn) and ASGI deployments can hold.
+
+Usage:
+    python scripts/bench_asgi.py [--modes sync,asgi] [--workers 2] [--levels 4,16,64,128] [--duration 10]
+                                 [--mix analyze=1,result=2,dashboard=1] [--slo 5.0] [--queue]
+                                 [--gemini-latency 1.5] [--gemini-sigma 0.4] [--db-latency 0.03]
+                                 [--storage-latency 0.08] [--out bench_asgi.json]
+
+For each mode the script starts a real server in a child process on a free
+port:
+* sync: gunicorn sync workers running app:app, as the Procfile does;
+* asgi: gunicorn with uvicorn workers running asgi:app.
+Both use the same worker count. The server uses the in-memory stand-ins from
+scripts/fakes.py: FakeSupabase, and FakeGenAI with log-normal latency. They
+sleep instead of doing network I/O (asyncio.sleep on the async paths), and
+the database is seeded before the workers fork.
+
+Clients then send a mix of /analyze submissions (photo plus voice note),
+/result pages and /dashboard pages in closed loops. The number of concurrent
+clients steps through --levels. For each level the script reports req/s,
+p50/p95 latency, errors and timeouts, and the server's total RSS. A level
+passes when p95 <= --slo seconds and under 1% of requests fail; "capacity"
+is the highest level that passes.
+
+By default /analyze waits for the diagnosis (TRIAGE_ASYNC=0), so the model
+call is on the request path. --queue uses the background triage queue
+instead.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(SCRIPTS)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, SCRIPTS)
+
+SEED_RECORDS = 500
+
+
+def serve(args):
+    """Child process: install the fakes, seed the database and run gunicorn in the foreground."""
+    os.environ.pop('SUPABASE_URL', None)
+    os.environ.pop('SUPABASE_KEY', None)
+    os.environ.update({
+        'GEMINI_API_KEY': 'fake-key', 'TRIAGE_CACHE_DISK': '0', 'TRIAGE_RECOVER_ON_START': '0',
+        'LOCAL_SYNC_INTERVAL': '0', 'WARMUP_ON_START': '0', 'GEMINI_RPM': '0', 'GEMINI_TPM': '0',
+        'TRIAGE_ASYNC': '1' if args.queue else '0', 'TRIAGE_QUEUE_DEPTH': '100000',
+    })
+    from fakes import AsyncFakeSupabase, FakeGenAI, FakeSupabase, install_fake_genai
+    from gunicorn.app.base import BaseApplication
+
+    install_fake_genai(FakeGenAI(args.gemini_latency, args.gemini_sigma, 0.0, seed=args.seed))
+    fake_db = FakeSupabase(db_latency=args.db_latency, storage_latency=args.storage_latency)
+    levels = ('CRITICAL', 'URGENT', 'STABLE')
+    fake_db.table('patient_records').insert([{
+        'id': f'seed-{i}', 'patient_name': f'Seed Patient {i}', 'age': i % 90, 'gender': 'F',
+        'symptoms_text': 'fever and cough', 'triage_level': levels[i % 3], 'confidence': 70,
+        'ai_diagnosis': 'Possible Viral Fever', 'explanation': 'Recommendation: monitor.',
+        'created_at': f'2025-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}',
+    } for i in range(SEED_RECORDS)]).execute()
+
+    import app as app_module
+    app_module.supabase = fake_db
+    if args.serve == 'asgi':
+        import asgi
+        asgi.async_supabase = AsyncFakeSupabase(fake_db)
+        application, worker_class = asgi.app, 'uvicorn.workers.UvicornWorker'
+    else:
+        application, worker_class = app_module.app, 'sync'
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in {'bind': f'127.0.0.1:{args.port}', 'workers': args.workers,
+                               'worker_class': worker_class, 'timeout': 120, 'loglevel': 'warning'}.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return application
+
+    # Silence the app's per-request prints; they would measure the terminal, not the server.
+    sys.stdout = open(os.devnull, 'w')
+    Server().run()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def tree_rss_mb(pid):
+    """Resident memory of ``pid`` and all its descendants, from /proc (Linux)."""
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat', 'r') as fh:
+                    parents[int(entry)] = int(fh.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    family, frontier = {pid}, [pid]
+    while frontier:
+        current = frontier.pop()
+        for child, parent in parents.items():
+            if parent == current and child not in family:
+                family.add(child)
+                frontier.append(child)
+    total_kb = 0
+    for member in family:
+        try:
+            with open(f'/proc/{member}/status', 'r') as fh:
+                for line in fh:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1)
+
+
+async def wait_ready(base, timeout=60):
+    import httpx
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f'{base}/static/css/style.css')).status_code == 200:
+                    return True
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    return False
+
+
+async def run_level(base, clients, duration, mix, timeout, payloads, rng):
+    import httpx
+    from bench_app import percentile
+    latencies, errors, timeouts = [], 0, 0
+    by_route = {name: [] for name, _ in mix}
+    routes = [name for name, weight in mix for _ in range(weight)]
+    stop_at = time.monotonic() + duration
+
+    async def request(client, route, n):
+        if route == 'analyze':
+            image, voice = payloads[n % len(payloads)]
+            data = {'patient_name': f'Bench {n}', 'age': str(5 + n % 80), 'gender': 'F' if n % 2 else 'M',
+                    'symptoms_text': f'fever and cough for {n % 9 + 1} days, case {n}'}
+            files = {'image_file': ('photo.jpg', image, 'image/jpeg'),
+                     'voice_file': ('recording.webm', voice, 'audio/webm')}
+            resp = await client.post(f'{base}/analyze', data=data, files=files)
+            return resp.status_code in (200, 202) and resp.json().get('success')
+        if route == 'result':
+            resp = await client.get(f'{base}/result', params={'id': f'seed-{n % SEED_RECORDS}'})
+            return resp.status_code == 200 and 'Seed Patient' in resp.text
+        return (await client.get(f'{base}/dashboard')).status_code == 200
+
+    async def loop(client, index):
+        nonlocal errors, timeouts
+        n = index
+        while time.monotonic() < stop_at:
+            route = rng.choice(routes)
+            started = time.perf_counter()
+            try:
+                ok = await request(client, route, n)
+            except httpx.TimeoutException:
+                ok, timeouts = False, timeouts + 1
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            by_route[route].append(latencies[-1])
+            if not ok:
+                errors += 1
+            n += clients
+
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    started = time.perf_counter()
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        await asyncio.gather(*(loop(client, i) for i in range(clients)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'clients': clients,
+        'requests': count,
+        'requests_per_sec': round(count / wall, 1) if wall else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1) if count else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1) if count else None,
+        'errors': errors,
+        'timeouts': timeouts,
+        'route_p95_ms': {name: round(percentile(sorted(values), 95) * 1000, 1)
+                         for name, values in by_route.items() if values},
+    }
+
+
+def bench_mode(mode, args, payloads):
+    port = free_port()
+    cmd = [sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port),
+           '--workers', str(args.workers), '--gemini-latency', str(args.gemini_latency),
+           '--gemini-sigma', str(args.gemini_sigma), '--db-latency', str(args.db_latency),
+           '--storage-latency', str(args.storage_latency), '--seed', str(args.seed)] + (['--queue'] if args.queue else [])
+    server = subprocess.Popen(cmd, cwd=ROOT)
+    base = f'http://127.0.0.1:{port}'
+    rows = []
+    try:
+        if not asyncio.run(wait_ready(base)):
+            raise RuntimeError(f'{mode} server did not start')
+        idle_rss = tree_rss_mb(server.pid)
+        rng = random.Random(args.seed)
+        for clients in args.levels:
+            row = asyncio.run(run_level(base, clients, args.duration, args.mix, args.timeout, payloads, rng))
+            row['server_rss_mb'] = tree_rss_mb(server.pid)
+            row['passed'] = bool(row['requests']) and row['p95_ms'] <= args.slo * 1000 \
+                and row['errors'] <= 0.01 * row['requests']
+            rows.append(row)
+            print(f"{mode:<5} {clients:>7} {row['requests_per_sec']:>8} {row['p50_ms']:>9} {row['p95_ms']:>9} "
+                  f"{row['errors']:>7} {row['timeouts']:>8} {row['server_rss_mb']:>10} {'ok' if row['passed'] else 'FAIL':>5}",
+                  flush=True)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    passing = [r['clients'] for r in rows if r['passed']]
+    return {'mode': mode, 'idle_rss_mb': idle_rss, 'capacity_clients': max(passing) if passing else 0, 'levels': rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='sync,asgi')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--levels', default='4,16,64,128', help='concurrent clients per step')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per step')
+    parser.add_argument('--mix', default='analyze=1,result=2,dashboard=1', help='relative route weights')
+    parser.add_argument('--slo', type=float, default=5.0, help='p95 latency bound in seconds for a passing step')
+    parser.add_argument('--timeout', type=float, default=30.0, help='client timeout per request')
+    parser.add_argument('--queue', action='store_true', help='diagnose on the background queue (TRIAGE_ASYNC=1)')
+    parser.add_argument('--gemini-latency', type=float, default=1.5)
+    parser.add_argument('--gemini-sigma', type=float, default=0.4)
+    parser.add_argument('--db-latency', type=float, default=0.03)
+    parser.add_argument('--storage-latency', type=float, default=0.08)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--out', default='bench_asgi.json')
+    parser.add_argument('--serve', choices=('sync', 'asgi'), help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return 0
+
+    from bench_app import fake_webm, make_jpeg
+    args.levels = [int(n) for n in args.levels.split(',')]
+    args.mix = [(name, int(weight)) for name, weight in (item.split('=') for item in args.mix.split(','))]
+    payloads = [(make_jpeg(i, size=(800, 600)), fake_webm(i)) for i in range(4)]
+
+    print(f"{'mode':<5} {'clients':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7} {'timeouts':>8} "
+          f"{'RSS MB':>10} {'slo':>5}")
+    results = [bench_mode(mode, args, payloads) for mode in args.modes.split(',')]
+
+    print()
+    for r in results:
+        print(f"{r['mode']:<5} capacity: {r['capacity_clients']} concurrent clients "
+              f"(p95 <= {args.slo}s, <1% errors) with {args.workers} worker(s); idle RSS {r['idle_rss_mb']} MB")
+    config = {k: v for k, v in vars(args).items() if k not in ('serve', 'port')}
+    with open(args.out, 'w', encoding='utf-8') as fh:
+        json.dump({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'config': config,
+                   'results': results}, fh, indent=2)
+    print(f'Wrote {args.out}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
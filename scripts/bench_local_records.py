@@ -0,0 +1,131 @@
+"""Benchmark streaming reads of the local record store against the old full-file loader.
+
+Usage:
+    python scripts/bench_local_records.py [--lines 1000000] [--file /tmp/bench_local_records.jsonl]
+
+Each scenario runs in a fresh process so its peak RSS is measured in
+isolation. Scenarios:
+
+* load_all       - the previous `_load_local_records()`: parse every line into a list
+* find_by_scan   - the previous `_find_local_record()`: load_all, then scan for one id
+* get_indexed    - LocalRecordStore.get() (includes building the offset index once)
+* newest_page    - page(limit=51), the dashboard's first page
+* filtered_page  - page(triage_level='CRITICAL', limit=51)
+* deep_page      - page(limit=51) with a cursor half way through the history
+
+The page scenarios time the page alone, on a store whose index is already
+built (as in a running worker); get_indexed shows the one-off build cost.
+* stream_all     - iterate every record once (what an export does)
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from local_store import LocalRecordStore  # noqa: E402
+
+LEVELS = ('CRITICAL', 'URGENT', 'STABLE')
+
+
+def generate(path, lines):
+    rng = random.Random(42)
+    with open(path, 'w', encoding='utf-8') as fh:
+        for i in range(lines):
+            fh.write(json.dumps({
+                'id': f'rec-{i:08d}',
+                'patient_name': f'Patient {i}',
+                'age': rng.randint(1, 90),
+                'gender': rng.choice(('M', 'F')),
+                'symptoms_text': 'fever and cough for three days, mild breathlessness',
+                'image_file_url': None,
+                'voice_file_url': None,
+                'ai_diagnosis': 'Possible respiratory infection',
+                'confidence': rng.randint(50, 95),
+                'triage_level': rng.choice(LEVELS),
+                'explanation': 'Recommendation: monitor symptoms and refer if breathing worsens.',
+                'created_at': f'2025-{1 + i * 12 // lines:02d}-01T00:00:{i % 60:02d}.{i:06d}',
+            }) + '\n')
+
+
+def legacy_load_all(path):
+    records = []
+    with open(path, 'r', encoding='utf-8') as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except Exception:
+                continue
+    return records
+
+
+def _run(scenario, path, lines, queue):
+    target = f'rec-{lines // 2:08d}'
+    started = time.perf_counter()
+    if scenario == 'load_all':
+        result = len(legacy_load_all(path))
+    elif scenario == 'find_by_scan':
+        result = next((r['id'] for r in legacy_load_all(path) if r.get('id') == target), None)
+    elif scenario == 'get_indexed':
+        result = LocalRecordStore(path).get(target)['id']
+    elif scenario in ('newest_page', 'filtered_page', 'deep_page'):
+        store = LocalRecordStore(path)
+        store.refresh()
+        cursor = store.get(target) if scenario == 'deep_page' else None
+        started = time.perf_counter()
+        if scenario == 'newest_page':
+            result = len(store.page(limit=51))
+        elif scenario == 'filtered_page':
+            result = len(store.page(triage_level='CRITICAL', limit=51))
+        else:
+            result = len(store.page(before=cursor['created_at'], before_id=cursor['id'], limit=51))
+    elif scenario == 'stream_all':
+        result = sum(1 for _ in LocalRecordStore(path).iter_records())
+    else:
+        raise ValueError(scenario)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    queue.put({'scenario': scenario, 'seconds': round(elapsed, 4), 'peak_rss_mb': round(rss / 1024, 1), 'result': str(result)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    parser.add_argument('--file', default='/tmp/bench_local_records.jsonl')
+    parser.add_argument('--keep', action='store_true', help='keep the generated file')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file) or sum(1 for _ in open(args.file, 'rb')) != args.lines:
+        print(f'Generating {args.lines} records in {args.file} ...')
+        generate(args.file, args.lines)
+    print(f'File size: {os.path.getsize(args.file) / 1e6:.1f} MB')
+
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{'scenario':<15} {'seconds':>9} {'peak RSS MB':>12}  result")
+    for scenario in ('load_all', 'find_by_scan', 'get_indexed', 'newest_page', 'filtered_page', 'deep_page',
+                     'stream_all'):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run, args=(scenario, args.file, args.lines, queue))
+        proc.start()
+        row = queue.get()
+        proc.join()
+        print(f"{row['scenario']:<15} {row['seconds']:>9} {row['peak_rss_mb']:>12}  {row['result']}")
+
+    if not args.keep:
+        os.remove(args.file)
+
+
+if __name__ == '__main__':
+    main()
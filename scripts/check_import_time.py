@@ -0,0 +1,119 @@
+"""Check that `import app` stays fast and does no network I/O.
+
+Usage:
+    python scripts/check_import_time.py [--budget 1.0] [--runs 5] [--top 10]
+
+Each run imports app.py in a fresh interpreter with dummy Supabase/Gemini
+credentials set (so an eager client would try to connect) and sockets patched
+to fail on connect. A run fails if the import opens a connection, pulls in one
+of the heavy client packages (supabase, google.generativeai, PIL), or the
+median import time exceeds the budget. The modules with the most self time
+under `python -X importtime` are printed to show where the time goes. Exits 1
+on failure.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFERRED_MODULES = ('supabase', 'google.generativeai', 'PIL')
+
+CHILD = r'''
+import json, socket, sys, time
+attempts = []
+def _blocked(self, address, *args, **kwargs):
+    attempts.append(str(address))
+    raise OSError('network disabled during import check')
+socket.socket.connect = _blocked
+socket.socket.connect_ex = _blocked
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    'seconds': elapsed,
+    'connections': attempts,
+    'loaded': [m for m in %r if m in sys.modules],
+}))
+''' % (DEFERRED_MODULES,)
+
+
+def child_env():
+    env = dict(os.environ)
+    env.update({
+        'SUPABASE_URL': 'http://127.0.0.1:9',
+        'SUPABASE_KEY': 'import-check',
+        'GEMINI_API_KEY': 'import-check',
+        'TRIAGE_CACHE_DISK': '0',
+        'PYTHONDONTWRITEBYTECODE': '1',
+    })
+    return env
+
+
+def run_once():
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=child_env(),
+                         capture_output=True, text=True, timeout=120)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip()[-2000:])
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top):
+    """Parse `-X importtime` output into (self_us, module), slowest first."""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=child_env(),
+                         capture_output=True, text=True, timeout=120)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        try:
+            self_us = int(parts[0])
+        except ValueError:
+            continue  # header line
+        rows.append((self_us, parts[2].strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=float, default=1.0, help='maximum median import time in seconds')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list (0 to skip)')
+    args = parser.parse_args()
+
+    failures = []
+    timings = []
+    for _ in range(args.runs):
+        result = run_once()
+        timings.append(result['seconds'])
+        if result['connections']:
+            failures.append(f"import opened network connections: {result['connections']}")
+        if result['loaded']:
+            failures.append(f"import loaded deferred modules: {result['loaded']}")
+
+    median = statistics.median(timings)
+    print(f"import app: median {median * 1000:.0f} ms, min {min(timings) * 1000:.0f} ms, "
+          f"max {max(timings) * 1000:.0f} ms over {args.runs} run(s); budget {args.budget * 1000:.0f} ms")
+    if median > args.budget:
+        failures.append(f'median import time {median:.3f}s exceeds budget {args.budget:.3f}s')
+
+    if args.top:
+        print(f"\n{'self ms':>8}  module")
+        for self_us, name in slowest_imports(args.top):
+            print(f'{self_us / 1000:>8.1f}  {name}')
+
+    for failure in sorted(set(failures)):
+        print(f'[FAIL] {failure}')
+    if failures:
+        return 1
+    print('\n[OK] import is network-free and within budget')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Export patient records as NDJSON or CSV, optionally gzipped, with constant memory.
+
+Usage:
+    python scripts/export_records.py [--format ndjson|csv] [--gzip] [--filter RED|YELLOW|GREEN]
+                                     [--since 2025-01-01] [--until 2025-03-31] [--out FILE]
+                                     [--page-size 1000] [--local] [--fake N]
+
+Reads from Supabase page by page (keyset cursor on created_at, id), or from
+data/local_records.jsonl with --local or when SUPABASE_URL/SUPABASE_KEY are
+not set. Writes to stdout unless --out is given; progress goes to stderr.
+--fake N exports N generated rows from an in-memory Supabase, to check
+throughput and memory use without a database.
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import export  # noqa: E402
+from local_store import LocalRecordStore  # noqa: E402
+
+TRIAGE_FILTERS = {'RED': 'CRITICAL', 'YELLOW': 'URGENT', 'GREEN': 'STABLE'}
+
+
+def fake_client(rows):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from fakes import FakeSupabase
+    client = FakeSupabase()
+    levels = ('CRITICAL', 'URGENT', 'STABLE')
+    client.table('patient_records').insert([{
+        'id': f'00000000-0000-0000-0000-{i:012d}',
+        'patient_name': f'Patient {i}',
+        'age': i % 90,
+        'gender': 'F' if i % 2 else 'M',
+        'symptoms_text': 'fever, cough, "headache"',
+        'triage_level': levels[i % 3],
+        'confidence': 80,
+        'ai_diagnosis': 'Viral fever',
+        'created_at': f'2025-{1 + i % 12:02d}-{1 + i % 28:02d}T00:00:{i % 60:02d}.{i % 1000000:06d}',
+    } for i in range(rows)]).execute()
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', choices=sorted(export.FORMATS), default='ndjson')
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--filter', choices=sorted(TRIAGE_FILTERS), default=None)
+    parser.add_argument('--since', default=None, help='date or ISO timestamp (inclusive)')
+    parser.add_argument('--until', default=None, help='date (whole day) or ISO timestamp (inclusive)')
+    parser.add_argument('--out', default=None, help='output file (default: stdout)')
+    parser.add_argument('--page-size', type=int, default=export.EXPORT_PAGE_SIZE)
+    parser.add_argument('--records', default=os.path.join(ROOT, 'data', 'local_records.jsonl'))
+    parser.add_argument('--local', action='store_true', help='read the local store even if Supabase is configured')
+    parser.add_argument('--fake', type=int, default=None, metavar='N', help='export N rows from an in-memory Supabase')
+    args = parser.parse_args()
+
+    load_dotenv()
+    since, until = export.normalize_range(args.since, args.until)
+    triage_level = TRIAGE_FILTERS.get(args.filter) if args.filter else None
+    client = None
+    if args.fake is not None:
+        client = fake_client(args.fake)
+    elif not args.local and os.environ.get('SUPABASE_URL') and os.environ.get('SUPABASE_KEY'):
+        from supabase import create_client
+        client = create_client(os.environ['SUPABASE_URL'], os.environ['SUPABASE_KEY'])
+
+    if client:
+        rows = export.iter_supabase_rows(client, triage_level, since, until, page_size=args.page_size)
+        source = 'supabase (fake)' if args.fake is not None else 'supabase'
+    else:
+        rows = export.iter_local_rows(LocalRecordStore(args.records), triage_level, since, until)
+        source = args.records
+
+    counted = {'rows': 0}
+
+    def counting(rows):
+        for row in rows:
+            counted['rows'] += 1
+            yield row
+
+    out = open(args.out, 'wb') if args.out else sys.stdout.buffer
+    started = time.perf_counter()
+    written = 0
+    try:
+        for chunk in export.encode(counting(rows), args.format, args.gzip):
+            out.write(chunk)
+            written += len(chunk)
+    finally:
+        if args.out:
+            out.close()
+        else:
+            out.flush()
+    elapsed = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"[INFO] Exported {counted['rows']} rows from {source} ({written} bytes) in {elapsed:.2f}s, "
+          f"{counted['rows'] / elapsed if elapsed else 0:.0f} rows/s, peak RSS {peak_mb:.0f} MB", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,411 @@
+"""In-memory stand-ins for the Supabase client, for exercising the app offline.
+
+Only the parts of the supabase-py API that this repo uses are implemented.
+`AsyncFakeSupabase` wraps a `FakeSupabase` with the awaitable API of
+supabase's async client (for asgi.py); both see the same tables and objects.
+"""
+import asyncio
+import threading
+import time
+import uuid
+
+
+class FakeResponse:
+    def __init__(self, data=None, count=None):
+        self.data = data
+        self.count = count
+        self.error = None
+
+
+_OPS = {
+    'eq': lambda a, b: str(a) == b,
+    'lt': lambda a, b: a is not None and str(a) < b,
+    'lte': lambda a, b: a is not None and str(a) <= b,
+    'gt': lambda a, b: a is not None and str(a) > b,
+    'gte': lambda a, b: a is not None and str(a) >= b,
+    'is': lambda a, b: a is None if b == 'null' else str(a).lower() == b,
+}
+
+
+def _split_top_level(text):
+    parts, depth, quoted, current = [], 0, False, ''
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        elif not quoted and ch == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+            continue
+        current += ch
+    parts.append(current)
+    return parts
+
+
+def _parse_condition(text):
+    if text.startswith('and(') and text.endswith(')'):
+        preds = [_parse_condition(p) for p in _split_top_level(text[4:-1])]
+        return lambda r: all(p(r) for p in preds)
+    column, op, value = text.split('.', 2)
+    value = value.strip('"')
+    return lambda r: _OPS[op](r.get(column), value)
+
+
+def _parse_or(filters):
+    """Evaluate PostgREST `or=(...)` filter strings such as the dashboard's keyset cursor."""
+    preds = [_parse_condition(p) for p in _split_top_level(filters)]
+    return lambda r: any(p(r) for p in preds)
+
+
+class FakeQuery:
+    def __init__(self, table, op='select', payload=None, columns='*', count=None, head=False):
+        self._table = table
+        self._op = op
+        self._payload = payload
+        self._columns = columns
+        self._count = count
+        self._head = head
+        self._filters = []
+        self._order = []
+        self._limit = None
+        self._single = False
+        self._on_conflict = None
+
+    def eq(self, column, value):
+        self._filters.append(lambda r: str(r.get(column)) == str(value))
+        return self
+
+    def lt(self, column, value):
+        self._filters.append(lambda r: r.get(column) is not None and r.get(column) < value)
+        return self
+
+    def gte(self, column, value):
+        self._filters.append(lambda r: r.get(column) is not None and r.get(column) >= value)
+        return self
+
+    def lte(self, column, value):
+        self._filters.append(lambda r: r.get(column) is not None and r.get(column) <= value)
+        return self
+
+    def or_(self, filters):
+        predicate = _parse_or(filters)
+        self._filters.append(predicate)
+        return self
+
+    def order(self, column, desc=False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def _project(self, row):
+        if self._columns in (None, '*'):
+            return dict(row)
+        return {c: row.get(c) for c in self._columns.split(',')}
+
+    def execute(self):
+        self._table.maybe_delay()
+        return self._run()
+
+    def _run(self):
+        with self._table.lock:
+            if self._op == 'insert':
+                rows = self._payload if isinstance(self._payload, list) else [self._payload]
+                inserted = [self._table.insert(r) for r in rows]
+                return FakeResponse(inserted)
+            if self._op == 'upsert':
+                rows = self._payload if isinstance(self._payload, list) else [self._payload]
+                return FakeResponse([self._table.upsert(r) for r in rows])
+            if self._op == 'update':
+                matched = [r for r in self._table.rows.values() if all(f(r) for f in self._filters)]
+                for r in matched:
+                    r.update(self._payload)
+                return FakeResponse([dict(r) for r in matched])
+            rows = [r for r in self._table.rows.values() if all(f(r) for f in self._filters)]
+        for column, desc in reversed(self._order):
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column) or ''), reverse=desc)
+        count = len(rows) if self._count else None
+        if self._head:
+            return FakeResponse([], count=count)
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        data = [self._project(r) for r in rows]
+        if self._single:
+            return FakeResponse(data[0] if data else None, count=count)
+        return FakeResponse(data, count=count)
+
+
+class AsyncFakeQuery(FakeQuery):
+    async def execute(self):
+        self._table.calls += 1
+        if self._table.latency:
+            await asyncio.sleep(self._table.latency)
+        return self._run()
+
+
+class FakeTable:
+    def __init__(self, name, latency=0.0):
+        self.name = name
+        self.rows = {}
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.calls = 0
+
+    def maybe_delay(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def insert(self, row):
+        row = dict(row)
+        row.setdefault('id', str(uuid.uuid4()))
+        row.setdefault('created_at', time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()) + f'.{time.time_ns() % 10**6:06d}+00:00')
+        if row['id'] in self.rows:
+            raise Exception(f'duplicate key value violates unique constraint "{self.name}_pkey"')
+        self.rows[row['id']] = row
+        return dict(row)
+
+    def upsert(self, row):
+        row = dict(row)
+        existing = self.rows.get(row['id'], {})
+        existing.update(row)
+        self.rows[row['id']] = existing
+        return dict(existing)
+
+
+class _TableHandle:
+    def __init__(self, table, query_class=FakeQuery):
+        self._table = table
+        self._query = query_class
+
+    def select(self, columns='*', count=None, head=False):
+        return self._query(self._table, 'select', columns=columns, count=count, head=head)
+
+    def insert(self, payload):
+        return self._query(self._table, 'insert', payload)
+
+    def upsert(self, payload, on_conflict=None):
+        return self._query(self._table, 'upsert', payload)
+
+    def update(self, payload):
+        return self._query(self._table, 'update', payload)
+
+
+class FakeBucket:
+    def __init__(self, storage, name):
+        self._storage = storage
+        self._name = name
+
+    def upload(self, file=None, path=None, file_options=None):
+        if self._storage.latency:
+            time.sleep(self._storage.latency)
+        return self._store(file, path, file_options)
+
+    def _store(self, file, path, file_options):
+        data = file.read() if hasattr(file, 'read') else file
+        if isinstance(data, str):
+            with open(data, 'rb') as fh:
+                data = fh.read()
+        key = (self._name, path)
+        if key in self._storage.objects and str((file_options or {}).get('upsert')).lower() != 'true':
+            # What storage3 raises for an existing object without upsert.
+            raise Exception({'statusCode': 409, 'error': 'Duplicate', 'message': 'The resource already exists'})
+        self._storage.objects[key] = bytes(data)
+        return FakeResponse({'path': path})
+
+    def get_public_url(self, path):
+        return f'https://fake.supabase.local/storage/v1/object/public/{self._name}/{path}'
+
+
+class AsyncFakeBucket(FakeBucket):
+    async def upload(self, file=None, path=None, file_options=None):
+        if self._storage.latency:
+            await asyncio.sleep(self._storage.latency)
+        return self._store(file, path, file_options)
+
+    async def get_public_url(self, path):
+        return FakeBucket.get_public_url(self, path)
+
+
+class FakeStorage:
+    def __init__(self, latency=0.0):
+        self.objects = {}
+        self.latency = latency
+
+    def from_(self, bucket):
+        return FakeBucket(self, bucket)
+
+
+class FakeSupabase:
+    """Minimal stand-in for `supabase.Client` with optional per-call latency (seconds)."""
+
+    def __init__(self, db_latency=0.0, storage_latency=0.0):
+        self.tables = {}
+        self.db_latency = db_latency
+        self.storage = FakeStorage(storage_latency)
+
+    def table(self, name):
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name, self.db_latency)
+        return _TableHandle(self.tables[name])
+
+    def rpc(self, name, params=None):
+        raise Exception(f'function {name} does not exist')
+
+
+class _AsyncFakeStorage:
+    def __init__(self, storage):
+        self._storage = storage
+
+    def from_(self, bucket):
+        return AsyncFakeBucket(self._storage, bucket)
+
+
+class AsyncFakeSupabase:
+    """Awaitable view of ``fake`` (a `FakeSupabase`): ``execute()``, ``upload()`` and ``get_public_url()`` are coroutines."""
+
+    def __init__(self, fake):
+        self.fake = fake
+        self.storage = _AsyncFakeStorage(fake.storage)
+
+    def table(self, name):
+        self.fake.table(name)
+        return _TableHandle(self.fake.tables[name], AsyncFakeQuery)
+
+    def rpc(self, name, params=None):
+        raise Exception(f'function {name} does not exist')
+
+
+class FakeGenAIError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f'{code} {message}')
+        self.code = code
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeGenerateResponse:
+    def __init__(self, text, prompt_tokens=0):
+        self.text = text
+        self.usage_metadata = FakeUsage(prompt_tokens, max(1, len(text) // 4))
+
+
+class FakeModel:
+    """Stand-in for `genai.GenerativeModel` with configurable latency and error injection.
+
+    Latency is drawn from a log-normal distribution with the given median (seconds);
+    ``error_rate`` of calls raise a 429 or 503 error instead of answering.
+    """
+
+    def __init__(self, name, latency=0.0, latency_sigma=0.0, error_rate=0.0, rng=None):
+        import random
+        self.model_name = name
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _sample(self):
+        import math
+        with self._lock:
+            self.calls += 1
+            delay = self.latency * math.exp(self._rng.gauss(0, self.latency_sigma)) if self.latency else 0.0
+            fail = self._rng.random() < self.error_rate
+            code = self._rng.choice((429, 503))
+        return delay, fail, code
+
+    def generate_content(self, contents, **kwargs):
+        delay, fail, code = self._sample()
+        if delay:
+            time.sleep(delay)
+        return self._answer(contents, fail, code)
+
+    async def generate_content_async(self, contents, **kwargs):
+        delay, fail, code = self._sample()
+        if delay:
+            await asyncio.sleep(delay)
+        return self._answer(contents, fail, code)
+
+    def _answer(self, contents, fail, code):
+        import json
+        if fail:
+            raise FakeGenAIError(code, 'Resource exhausted (fake)' if code == 429 else 'Service unavailable (fake)')
+        prompt = contents if isinstance(contents, str) else ' '.join(p for p in contents if isinstance(p, str))
+        text = json.dumps({
+            'main_diagnosis': 'Possible Viral Fever (simulated)',
+            'confidence': 70,
+            'triage_level': 'URGENT',
+            'explanation': 'Recommendation: Monitor temperature and refer to the PHC if fever persists beyond 3 days.',
+        })
+        return FakeGenerateResponse(text, prompt_tokens=max(1, len(prompt) // 4))
+
+    def count_tokens(self, contents):
+        prompt = contents if isinstance(contents, str) else ' '.join(p for p in contents if isinstance(p, str))
+
+        class _Count:
+            total_tokens = max(1, len(prompt) // 4)
+        return _Count()
+
+
+class _FakeModelInfo:
+    def __init__(self, name):
+        self.name = name
+        self.supported_generation_methods = ['generateContent', 'countTokens']
+
+
+class FakeGenAI:
+    """Module-like stand-in for `google.generativeai`; install with `install_fake_genai()`."""
+
+    def __init__(self, latency=0.0, latency_sigma=0.0, error_rate=0.0, models=('models/gemini-2.5-flash',), seed=None):
+        import random
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.model_names = list(models)
+        self._rng = random.Random(seed)
+        self.models = []
+
+    def configure(self, api_key=None, **kwargs):
+        pass
+
+    def list_models(self):
+        return [_FakeModelInfo(n) for n in self.model_names]
+
+    def GenerativeModel(self, name, **kwargs):
+        model = FakeModel(name, self.latency, self.latency_sigma, self.error_rate, self._rng)
+        self.models.append(model)
+        return model
+
+
+def install_fake_genai(fake):
+    """Make `import google.generativeai` resolve to ``fake`` (call before importing app)."""
+    import sys
+    import types
+    google = sys.modules.get('google')
+    if google is None:
+        try:
+            import google  # noqa: F401  (namespace package from other google libs)
+            google = sys.modules['google']
+        except ImportError:
+            google = types.ModuleType('google')
+            google.__path__ = []
+            sys.modules['google'] = google
+    sys.modules['google.generativeai'] = fake
+    google.generativeai = fake
+    return fake
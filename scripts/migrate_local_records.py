@@ -0,0 +1,143 @@
+"""Validate, repair and optionally compact data/local_records.jsonl.
+
+Usage:
+    python scripts/migrate_local_records.py [--records data/local_records.jsonl] [--rewrite] [--keep-history]
+
+Files written before appends were locked and fsync'd may hold lines that two
+workers interleaved, or a torn last line from a crash. This script reports
+every line that is not a JSON object with an id, and how many superseded
+versions (e.g. PENDING lines) the file carries. The current store reads such a
+file as-is, skipping bad lines, so running it is optional.
+
+With --rewrite it takes the store's write lock, so running workers wait
+instead of appending mid-rewrite. It then writes a new file holding the latest
+version of each record (or every valid line with --keep-history), fsyncs it
+and atomically renames it into place. Rejected lines are saved to
+<records>.rejected, and the offline-sync high-water mark is reset so the next
+sync re-upserts from the start (upserts are idempotent). Workers notice the
+file changed and rebuild their index.
+"""
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from local_store import LocalRecordStore  # noqa: E402
+from sync_engine import SyncEngine  # noqa: E402
+
+
+def scan(path):
+    """Return (stats, latest_offsets, rejected_lines) for the file at ``path``."""
+    stats = {'lines': 0, 'valid': 0, 'invalid_json': 0, 'missing_id': 0, 'blank': 0, 'torn_tail': False,
+             'records': 0, 'superseded': 0, 'bytes': os.path.getsize(path)}
+    latest = {}
+    rejected = []
+    offset = 0
+    with open(path, 'rb') as fh:
+        for raw in fh:
+            line_offset = offset
+            offset += len(raw)
+            stats['lines'] += 1
+            if not raw.endswith(b'\n'):
+                stats['torn_tail'] = True
+            if not raw.strip():
+                stats['blank'] += 1
+                continue
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                stats['invalid_json'] += 1
+                rejected.append(raw)
+                continue
+            if not isinstance(record, dict) or record.get('id') in (None, ''):
+                stats['missing_id'] += 1
+                rejected.append(raw)
+                continue
+            stats['valid'] += 1
+            record_id = str(record['id'])
+            if record_id in latest:
+                stats['superseded'] += 1
+            latest[record_id] = line_offset
+    stats['records'] = len(latest)
+    return stats, latest, rejected
+
+
+def rewrite(path, keep_history, state_path):
+    store = LocalRecordStore(path)
+    tmp_path = f'{path}.rewrite'
+    # Hold the lock appends take, so no worker writes between our scan and the rename.
+    with store.write_lock():
+        # Re-scan under the lock: lines may have been appended since the report.
+        _, latest, rejected = scan(path)
+        keep = set(latest.values())
+        written = 0
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as out:
+            offset = 0
+            for raw in src:
+                line_offset = offset
+                offset += len(raw)
+                if not raw.strip():
+                    continue
+                if line_offset in keep or (keep_history and _is_record(raw)):
+                    out.write(raw if raw.endswith(b'\n') else raw + b'\n')
+                    written += 1
+            out.flush()
+            os.fsync(out.fileno())
+        if rejected:
+            with open(f'{path}.rejected', 'ab') as rej:
+                for raw in rejected:
+                    rej.write(raw.rstrip(b'\n') + b'\n')
+        os.replace(tmp_path, path)
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    if os.path.exists(state_path):
+        SyncEngine(None, path, state_path, None).save_offset(0)
+    return written, len(rejected)
+
+
+def _is_record(raw):
+    try:
+        record = json.loads(raw)
+    except ValueError:
+        return False
+    return isinstance(record, dict) and record.get('id') not in (None, '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', default=os.path.join(ROOT, 'data', 'local_records.jsonl'))
+    parser.add_argument('--state', default=os.path.join(ROOT, 'data', 'sync_state.json'),
+                        help='offline-sync state to reset after a rewrite')
+    parser.add_argument('--rewrite', action='store_true', help='compact the file and drop rejected lines')
+    parser.add_argument('--keep-history', action='store_true', help='with --rewrite, keep superseded versions')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.records):
+        print(f'[INFO] {args.records} does not exist; nothing to migrate')
+        return 0
+
+    stats, latest, rejected = scan(args.records)
+    print(json.dumps(stats, indent=2))
+    if stats['invalid_json'] or stats['missing_id']:
+        print(f"[WARN] {len(rejected)} line(s) are not records (interleaved or torn writes)")
+    if not args.rewrite:
+        if rejected or stats['torn_tail'] or stats['superseded']:
+            print('[INFO] Run with --rewrite to compact the file and move bad lines to .rejected')
+        return 0
+
+    if not (rejected or stats['torn_tail'] or (stats['superseded'] and not args.keep_history)):
+        print('[INFO] File is already clean; not rewriting')
+        return 0
+    written, rejected_count = rewrite(args.records, args.keep_history, args.state)
+    print(f'[INFO] Rewrote {args.records}: {written} line(s) kept, {rejected_count} rejected')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
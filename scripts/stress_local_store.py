@@ -0,0 +1,207 @@
+"""Stress the local record store with many concurrent writer processes.
+
+Usage:
+    python scripts/stress_local_store.py [--processes 8] [--threads 4] [--records 250] [--payload 6000]
+                                         [--batch 1] [--kill 0] [--no-fsync] [--legacy]
+                                         [--file /tmp/stress_local_records.jsonl]
+
+Each writer process runs several threads appending records through
+LocalRecordStore, the way gunicorn workers share data/local_records.jsonl.
+After an append returns, the writer logs the id to its own ack file. Each
+record carries a checksum of its contents. The payload defaults to more than
+one 4 KiB page, so unlocked writes can interleave.
+
+--kill N sends SIGKILL to N writers partway through, to simulate crashes.
+--legacy writes with the old unlocked open('a') append instead, for
+comparison.
+
+When the writers finish, the script repairs a torn tail as the next append
+would, then checks:
+* every line is a JSON record whose checksum matches (no corrupt lines)
+* every acknowledged id is present (nothing lost)
+* no id appears twice
+* a fresh store indexes exactly the ids in the file
+
+It reports records/s and how many records each fsync'd commit carried on
+average. Exits 1 if any check fails.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import signal
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from local_store import LocalRecordStore  # noqa: E402
+
+LEVELS = ('CRITICAL', 'URGENT', 'STABLE')
+
+
+def checksum(record):
+    body = {k: v for k, v in record.items() if k != 'check'}
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def make_record(proc, thread, seq, payload):
+    record = {
+        'id': f'p{proc}-t{thread}-{seq}',
+        'patient_name': f'Stress {proc}/{thread}/{seq}',
+        'age': (proc * 7 + seq) % 90,
+        'gender': 'F' if seq % 2 else 'M',
+        'symptoms_text': (f'{proc}:{thread}:{seq} ' * (payload // 12 + 1))[:payload],
+        'triage_level': LEVELS[seq % 3],
+        'created_at': f'2025-01-01T00:00:00.{proc:02d}{thread:02d}{seq:04d}',
+    }
+    record['check'] = checksum(record)
+    return record
+
+
+def legacy_append(path, records):
+    # What /analyze did before: text-mode append, no lock, no fsync.
+    with open(path, 'a', encoding='utf-8') as fh:
+        for record in records:
+            fh.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def writer(proc, args, start_event):
+    store = LocalRecordStore(args.file, fsync=not args.no_fsync)
+    ack_path = f'{args.file}.ack.{proc}'
+    ack_lock = threading.Lock()
+    ack = open(ack_path, 'a', encoding='utf-8', buffering=1)
+
+    def run(thread):
+        seq = 0
+        while seq < args.records:
+            batch = [make_record(proc, thread, seq + i, args.payload) for i in range(min(args.batch, args.records - seq))]
+            if args.legacy:
+                legacy_append(args.file, batch)
+            else:
+                store.append_many(batch)
+            with ack_lock:
+                ack.write(''.join(r['id'] + '\n' for r in batch))
+            seq += len(batch)
+
+    start_event.wait()
+    threads = [threading.Thread(target=run, args=(t,)) for t in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ack.close()
+    with open(f'{args.file}.stats.{proc}', 'w', encoding='utf-8') as fh:
+        json.dump(store.commit_stats, fh)
+
+
+def verify(args, procs):
+    acked = set()
+    for proc in range(procs):
+        path = f'{args.file}.ack.{proc}'
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as fh:
+                acked.update(line.strip() for line in fh if line.strip())
+
+    repaired = 0 if args.legacy else LocalRecordStore(args.file).repair()
+    seen = {}
+    corrupt = 0
+    lines = 0
+    with open(args.file, 'rb') as fh:
+        for raw in fh:
+            lines += 1
+            try:
+                record = json.loads(raw)
+                assert isinstance(record, dict) and record.get('check') == checksum(record)
+            except Exception:
+                corrupt += 1
+                continue
+            seen[record['id']] = seen.get(record['id'], 0) + 1
+
+    indexed = len(LocalRecordStore(args.file))
+    commits = {'commits': 0, 'records': 0}
+    for proc in range(procs):
+        path = f'{args.file}.stats.{proc}'
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as fh:
+                stats = json.load(fh)
+            commits['commits'] += stats.get('commits', 0)
+            commits['records'] += stats.get('records', 0)
+    return {
+        'lines': lines,
+        'records': len(seen),
+        'acknowledged': len(acked),
+        'lost': len(acked - set(seen)),
+        'corrupt_lines': corrupt,
+        'duplicates': sum(1 for n in seen.values() if n > 1),
+        'indexed': indexed,
+        'torn_bytes_repaired': repaired,
+        'records_per_commit': round(commits['records'] / commits['commits'], 2) if commits['commits'] else None,
+    }
+
+
+def cleanup(path, procs):
+    for suffix in [''] + [f'.ack.{p}' for p in range(procs)] + [f'.stats.{p}' for p in range(procs)] + ['.torn']:
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--records', type=int, default=250, help='records per thread')
+    parser.add_argument('--payload', type=int, default=6000, help='bytes of symptom text per record')
+    parser.add_argument('--batch', type=int, default=1, help='records per append call')
+    parser.add_argument('--kill', type=int, default=0, help='writer processes to SIGKILL mid-run')
+    parser.add_argument('--no-fsync', action='store_true')
+    parser.add_argument('--legacy', action='store_true', help='use the old unlocked append for comparison')
+    parser.add_argument('--file', default='/tmp/stress_local_records.jsonl')
+    parser.add_argument('--keep', action='store_true', help='keep the data file afterwards')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    cleanup(args.file, args.processes)
+    ctx = multiprocessing.get_context('spawn')
+    start_event = ctx.Event()
+    procs = [ctx.Process(target=writer, args=(p, args, start_event)) for p in range(args.processes)]
+    for p in procs:
+        p.start()
+    time.sleep(1.0)  # let the spawned interpreters import before starting the clock
+    started = time.perf_counter()
+    start_event.set()
+
+    if args.kill:
+        rng = random.Random(args.seed)
+        # Kill once roughly a third of the expected records are on disk.
+        target = args.processes * args.threads * args.records * (args.payload + 300) // 3
+        while time.perf_counter() - started < 60 and (not os.path.exists(args.file) or os.path.getsize(args.file) < target):
+            time.sleep(0.01)
+        for p in rng.sample(procs, min(args.kill, len(procs))):
+            os.kill(p.pid, signal.SIGKILL)
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+
+    report = verify(args, args.processes)
+    report['seconds'] = round(elapsed, 3)
+    report['records_per_sec'] = round(report['records'] / elapsed, 1) if elapsed else None
+    report['mode'] = 'legacy' if args.legacy else ('store' + ('' if args.no_fsync else '+fsync'))
+    print(json.dumps(report, indent=2))
+
+    ok = not report['lost'] and not report['corrupt_lines'] and not report['duplicates'] \
+        and report['indexed'] == report['records']
+    if not args.keep:
+        cleanup(args.file, args.processes)
+    print('[OK] no lost or corrupt records' if ok else '[FAIL] lost, corrupt or duplicated records')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Push offline records from data/local_records.jsonl into Supabase.
+
+Usage:
+    python scripts/sync_local_records.py [--batch-size 200] [--max-rows N] [--loop SECONDS]
+    python scripts/sync_local_records.py --fake   # dry run against an in-memory Supabase
+
+Progress is tracked in data/sync_state.json, so an interrupted run resumes
+where it stopped.
+"""
+import argparse
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sync_engine import SyncEngine  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--max-rows', type=int, default=None)
+    parser.add_argument('--loop', type=float, default=None, help='keep syncing every N seconds')
+    parser.add_argument('--records', default=os.path.join(ROOT, 'data', 'local_records.jsonl'))
+    parser.add_argument('--state', default=os.path.join(ROOT, 'data', 'sync_state.json'))
+    parser.add_argument('--fake', action='store_true', help='use an in-memory Supabase and a throwaway state file')
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.fake:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from fakes import FakeSupabase
+        client = FakeSupabase()
+        args.state = args.state + '.fake'
+    else:
+        url = os.environ.get('SUPABASE_URL')
+        key = os.environ.get('SUPABASE_KEY')
+        if not url or not key:
+            print('SUPABASE_URL and SUPABASE_KEY must be set')
+            return 1
+        from supabase import create_client
+        client = create_client(url, key)
+
+    engine = SyncEngine(client, args.records, args.state, os.path.join(ROOT, 'static', 'uploads'),
+                        batch_size=args.batch_size)
+    while True:
+        stats = engine.run_once(max_rows=args.max_rows)
+        print(f"rows={stats['rows']} batches={stats['batches']} files={stats['files']} "
+              f"seconds={stats['seconds']} rows/s={stats['rows_per_sec']} offset={stats['offset']}")
+        if args.fake:
+            print(f"fake patient_records now holds {len(client.tables['patient_records'].rows) if client.tables else 0} rows")
+        if not args.loop:
+            return 0
+        time.sleep(args.loop)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
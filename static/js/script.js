@@ -128,6 +128,10 @@ async function handleFormSubmit(e) {
         
         const result = await response.json();
         
+        if (result.success && result.status === 'PENDING') {
+            await waitForTriage(result.record_id);
+        }
+        
         clearInterval(messageInterval);
         
         if (result.success) {
@@ -144,4 +148,24 @@ async function handleFormSubmit(e) {
         progressModal.classList.remove('active');
         alert('Error submitting form: ' + error.message);
     }
-}
\ No newline at end of file
+}
+
+const STATUS_POLL_INTERVAL_MS = 1500;
+const STATUS_POLL_TIMEOUT_MS = 120000;
+
+async function waitForTriage(recordId) {
+    // /analyze returns as soon as the record is saved; poll until the diagnosis lands.
+    const deadline = Date.now() + STATUS_POLL_TIMEOUT_MS;
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, STATUS_POLL_INTERVAL_MS));
+        try {
+            const response = await fetch(`/analyze/status/${encodeURIComponent(recordId)}`);
+            const status = await response.json();
+            if (!status.success || status.status !== 'PENDING') {
+                return;
+            }
+        } catch (error) {
+            // Flaky connection: keep polling until the deadline.
+        }
+    }
+}
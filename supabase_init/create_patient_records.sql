@@ -21,3 +21,7 @@ CREATE TABLE IF NOT EXISTS public.patient_records (
 -- Optional: create a basic index for triage level and created_at
 CREATE INDEX IF NOT EXISTS idx_patient_records_triage_level ON public.patient_records (triage_level);
 CREATE INDEX IF NOT EXISTS idx_patient_records_created_at ON public.patient_records (created_at);
+
+-- Set when a triage worker claims a PENDING record, so a job recovered by another
+-- worker is not diagnosed twice. Safe to run on an existing table.
+ALTER TABLE public.patient_records ADD COLUMN IF NOT EXISTS claimed_at timestamptz;
@@ -0,0 +1,14 @@
+-- Run this in the Supabase SQL editor to let /dashboard count triage levels in the database.
+-- Without it the app falls back to one count query per triage level.
+
+CREATE OR REPLACE FUNCTION public.triage_counts()
+RETURNS TABLE (triage_level text, count bigint)
+LANGUAGE sql STABLE
+AS $$
+  SELECT triage_level, count(*) FROM public.patient_records GROUP BY triage_level;
+$$;
+
+-- Keyset pagination orders by (created_at DESC, id DESC); this index serves both the
+-- unfiltered listing and the per-triage filtered listing without a sort.
+CREATE INDEX IF NOT EXISTS idx_patient_records_triage_created_at
+  ON public.patient_records (triage_level, created_at DESC, id DESC);
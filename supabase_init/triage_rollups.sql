@@ -0,0 +1,25 @@
+-- Run this in the Supabase SQL editor so /dashboard can load all of its stats and charts
+-- with one grouped query. Age buckets must match age_bucket() in rollups.py exactly,
+-- including 'unknown' for missing and negative ages.
+
+CREATE OR REPLACE FUNCTION public.triage_rollups()
+RETURNS TABLE (triage_level text, day date, age_bucket text, gender text, count bigint)
+LANGUAGE sql STABLE
+AS $$
+  SELECT
+    triage_level,
+    created_at::date AS day,
+    CASE
+      WHEN age IS NULL OR age < 0 THEN 'unknown'
+      WHEN age <= 4 THEN '0-4'
+      WHEN age <= 14 THEN '5-14'
+      WHEN age <= 29 THEN '15-29'
+      WHEN age <= 44 THEN '30-44'
+      WHEN age <= 59 THEN '45-59'
+      ELSE '60+'
+    END AS age_bucket,
+    gender,
+    count(*)
+  FROM public.patient_records
+  GROUP BY 1, 2, 3, 4;
+$$;
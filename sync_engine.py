@@ -0,0 +1,191 @@
+"""Push records saved offline in data/local_records.jsonl up to Supabase.
+
+The engine streams the JSONL file from a durable high-water mark (a byte
+offset stored in data/sync_state.json), upserts rows into `patient_records`
+in batches keyed on `id`, and advances the mark only after a batch is
+committed, so an interrupted sync resumes where it stopped and re-sending a
+batch is harmless. Media saved to static/uploads while offline is uploaded to
+the `media` bucket and the record's URL rewritten to the public one.
+"""
+import json
+import mimetypes
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+
+# Columns of public.patient_records (supabase_init/create_patient_records.sql).
+RECORD_COLUMNS = (
+    'id', 'patient_name', 'age', 'gender', 'symptoms_text', 'image_file_url', 'voice_file_url',
+    'ai_diagnosis', 'confidence', 'triage_level', 'explanation', 'created_at',
+)
+MEDIA_COLUMNS = ('image_file_url', 'voice_file_url')
+LOCAL_UPLOADS_MARKER = '/static/uploads/'
+
+
+def _content_type(name):
+    """MIME type to store ``name`` under; storage3 defaults to text/plain, which browsers won't render."""
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if name.startswith('voice_') and content_type.startswith('video/'):
+        # Voice notes are recorded as webm/ogg, which mimetypes reports as video.
+        content_type = 'audio/' + content_type.split('/', 1)[1]
+    return content_type
+
+
+class SyncEngine:
+    def __init__(self, client, records_path, state_path, uploads_dir, batch_size=200,
+                 table='patient_records', bucket='media'):
+        self.client = client
+        self.records_path = records_path
+        self.state_path = state_path
+        self.uploads_dir = uploads_dir
+        self.batch_size = batch_size
+        self.table = table
+        self.bucket = bucket
+        self._lock = threading.Lock()
+
+    def load_offset(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as fh:
+                return int(json.load(fh).get('offset', 0))
+        except (OSError, ValueError):
+            return 0
+
+    def save_offset(self, offset):
+        """Persist the high-water mark atomically (write, fsync, rename)."""
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump({'offset': offset, 'updated_at': time.time()}, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def _acquire_file_lock(self):
+        """Keep gunicorn workers (and the CLI) from syncing at the same time. False if another holds it."""
+        if not fcntl:
+            return None
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        lock_fh = open(f'{self.state_path}.lock', 'w')
+        try:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_fh.close()
+            return False
+        return lock_fh
+
+    def _read_batches(self, offset):
+        """Yield (rows, end_offset) batches of complete lines starting at ``offset``."""
+        rows = {}
+        end = offset
+        with open(self.records_path, 'rb') as fh:
+            fh.seek(offset)
+            for raw in fh:
+                if not raw.endswith(b'\n'):
+                    break  # line still being written
+                end += len(raw)
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict) or not record.get('id'):
+                    continue
+                if record.get('triage_level') == 'PENDING':
+                    # The finished version is appended later and will be synced then.
+                    continue
+                # De-duplicate within a batch: an upsert may not touch the same row twice.
+                rows[str(record['id'])] = record
+                if len(rows) >= self.batch_size:
+                    yield list(rows.values()), end
+                    rows = {}
+        yield list(rows.values()), end
+
+    def _upload_local_media(self, url, stats):
+        if not url or LOCAL_UPLOADS_MARKER not in url:
+            return url
+        file_name = url.split(LOCAL_UPLOADS_MARKER, 1)[1].split('?')[0]
+        local_path = os.path.join(self.uploads_dir, file_name)
+        if not os.path.exists(local_path):
+            return url
+        storage = self.client.storage.from_(self.bucket)
+        names = [file_name]
+        thumb = f'thumb_{file_name}'
+        if os.path.exists(os.path.join(self.uploads_dir, thumb)):
+            names.append(thumb)
+        for name in names:
+            with open(os.path.join(self.uploads_dir, name), 'rb') as fh:
+                storage.upload(file=fh.read(), path=name,
+                               file_options={'upsert': 'true', 'content-type': _content_type(name)})
+            stats['files'] += 1
+        return storage.get_public_url(file_name)
+
+    def _prepare(self, record, stats):
+        row = {k: record.get(k) for k in RECORD_COLUMNS if k in record}
+        for column in MEDIA_COLUMNS:
+            try:
+                row[column] = self._upload_local_media(row.get(column), stats)
+            except Exception as e:
+                print(f"[WARN] Could not upload {row.get(column)} for record {row.get('id')}: {e}")
+        return row
+
+    def run_once(self, max_rows=None):
+        """Sync everything after the high-water mark. Returns throughput stats."""
+        stats = {'rows': 0, 'batches': 0, 'files': 0, 'seconds': 0.0, 'rows_per_sec': 0.0, 'offset': 0}
+        if not self._lock.acquire(blocking=False):
+            return stats
+        lock_fh = self._acquire_file_lock()
+        if lock_fh is False:
+            self._lock.release()
+            return stats
+        started = time.perf_counter()
+        try:
+            offset = self.load_offset()
+            if not os.path.exists(self.records_path):
+                return stats
+            if os.path.getsize(self.records_path) < offset:
+                print("[WARN] Local records file shrank; re-syncing from the start")
+                offset = 0
+            for records, end in self._read_batches(offset):
+                if records:
+                    rows = [self._prepare(r, stats) for r in records]
+                    self.client.table(self.table).upsert(rows, on_conflict='id').execute()
+                    stats['rows'] += len(rows)
+                    stats['batches'] += 1
+                if end != offset:
+                    self.save_offset(end)
+                    offset = end
+                if max_rows and stats['rows'] >= max_rows:
+                    break
+            stats['offset'] = offset
+        finally:
+            if lock_fh:
+                lock_fh.close()
+            self._lock.release()
+            elapsed = time.perf_counter() - started
+            stats['seconds'] = round(elapsed, 3)
+            if elapsed > 0:
+                stats['rows_per_sec'] = round(stats['rows'] / elapsed, 1)
+        if stats['rows']:
+            print(f"[INFO] Synced {stats['rows']} local record(s) in {stats['batches']} batch(es), "
+                  f"{stats['files']} file(s), {stats['rows_per_sec']} rows/s")
+        return stats
+
+
+def start_background_sync(engine, interval):
+    """Run ``engine.run_once`` every ``interval`` seconds on a daemon thread."""
+    def loop():
+        while True:
+            try:
+                engine.run_once()
+            except Exception as e:
+                print(f"[WARN] Background sync failed, will retry: {e}")
+            time.sleep(interval)
+
+    t = threading.Thread(target=loop, name='local-record-sync', daemon=True)
+    t.start()
+    return t
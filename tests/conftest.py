@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+
+# Keep the app offline: no Supabase credentials, no disk cache, no background start-up.
+os.environ.pop('SUPABASE_URL', None)
+os.environ.pop('SUPABASE_KEY', None)
+os.environ.setdefault('GEMINI_API_KEY', 'fake-key')
+os.environ.update({'TRIAGE_CACHE_DISK': '0', 'WARMUP_ON_START': '0', 'TRIAGE_RECOVER_ON_START': '0',
+                   'LOCAL_STORE_FSYNC': '0'})
+
+
+@pytest.fixture
+def core(tmp_path, monkeypatch):
+    """The app module with its local record store moved to a temporary directory."""
+    import app as core
+    from local_store import LocalRecordStore
+    from rollups import RemoteRollups, TriageRollups
+
+    store = LocalRecordStore(str(tmp_path / 'local_records.jsonl'), fsync=False)
+    rollups = TriageRollups()
+    store.subscribe(rollups)
+    monkeypatch.setattr(core, 'local_store', store)
+    monkeypatch.setattr(core, 'local_rollups', rollups)
+    monkeypatch.setattr(core, 'remote_rollups', RemoteRollups(ttl=300))
+    monkeypatch.setattr(core, 'supabase', None)
+    monkeypatch.setattr(core, '_supabase_ready', True)
+    monkeypatch.setattr(core, '_background_started', True)
+    return core
+
+
+@pytest.fixture
+def client(core):
+    return core.app.test_client()
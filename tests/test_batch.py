@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from gemini_client import RateLimitExceeded
+from triage_queue import TriageQueue
+
+DIAGNOSIS = {'main_diagnosis': 'Viral fever', 'confidence': 80, 'triage_level': 'STABLE',
+             'explanation': 'Recommendation: rest and fluids.'}
+
+
+@pytest.fixture
+def batch(core, monkeypatch):
+    """/analyze/batch with a scripted model: patients named 'slow' time out, 'throttled' are not assessed."""
+    release = threading.Event()
+
+    def diagnose(symptoms_text, image_url, patient_info, *args, **kwargs):
+        assert kwargs.get('raise_unassessed')
+        if patient_info['patient_name'] == 'throttled':
+            raise RateLimitExceeded('Gemini request rate limit reached')
+        if patient_info['patient_name'] == 'slow':
+            release.wait(5)
+        return dict(DIAGNOSIS)
+
+    submitted = []
+    monkeypatch.setattr(core, 'get_ai_diagnosis_from_api', diagnose)
+    monkeypatch.setattr(core, 'BATCH_DEADLINE', 0.5)
+    monkeypatch.setattr(core, 'triage_queue', TriageQueue(lambda job_id, job: submitted.append((job_id, job))))
+    yield core, submitted
+    release.set()
+    core.triage_queue.join()
+
+
+def _post(client, names):
+    return client.post('/analyze/batch', json={'patients': [
+        {'patient_name': name, 'age': 30, 'symptoms_text': 'fever'} for name in names]})
+
+
+def test_unassessed_entries_are_saved_pending_and_queued(batch, client, monkeypatch):
+    core, submitted = batch
+    monkeypatch.setattr(core, 'TRIAGE_ASYNC', True)
+    response = _post(client, ['ok', 'slow', 'throttled'])
+    body = response.get_json()
+
+    assert response.status_code == 207
+    assert [r['status'] for r in body['results']] == ['COMPLETE', 'TIMED_OUT', 'AI_FAILED']
+    assert [r['triage_level'] for r in body['results']] == ['STABLE', 'PENDING', 'PENDING']
+    assert (body['saved'], body['complete'], body['queued'], body['failed']) == (3, 1, 2, 2)
+    for result in body['results'][1:]:
+        assert core.local_store.get(result['record_id'])['triage_level'] == 'PENDING'
+
+    core.triage_queue.join()
+    assert sorted(job_id for job_id, _ in submitted) == sorted(r['record_id'] for r in body['results'][1:])
+    assert all(job['local'] and job['symptoms_text'] == 'fever' for _, job in submitted)
+
+
+def test_unassessed_entries_are_urgent_without_the_queue(batch, client, monkeypatch):
+    core, submitted = batch
+    monkeypatch.setattr(core, 'TRIAGE_ASYNC', False)
+    body = _post(client, ['slow', 'throttled']).get_json()
+
+    assert [r['status'] for r in body['results']] == ['TIMED_OUT', 'AI_FAILED']
+    assert [r['triage_level'] for r in body['results']] == ['URGENT', 'URGENT']
+    assert body['queued'] == 0 and body['failed'] == 2
+    assert not submitted
+
+
+def test_all_complete_is_200(batch, client):
+    response = _post(client, ['ok', 'ok'])
+    assert response.status_code == 200
+    assert response.get_json()['failed'] == 0
+
+
+def test_batch_accepts_more_than_one_patients_upload_limit(batch, client, monkeypatch):
+    core, _ = batch
+    monkeypatch.setitem(core.app.config, 'MAX_CONTENT_LENGTH', 2000)
+    names = ['ok'] * 40
+    assert _post(client, names).status_code == 200
+    assert client.post('/analyze', data={'patient_name': 'x' * 4000}).status_code == 413
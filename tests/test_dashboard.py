@@ -0,0 +1,64 @@
+import pytest
+
+from fakes import FakeSupabase
+
+RECORD_ID = '0b6f4b1e-9a43-4c55-b3c1-2f7a4f9d8e10'
+
+
+@pytest.mark.parametrize('query', [
+    {'before': '2025-01-01T00:00:00")', 'before_id': RECORD_ID},
+    {'before': '2025-01-01T00:00:00', 'before_id': f'{RECORD_ID}),triage_level.neq.x'},
+    {'before': 'yesterday'},
+    {'before_id': RECORD_ID},
+])
+def test_dashboard_rejects_malformed_cursor(core, client, monkeypatch, query):
+    fake = FakeSupabase()
+    monkeypatch.setattr(core, 'supabase', fake)
+    response = client.get('/dashboard', query_string=query)
+    assert response.status_code == 400
+    assert 'patient_records' not in fake.tables
+
+
+def test_dashboard_accepts_valid_cursor(core, client, monkeypatch):
+    fake = FakeSupabase()
+    fake.table('patient_records').insert([
+        {'id': RECORD_ID, 'patient_name': 'Older', 'triage_level': 'STABLE', 'created_at': '2025-01-01T00:00:00'},
+        {'id': 'ffffffff-0000-4000-8000-000000000000', 'patient_name': 'Newer', 'triage_level': 'STABLE',
+         'created_at': '2025-01-02T00:00:00'},
+    ]).execute()
+    monkeypatch.setattr(core, 'supabase', fake)
+    response = client.get('/dashboard', query_string={'before': '2025-01-02T00:00:00',
+                                                      'before_id': 'ffffffff-0000-4000-8000-000000000000'})
+    assert response.status_code == 200
+    assert b'Older' in response.data and b'Newer' not in response.data
+
+
+class NoRollupsSupabase(FakeSupabase):
+    """A database without the optional triage_rollups()/triage_counts() functions installed."""
+
+    rpc_calls = 0
+
+    def rpc(self, name, params=None):
+        self.rpc_calls += 1
+        return super().rpc(name, params)
+
+
+def test_missing_rollups_function_costs_one_query_set_per_ttl(core, client, monkeypatch):
+    fake = NoRollupsSupabase()
+    fake.table('patient_records').insert([
+        {'id': RECORD_ID, 'patient_name': 'A', 'triage_level': 'URGENT', 'created_at': '2025-01-01T00:00:00'},
+        {'id': 'ffffffff-0000-4000-8000-000000000000', 'patient_name': 'B', 'triage_level': 'PENDING',
+         'created_at': '2025-01-02T00:00:00'},
+    ]).execute()
+    monkeypatch.setattr(core, 'supabase', fake)
+
+    stats = core._dashboard_stats()
+    assert (stats['total'], stats['urgent'], stats['stable']) == (2, 1, 0)
+    assert 'by_age' not in stats
+    rpc_calls, table_calls = fake.rpc_calls, fake.tables['patient_records'].calls
+
+    assert client.get('/dashboard').status_code == 200
+    assert core._dashboard_stats()['urgent'] == 1
+    assert fake.rpc_calls == rpc_calls
+    # Only the dashboard page query ran; no more count queries.
+    assert fake.tables['patient_records'].calls == table_calls + 1
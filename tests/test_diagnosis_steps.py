@@ -0,0 +1,89 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from caching import TriageCache
+from gemini_client import RateLimitExceeded
+
+REPLY = {'main_diagnosis': 'Viral fever', 'confidence': 80, 'triage_level': 'STABLE', 'explanation': 'Rest.'}
+
+
+class Registry:
+    def get(self):
+        return 'models/fake', object()
+
+    def report_success(self, name):
+        pass
+
+    def report_failure(self, name, error):
+        return False
+
+
+class Gemini:
+    """Fails any request carrying an image with ``vision_error``; answers text-only ones with REPLY."""
+
+    def __init__(self, vision_error=None):
+        self.vision_error = vision_error
+        self.calls = []
+
+    def generate(self, model, contents, deadline=None, generation_config=None):
+        self.calls.append('vision' if isinstance(contents, list) else 'text')
+        if isinstance(contents, list) and self.vision_error:
+            raise self.vision_error
+        return SimpleNamespace(text=json.dumps(REPLY), usage_metadata=None)
+
+    async def generate_async(self, *args, **kwargs):
+        return self.generate(*args, **kwargs)
+
+
+@pytest.fixture
+def gemini(core, monkeypatch):
+    monkeypatch.setattr(core, 'get_model_registry', lambda: Registry())
+    monkeypatch.setattr(core, 'GEMINI_API_KEY', 'fake-key')
+    monkeypatch.setattr(core, 'triage_cache', TriageCache())
+
+    def install(**kwargs):
+        monkeypatch.setattr(core, 'gemini_client', Gemini(**kwargs))
+        return core.gemini_client
+    return install
+
+
+def _diagnose(core, driver, **kwargs):
+    args = ('fever and cough', None, {'patient_age': 30}, b'jpeg-bytes', 'image/jpeg')
+    if driver == 'sync':
+        return core.get_ai_diagnosis_from_api(*args, **kwargs)
+    asgi = pytest.importorskip('asgi')
+    return asyncio.run(asgi.get_ai_diagnosis(*args, **kwargs))
+
+
+@pytest.mark.parametrize('driver', ['sync', 'async'])
+def test_vision_failure_falls_back_to_text_only_and_is_not_cached(core, gemini, driver):
+    client = gemini(vision_error=ValueError('image rejected'))
+    assert _diagnose(core, driver) == REPLY
+    assert client.calls == ['vision', 'text']
+    # The text-only answer was not made from the image, so a resubmission asks again.
+    assert _diagnose(core, driver) == REPLY
+    assert client.calls == ['vision', 'text', 'vision', 'text']
+
+
+@pytest.mark.parametrize('driver', ['sync', 'async'])
+def test_parsed_result_is_cached(core, gemini, driver):
+    client = gemini()
+    assert _diagnose(core, driver) == REPLY
+    assert _diagnose(core, driver) == REPLY
+    assert client.calls == ['vision']
+
+
+@pytest.mark.parametrize('driver', ['sync', 'async'])
+def test_throttled_call_is_not_retried_text_only(core, gemini, driver):
+    client = gemini(vision_error=RateLimitExceeded('Gemini request rate limit reached'))
+    assert _diagnose(core, driver)['triage_level'] == 'URGENT'
+    assert client.calls == ['vision']
+
+
+def test_throttled_call_is_raised_for_the_queue_to_retry(core, gemini):
+    gemini(vision_error=RateLimitExceeded('Gemini request rate limit reached'))
+    with pytest.raises(RateLimitExceeded):
+        _diagnose(core, 'sync', raise_unassessed=True)
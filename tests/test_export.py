@@ -0,0 +1,28 @@
+import json
+
+
+def _save(core, i, level='STABLE'):
+    core.local_store.append({'id': f'rec-{i}', 'patient_name': f'P{i}', 'triage_level': level,
+                             'created_at': f'2026-01-01T00:00:0{i}+00:00'})
+
+
+def test_export_is_disabled_without_a_token(core, client, monkeypatch):
+    monkeypatch.setattr(core, 'EXPORT_TOKEN', None)
+    assert client.get('/export').status_code == 404
+
+
+def test_export_rejects_a_missing_or_wrong_token(core, client, monkeypatch):
+    monkeypatch.setattr(core, 'EXPORT_TOKEN', 's3cret')
+    assert client.get('/export').status_code == 401
+    assert client.get('/export', headers={'X-Export-Token': 'nope'}).status_code == 401
+    assert client.get('/export?token=s3cret').status_code == 401
+
+
+def test_export_streams_records_with_the_token(core, client, monkeypatch):
+    monkeypatch.setattr(core, 'EXPORT_TOKEN', 's3cret')
+    for i in range(3):
+        _save(core, i, level='URGENT' if i == 1 else 'STABLE')
+    response = client.get('/export?filter=YELLOW', headers={'X-Export-Token': 's3cret'})
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [r['id'] for r in rows] == ['rec-1']
@@ -0,0 +1,140 @@
+import random
+
+import pytest
+
+from fakes import FakeGenAIError, FakeModel
+from gemini_client import (CircuitBreaker, CircuitOpenError, DeadlineExceeded, GeminiClient, RateLimitExceeded,
+                           RetriesExhausted, TokenBucket)
+
+
+class Clock:
+    """Fake monotonic clock; ``sleep`` advances it instead of blocking."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _client(clock, **kwargs):
+    kwargs.setdefault('requests_per_minute', None)
+    kwargs.setdefault('breaker', CircuitBreaker(failure_threshold=kwargs.pop('threshold', 5), reset_timeout=30,
+                                                clock=clock))
+    return GeminiClient(clock=clock, sleep=clock.sleep, rng=random.Random(0), **kwargs)
+
+
+def _failing_model(error_rate=1.0):
+    return FakeModel('models/fake', error_rate=error_rate, rng=random.Random(1))
+
+
+def test_retries_429_and_5xx_then_succeeds():
+    clock = Clock()
+    model = _failing_model()
+    client = _client(clock, base_delay=1.0)
+    # Upstream recovers while the client backs off.
+    client._sleep = lambda s: (clock.sleep(s), setattr(model, 'error_rate', 0.0 if len(clock.sleeps) >= 2 else 1.0))
+
+    response = client.generate(model, 'fever')
+    assert 'triage_level' in response.text
+    assert model.calls == 3
+    assert client.stats()['retries'] == 2
+    assert all(0.5 <= s <= 2.0 for s in clock.sleeps)  # equal-jitter backoff around 1s, 2s
+
+
+def test_retries_exhausted_after_max_retries():
+    clock = Clock()
+    model = _failing_model()
+    client = _client(clock, max_retries=2)
+    with pytest.raises(RetriesExhausted) as info:
+        client.generate(model, 'fever')
+    assert isinstance(info.value.__cause__, FakeGenAIError)
+    assert model.calls == 3
+
+
+def test_open_breaker_fails_fast_without_calling_model():
+    clock = Clock()
+    model = _failing_model()
+    client = _client(clock, threshold=2, max_retries=5)
+    with pytest.raises(RetriesExhausted):
+        client.generate(model, 'fever')
+    assert client.breaker.state == CircuitBreaker.OPEN
+    calls = model.calls
+
+    with pytest.raises(CircuitOpenError):
+        client.generate(model, 'fever')
+    assert model.calls == calls
+    assert client.stats()['rejected_open'] == 1
+
+
+def _half_open(clock, client, model):
+    with pytest.raises(RetriesExhausted):
+        client.generate(model, 'fever')
+    clock.now += 31
+    assert client.breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_half_open_probe_success_closes_breaker():
+    clock = Clock()
+    model = _failing_model()
+    client = _client(clock, threshold=1, max_retries=0)
+    _half_open(clock, client, model)
+    model.error_rate = 0.0
+    client.generate(model, 'fever')
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_probe_released_after_non_retryable_error():
+    clock = Clock()
+    client = _client(clock, threshold=1, max_retries=0)
+    _half_open(clock, client, _failing_model())
+
+    class BadRequest:
+        def generate_content(self, contents, **kwargs):
+            raise ValueError('400 invalid argument')
+
+    with pytest.raises(ValueError):
+        client.generate(BadRequest(), 'fever')
+    # Upstream answered, so the breaker closes and later calls go through.
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    assert client.generate(_failing_model(0.0), 'fever')
+
+
+def test_half_open_probe_released_after_local_deadline():
+    clock = Clock()
+    client = _client(clock, threshold=1, max_retries=0)
+    _half_open(clock, client, _failing_model())
+
+    with pytest.raises(DeadlineExceeded):
+        client.generate(_failing_model(0.0), 'fever', deadline=0)
+    # No upstream verdict: still half-open, but the next call may probe again.
+    assert client.breaker.state == CircuitBreaker.HALF_OPEN
+    assert client.generate(_failing_model(0.0), 'fever')
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_rpm_throttle_waits_when_it_fits_the_deadline():
+    clock = Clock()
+    client = _client(clock, requests_per_minute=60)
+    client.request_bucket = TokenBucket(60, capacity=1, clock=clock, sleep=clock.sleep)
+    model = _failing_model(0.0)
+    client.generate(model, 'fever')
+    client.generate(model, 'fever', deadline=5)
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_rpm_throttle_raises_before_deadline_when_it_cannot_fit():
+    clock = Clock()
+    client = _client(clock, requests_per_minute=1)
+    model = _failing_model(0.0)
+    client.generate(model, 'fever')
+    with pytest.raises(RateLimitExceeded):
+        client.generate(model, 'fever', deadline=5)
+    assert clock.now == 0.0  # gave up immediately rather than sleeping into the deadline
+    assert model.calls == 1
+    assert client.stats()['throttled'] == 1
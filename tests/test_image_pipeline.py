@@ -0,0 +1,44 @@
+import io
+
+import pytest
+from PIL import Image
+
+from image_pipeline import preprocess_image
+
+
+def _png(size, mode='RGB'):
+    buf = io.BytesIO()
+    Image.new(mode, size).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def test_downscales_a_large_image_to_max_edge():
+    result = preprocess_image(_png((4000, 2000)), max_edge=400)
+    img = Image.open(io.BytesIO(result['data']))
+    assert img.size == (400, 200)
+    assert img.mode == 'RGB'
+
+
+def test_rejects_images_over_the_pixel_limit_before_decoding():
+    assert preprocess_image(_png((3000, 3000)), max_pixels=4_000_000) is None
+
+
+def test_decompression_bomb_warning_is_an_error(monkeypatch):
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1_000_000)
+    assert preprocess_image(_png((1200, 1000)), max_pixels=10_000_000) is None
+
+
+def test_keeps_exif_orientation_after_reducing():
+    img = Image.new('RGB', (4000, 2000))
+    exif = img.getexif()
+    exif[0x0112] = 6  # rotate 90° clockwise
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', exif=exif.tobytes())
+    result = preprocess_image(buf.getvalue(), max_edge=400)
+    assert Image.open(io.BytesIO(result['data'])).size == (200, 400)
+
+
+@pytest.mark.parametrize('mode', ['P', 'RGBA', 'L'])
+def test_reduces_every_mode_to_rgb(mode):
+    result = preprocess_image(_png((2000, 1000), mode=mode), max_edge=400)
+    assert Image.open(io.BytesIO(result['data'])).size == (400, 200)
@@ -0,0 +1,10 @@
+import check_import_time
+
+BUDGET = 1.0  # same default as `scripts/check_import_time.py --budget`
+
+
+def test_import_app_is_network_free_and_within_budget():
+    result = check_import_time.run_once()
+    assert result['connections'] == []
+    assert result['loaded'] == []
+    assert result['seconds'] < BUDGET
@@ -0,0 +1,57 @@
+from local_store import LocalRecordStore
+
+
+def _all_pages(page, page_size):
+    seen, cursor = [], {}
+    while True:
+        records, cursor = page(page_size=page_size, **cursor)
+        seen.extend(records)
+        if not cursor:
+            return seen
+
+
+def test_page_orders_by_created_at_when_an_update_arrives_late(tmp_path):
+    store = LocalRecordStore(str(tmp_path / 'records.jsonl'), fsync=False)
+    store.append({'id': 'a', 'triage_level': 'PENDING', 'created_at': '2025-01-01T10:00:00'})
+    store.append({'id': 'b', 'triage_level': 'STABLE', 'created_at': '2025-01-01T11:00:00'})
+    store.append({'id': 'c', 'triage_level': 'STABLE', 'created_at': '2025-01-01T11:00:00'})
+    store.append({'id': 'd', 'triage_level': 'URGENT', 'created_at': '2025-01-01T12:00:00'})
+    # The diagnosis for "a" lands after the newer inserts, so its latest line is at the tail.
+    store.append({'id': 'a', 'triage_level': 'CRITICAL', 'created_at': '2025-01-01T10:00:00'})
+
+    first = store.page(limit=2)
+    assert [r['id'] for r in first] == ['d', 'c']
+    rest = store.page(before=first[-1]['created_at'], before_id=first[-1]['id'], limit=10)
+    assert [r['id'] for r in rest] == ['b', 'a']
+    assert rest[-1]['triage_level'] == 'CRITICAL'
+
+
+def test_local_dashboard_pages_cover_every_record_once(core):
+    for i in range(7):
+        core.local_store.append({'id': f'r{i}', 'triage_level': 'PENDING', 'created_at': f'2025-01-01T0{i}:00:00'})
+    for i in (1, 4):
+        core.local_store.append({'id': f'r{i}', 'triage_level': 'STABLE', 'created_at': f'2025-01-01T0{i}:00:00'})
+
+    records = _all_pages(core._local_dashboard_page, page_size=2)
+    assert [r['id'] for r in records] == ['r6', 'r5', 'r4', 'r3', 'r2', 'r1', 'r0']
+    assert [r['triage_level'] for r in records if r['id'] in ('r1', 'r4')] == ['STABLE', 'STABLE']
+
+
+def test_page_by_level_follows_updates_and_other_writers(tmp_path):
+    path = str(tmp_path / 'records.jsonl')
+    store = LocalRecordStore(path, fsync=False)
+    store.append({'id': 'a', 'triage_level': 'PENDING', 'created_at': '2025-01-01T10:00:00'})
+    store.append({'id': 'b', 'triage_level': 'PENDING', 'created_at': '2025-01-01T09:00:00'})
+    assert [r['id'] for r in store.page(triage_level='PENDING')] == ['a', 'b']
+
+    # Another worker finishes "b" and saves an older record; this store sees them on its next read.
+    other = LocalRecordStore(path, fsync=False)
+    other.append({'id': 'b', 'triage_level': 'URGENT', 'created_at': '2025-01-01T09:00:00'})
+    other.append({'id': 'c', 'triage_level': 'URGENT', 'created_at': '2025-01-01T08:00:00'})
+
+    assert [r['id'] for r in store.page(triage_level='PENDING')] == ['a']
+    assert [r['id'] for r in store.page(triage_level='URGENT')] == ['b', 'c']
+    assert [r['id'] for r in store.page()] == ['a', 'b', 'c']
+    assert [r['id'] for r in store.page(before='2025-01-01T09:00:00')] == ['c']
+    # A fresh store builds the same order from the file in one pass.
+    assert [r['id'] for r in LocalRecordStore(path).page(triage_level='URGENT')] == ['b', 'c']
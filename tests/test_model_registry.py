@@ -0,0 +1,55 @@
+from fakes import FakeGenAI
+from model_registry import ModelRegistry
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _registry(clock, models=('models/gemini-2.5-flash', 'models/gemini-2.0-flash'), **kwargs):
+    return ModelRegistry(FakeGenAI(models=models), clock=clock, **kwargs)
+
+
+def test_repeated_get_lists_models_once():
+    registry = _registry(Clock())
+    first = registry.get()
+    for _ in range(5):
+        assert registry.get() == first
+    assert first[0] == 'models/gemini-2.5-flash'
+    assert registry.list_calls == 1
+
+
+def test_relists_after_ttl():
+    clock = Clock()
+    registry = _registry(clock, ttl=60)
+    registry.get()
+    clock.now = 59
+    registry.get()
+    assert registry.list_calls == 1
+    clock.now = 61
+    registry.get()
+    assert registry.list_calls == 2
+
+
+def test_not_found_parks_model_and_fails_over():
+    clock = Clock()
+    registry = _registry(clock, failure_cooldown=300)
+    chosen, _ = registry.get()
+    assert registry.report_failure(chosen, Exception('404 models/gemini-2.5-flash is not found'))
+    assert registry.get()[0] == 'models/gemini-2.0-flash'
+    assert registry.list_calls == 2  # a not-found forces a re-list
+    assert registry.state()['failures'][chosen]['parked']
+
+    clock.now = 301
+    assert registry.get()[0] == chosen
+
+
+def test_other_errors_do_not_park():
+    registry = _registry(Clock())
+    chosen, _ = registry.get()
+    assert not registry.report_failure(chosen, Exception('503 unavailable'))
+    assert registry.get()[0] == chosen
@@ -0,0 +1,118 @@
+import json
+import os
+
+import pytest
+
+from fakes import FakeSupabase
+from sync_engine import SyncEngine
+
+
+def _record(i, **fields):
+    record = {'id': f'rec-{i:03d}', 'patient_name': f'Patient {i}', 'triage_level': 'STABLE',
+              'created_at': f'2026-01-01T00:00:{i:02d}+00:00'}
+    record.update(fields)
+    return record
+
+
+def _write(path, records):
+    with open(path, 'a', encoding='utf-8') as fh:
+        for record in records:
+            fh.write(json.dumps(record) + '\n')
+
+
+@pytest.fixture
+def paths(tmp_path):
+    uploads = tmp_path / 'uploads'
+    uploads.mkdir()
+    return {
+        'records_path': str(tmp_path / 'local_records.jsonl'),
+        'state_path': str(tmp_path / 'sync_state.json'),
+        'uploads_dir': str(uploads),
+    }
+
+
+def _engine(client, paths, batch_size=2):
+    return SyncEngine(client, batch_size=batch_size, **paths)
+
+
+def test_upserts_in_batches_and_advances_the_mark(paths):
+    fake = FakeSupabase()
+    _write(paths['records_path'], [_record(i) for i in range(5)])
+    engine = _engine(fake, paths)
+
+    stats = engine.run_once()
+    table = fake.tables['patient_records']
+    assert stats['rows'] == 5
+    assert stats['batches'] == 3
+    assert table.calls == 3
+    assert sorted(table.rows) == [f'rec-{i:03d}' for i in range(5)]
+    assert engine.load_offset() == os.path.getsize(paths['records_path'])
+
+    assert engine.run_once()['rows'] == 0
+    assert table.calls == 3
+
+
+def test_resumes_after_an_interrupted_batch(paths):
+    fake = FakeSupabase()
+    _write(paths['records_path'], [_record(i) for i in range(6)])
+
+    class Flaky:
+        storage = fake.storage
+        upserts = 0
+
+        def table(self, name):
+            Flaky.upserts += 1
+            if Flaky.upserts == 2:
+                raise ConnectionError('network dropped')
+            return fake.table(name)
+
+    with pytest.raises(ConnectionError):
+        _engine(Flaky(), paths).run_once()
+    table = fake.tables['patient_records']
+    assert sorted(table.rows) == ['rec-000', 'rec-001']
+    committed = _engine(fake, paths).load_offset()
+    assert 0 < committed < os.path.getsize(paths['records_path'])
+
+    stats = _engine(fake, paths).run_once()
+    # Only the batches after the high-water mark are re-sent.
+    assert stats['rows'] == 4
+    assert sorted(table.rows) == [f'rec-{i:03d}' for i in range(6)]
+
+
+def test_skips_pending_lines_and_syncs_the_finished_version(paths):
+    fake = FakeSupabase()
+    _write(paths['records_path'], [_record(1, triage_level='PENDING', ai_diagnosis='Pending')])
+    engine = _engine(fake, paths)
+
+    assert engine.run_once()['rows'] == 0
+    assert 'patient_records' not in fake.tables or not fake.tables['patient_records'].rows
+
+    _write(paths['records_path'], [_record(1, triage_level='URGENT', ai_diagnosis='Sepsis')])
+    assert engine.run_once()['rows'] == 1
+    row = fake.tables['patient_records'].rows['rec-001']
+    assert row['triage_level'] == 'URGENT'
+    assert row['ai_diagnosis'] == 'Sepsis'
+
+
+def test_uploads_local_media_and_rewrites_urls(paths):
+    fake = FakeSupabase()
+    uploads = paths['uploads_dir']
+    for name, data in (('img_1.jpg', b'jpeg'), ('thumb_img_1.jpg', b'thumb'), ('voice_1.webm', b'webm')):
+        with open(os.path.join(uploads, name), 'wb') as fh:
+            fh.write(data)
+    _write(paths['records_path'], [_record(
+        1,
+        image_file_url='http://localhost:5000/static/uploads/img_1.jpg',
+        voice_file_url='http://localhost:5000/static/uploads/voice_1.webm',
+    ), _record(2, image_file_url='https://cdn.example/elsewhere.jpg')])
+
+    stats = _engine(fake, paths).run_once()
+    assert stats['files'] == 3
+    assert fake.storage.objects[('media', 'img_1.jpg')] == b'jpeg'
+    assert fake.storage.objects[('media', 'thumb_img_1.jpg')] == b'thumb'
+    assert fake.storage.objects[('media', 'voice_1.webm')] == b'webm'
+
+    rows = fake.tables['patient_records'].rows
+    assert rows['rec-001']['image_file_url'] == 'https://fake.supabase.local/storage/v1/object/public/media/img_1.jpg'
+    assert rows['rec-001']['voice_file_url'] == 'https://fake.supabase.local/storage/v1/object/public/media/voice_1.webm'
+    assert rows['rec-002']['image_file_url'] == 'https://cdn.example/elsewhere.jpg'
@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from gemini_client import DeadlineExceeded, RateLimitExceeded, RetriesExhausted
+from triage_queue import DONE, RETRYING, RetryLater, TriageQueue
+
+
+class Registry:
+    def report_failure(self, name, error):
+        return False
+
+
+@pytest.mark.parametrize('error', [
+    RateLimitExceeded('Gemini request rate limit reached (quota 15/min)'),
+    RetriesExhausted('Gemini call failed after 3 retries: 429 quota exceeded'),
+    DeadlineExceeded('no time left for the Gemini call'),
+    Exception('429 Resource has been exhausted (e.g. check quota).'),
+])
+def test_unassessed_patient_is_never_stable(core, error):
+    result = core._failed_diagnosis({'registry': Registry(), 'chosen': 'models/fake'}, error)
+    assert result['triage_level'] == 'URGENT'
+    assert result['confidence'] == 0
+
+
+def _pending(core, record_id='rec-1'):
+    core.local_store.append({'id': record_id, 'triage_level': 'PENDING', 'created_at': '2026-01-01T00:00:00'})
+    return {'symptoms_text': 'fever', 'local': True}
+
+
+def test_throttled_job_stays_pending_and_is_retried_with_backoff(core, monkeypatch):
+    def throttled(*args, **kwargs):
+        assert kwargs.get('raise_unassessed')
+        raise RateLimitExceeded('Gemini request rate limit reached')
+
+    monkeypatch.setattr(core, 'get_ai_diagnosis_from_api', throttled)
+    monkeypatch.setattr(core, 'TRIAGE_RETRY_ATTEMPTS', 3)
+    job = _pending(core)
+
+    delays = []
+    for _ in range(2):
+        with pytest.raises(RetryLater) as info:
+            core._diagnose_job('rec-1', job)
+        delays.append(info.value.delay)
+        assert core.local_store.get('rec-1')['triage_level'] == 'PENDING'
+    assert delays == [core.TRIAGE_RETRY_DELAY, core.TRIAGE_RETRY_DELAY * 2]
+
+    # Out of attempts: saved for manual assessment, still never STABLE.
+    core._diagnose_job('rec-1', job)
+    record = core.local_store.get('rec-1')
+    assert record['triage_level'] == 'URGENT'
+    assert record['ai_diagnosis'] == core.NOT_ASSESSED_RESULT['main_diagnosis']
+
+
+def test_queue_resubmits_a_job_that_asks_to_retry():
+    done = threading.Event()
+    calls = []
+
+    def handler(job_id, payload):
+        calls.append(job_id)
+        if len(calls) == 1:
+            raise RetryLater(0.05, 'throttled')
+        done.set()
+
+    queue = TriageQueue(handler, workers=1)
+    try:
+        queue.submit('job-1', {})
+        for _ in range(100):
+            if queue.status('job-1') == RETRYING:
+                break
+            threading.Event().wait(0.005)
+        assert queue.status('job-1') == RETRYING
+        assert done.wait(2)
+        queue.join()
+        assert calls == ['job-1', 'job-1']
+        assert queue.status('job-1') == DONE
+    finally:
+        queue.stop()
@@ -0,0 +1,126 @@
+"""In-process queue that runs triage jobs on a bounded pool of worker threads.
+
+`/analyze` persists the record with a PENDING triage, submits a job here and
+returns straight away; a worker thread runs the diagnosis and writes the
+result back. The queue has a fixed depth so a burst of submissions is
+rejected (and the client told to retry) instead of piling up unbounded work.
+A handler that cannot finish a job yet (e.g. the AI service is throttled)
+raises `RetryLater` and the job is submitted again after the delay.
+"""
+import queue
+import threading
+from collections import OrderedDict
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit."""
+
+
+class RetryLater(Exception):
+    """Raised by a handler to have its job submitted again after ``delay`` seconds."""
+
+    def __init__(self, delay, reason=''):
+        super().__init__(reason)
+        self.delay = delay
+
+
+QUEUED = 'QUEUED'
+RUNNING = 'RUNNING'
+RETRYING = 'RETRYING'
+DONE = 'DONE'
+FAILED = 'FAILED'
+
+
+class TriageQueue:
+    def __init__(self, handler, workers=4, max_depth=100, history=1000):
+        self._handler = handler
+        self.workers = workers
+        self.max_depth = max_depth
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._threads = []
+        self._lock = threading.Lock()
+        # Recent job states, bounded so finished jobs do not accumulate forever.
+        self._status = OrderedDict()
+        self._history = history
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'triage-worker-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _set_status(self, job_id, state):
+        with self._lock:
+            self._status[job_id] = state
+            self._status.move_to_end(job_id)
+            while len(self._status) > self._history:
+                self._status.popitem(last=False)
+
+    def submit(self, job_id, payload):
+        """Queue ``payload`` for the handler. Raises QueueFull under backpressure."""
+        self.start()
+        try:
+            self._queue.put_nowait((job_id, payload))
+        except queue.Full:
+            raise QueueFull(f'Triage queue is full ({self.max_depth} jobs pending)')
+        self._set_status(job_id, QUEUED)
+
+    def retry_later(self, job_id, payload, delay):
+        """Submit ``payload`` again after ``delay`` seconds, waiting another ``delay`` while the queue is full."""
+        def resubmit():
+            try:
+                self.submit(job_id, payload)
+            except QueueFull:
+                self.retry_later(job_id, payload, delay)
+
+        self._set_status(job_id, RETRYING)
+        timer = threading.Timer(delay, resubmit)
+        timer.daemon = True
+        timer.start()
+
+    def has_capacity(self):
+        return self._queue.qsize() < self.max_depth
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def status(self, job_id):
+        with self._lock:
+            return self._status.get(job_id)
+
+    def _run(self):
+        while True:
+            job_id, payload = self._queue.get()
+            if job_id is None:
+                self._queue.task_done()
+                return
+            self._set_status(job_id, RUNNING)
+            try:
+                self._handler(job_id, payload)
+                self._set_status(job_id, DONE)
+            except RetryLater as e:
+                print(f"[WARN] Triage job {job_id} will be retried in {e.delay:.0f}s: {e}")
+                self.retry_later(job_id, payload, e.delay)
+            except Exception as e:
+                print(f"[ERROR] Triage job {job_id} failed: {e}")
+                self._set_status(job_id, FAILED)
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Block until every queued job has been processed."""
+        self._queue.join()
+
+    def stop(self):
+        with self._lock:
+            threads, self._threads = self._threads, []
+            self._started = False
+        for _ in threads:
+            self._queue.put((None, None))
+        for t in threads:
+            t.join()